@@ -2,10 +2,11 @@
 Module for parsing Active race results.
 """
 
+import copy
 import datetime
 import logging
 import re
-import requests
+import urllib.parse
 import warnings
 
 import lxml
@@ -13,6 +14,9 @@ from lxml import etree, html
 from lxml import html
 
 from .common import RaceResults
+from .fetch import FetchError, build_url
+from .pipeline import Pipeline
+from .scheduler import FetchScheduler
 
 logging.basicConfig()
 
@@ -27,9 +31,13 @@ class ActiveRR(RaceResults):
         output.
     states : list
         List of states in which to search. Default is ['NJ']
+    scheduler : rr.scheduler.FetchScheduler
+        Shared by the event and results page downloads of a run.
     """
+    provider = 'active'
+
     def __init__(self, date_range=None, membership_list=None,
-                 output_file=None, states=None, verbose='INFO'):
+                 output_file=None, states=None, verbose='INFO', **kwargs):
         """
         Parameters
         ----------
@@ -49,31 +57,74 @@ class ActiveRR(RaceResults):
                              start_date=date_range[0],
                              stop_date=date_range[1],
                              output_file=output_file)
+        self.base_url = 'http://results.active.com'
+        self.__dict__.update(**kwargs)
 
         # Need to remember the current URL.
         self.states = states
         self._downloaded_url = None
+        self.scheduler = None
 
     def compile_web_results(self):
         """
         Download the requested results and compile them.
         """
+        self.scheduler = FetchScheduler(self.fetcher, jobs=self.jobs)
+
+        # Search every state at once.
+        urls = []
         for state in self.states:
-            url = 'http://results.active.com/search'
             params = {'search[source]': 'event',
                       'search[query]': state,
                       'search[start_date]': self.start_date.strftime('%Y-%m-%d'),
                       'search[end_date]': self.stop_date.strftime('%Y-%m-%d')}
-            response = requests.get(url, params=params)
-    
-            # Go thru the list of events.  They are identified by DIV tags with
-            # "result-rows" class.
-            doc = html.document_fromstring(response.content)
-            results = doc.find_class('result-row')
-            for result in results:
-                self.process_event(result)
+            urls.append(build_url(self.base_url + '/search', params))
+        searches = {}
+        for url, response, error in self.scheduler.fetch_all(
+                urls, jobs=len(urls)):
+            if error is not None:
+                msg = '{0}, going on to next state...'.format(error)
+                self.logger.warning(msg)
+                continue
+            searches[url] = response
+
+        # Go thru the list of events.  They are identified by DIV tags with
+        # "result-rows" class.
+        events = []
+        for url in urls:
+            if url in searches:
+                doc = html.document_fromstring(searches.pop(url).content)
+                events.extend(doc.find_class('result-row'))
+
+        def fetch(event):
+            url = self.event_url(event)
+            try:
+                return event, self.scheduler.fetch(url)
+            except FetchError as error:
+                msg = '{0}, going on to next race...'.format(error)
+                self.logger.warning(msg)
+                return None
+
+        # Event pages from every state are fetched ahead of the event
+        # being processed.
+        pipeline = Pipeline(iter(events), queue_size=self.queue_size,
+                            stats=self.stage_stats)
+        pipeline.add_stage('fetch', fetch, workers=self.jobs)
+        for event, response in pipeline:
+            try:
+                self.process_event(event, response)
+            except FetchError as error:
+                msg = '{0}, going on to next race...'.format(error)
+                self.logger.warning(msg)
+
+    def event_url(self, event):
+        """
+        URL of an event's page, given its row in the search results.
+        """
+        link = event.cssselect('.result-title a[href]')[0].get('href')
+        return self.base_url + link
 
-    def process_event(self, event):
+    def process_event(self, event, response=None):
         """
         Parameters
         ----------
@@ -100,18 +151,18 @@ class ActiveRR(RaceResults):
             <br class="clear"/>
           </div>
    
+        response : rr.fetch.Response
+            The event's page, if it has already been downloaded.
         """
         name = event.cssselect('.result-title a')[0].text.strip()
         place = event.cssselect('.result-sub-location')[0].text.strip()
         date = event.cssselect('.result-extras .title')[0].tail.strip()
         print('Looking at {}, {}, {}'.format(name, place, date))
+        self.race_date = datetime.datetime.strptime(date, '%m/%d/%Y').date()
 
-        link = event.cssselect('.result-title a[href]')[0].get('href')
-        url = 'http://results.active.com' + link
-
-        r = requests.get(url)
-        if r.status_code != 200:
-            raise RuntimeError("Could not retrieve {}".format(url))
+        r = response
+        if r is None:
+            r = self.fetcher.fetch(self.event_url(event))
 
         # Hopefully there is an "Overall Results" in there somewhere.
         #if "Overall Results" in r.text:
@@ -139,7 +190,7 @@ class ActiveRR(RaceResults):
                 print('\tSkipping event overview')
                 continue
             print('\tLooking at {}'.format(elt.text))
-            url = 'http://results.active.com' + elt.get('href')
+            url = self.base_url + elt.get('href')
             self.process_results_page(url)
                 
 
@@ -150,50 +201,190 @@ class ActiveRR(RaceResults):
         url : str
             URL of the lead-in results page
         """
-        r = requests.get(url)
-        if r.status_code != 200:
-            raise RuntimeError("Could not retrieve {}".format(url))
+        r = self.fetcher.fetch(url)
         leadin_doc = html.document_fromstring(r.content)
         tables = leadin_doc.cssselect('.participant-list')
+        if len(tables) == 0:
+            return
+
+        # Each page is matched as soon as it arrives and then let go, so
+        # only the matching rows of a large race are held onto.
+        self.downloaded_url = url
+        lines = []
+        lst = []
+        for table in tables:
+            lst.extend(self.match_table(table, lines))
+
+        # A long race's pagination may only list the first few pages, so
+        # the last page fetched is checked for any that follow.
+        doc = leadin_doc
+        last_page = 1
+        page_urls = self.page_urls(doc)
+        while page_urls:
+            matched, doc = self.fetch_pages(page_urls, lines)
+            lst.extend(matched)
+            last_page += len(page_urls)
+            page_urls = self.page_urls(doc, after=last_page)
+        if page_urls is None:
+            # The page count is not known, so follow the "Next" links.
+            lst.extend(self.follow_pages(doc, lines))
+
+        # Index every finisher, not just the members.
+        self.downloaded_url = url
+        self.index_document(lines, title=leadin_doc.findtext('.//title'))
+
+        if len(lst) > 0:
+            # Ok we found some results.  Insert the header for the first table.
+            header_row = tables[0].cssselect('tr')[0]
+            lst.insert(0, header_row)
+            self.webify_results(leadin_doc, lst, url)
+
+    def page_urls(self, doc, after=1):
+        """
+        URLs of the results pages listed in a page's pagination links.
+
+        Parameters
+        ----------
+        doc : lxml.html.HtmlElement
+            A results page.
+        after : int
+            Only the pages after this one are wanted.
+
+        Returns
+        -------
+        list
+            The URLs in page order, or None if there is a next page but the
+            links do not say which pages are left.
+        """
+        anchors = doc.cssselect('.pagination a[href]')
+        nexts = [anchor for anchor in anchors
+                 if anchor.text is not None and anchor.text.startswith('Next')]
+        if len(nexts) == 0:
+            return []
+        numbers = [int(anchor.text) for anchor in anchors
+                   if anchor.text is not None
+                   and anchor.text.strip().isdigit()]
+        parts = urllib.parse.urlsplit(nexts[0].get('href'))
+        query = urllib.parse.parse_qs(parts.query)
+        if len(numbers) == 0 or 'page' not in query or max(numbers) <= after:
+            return None
+
+        urls = []
+        for page in range(after + 1, max(numbers) + 1):
+            query['page'] = [str(page)]
+            qs = urllib.parse.urlencode(query, doseq=True)
+            urls.append(self.base_url + parts._replace(query=qs).geturl())
+        return urls
 
-        # Get any following pages.
-        links = leadin_doc.cssselect('.pagination a[rel]')
+    def fetch_pages(self, urls, lines):
+        """
+        Fetch results pages concurrently and match each as it arrives.
+
+        Parameters
+        ----------
+        urls : list
+            URLs of the results pages.
+        lines : list
+            Every finisher is appended to this, if documents are indexed.
+
+        Returns
+        -------
+        tuple
+            The matching <TR> elements, in page order, and the last page.
+        """
+        if self.scheduler is None:
+            self.scheduler = FetchScheduler(self.fetcher, jobs=self.jobs)
+
+        def fetch(page):
+            url = urls[page]
+            self.logger.info('Downloading {0}...'.format(url))
+            return page, self.scheduler.fetch(url)
+
+        matched = {}
+        page_lines = {}
+        last_doc = None
+        pipeline = Pipeline(iter(range(len(urls))), name='paginate',
+                            queue_size=self.queue_size,
+                            stats=self.stage_stats, consumer='match')
+        # All the pages are on the same host, so as many may be in flight
+        # as the host allows.
+        workers = self.workers.get('fetch page', self.scheduler.per_host)
+        pipeline.add_stage('fetch page', fetch, workers=workers)
+        for page, response in pipeline:
+            doc = html.document_fromstring(response.content)
+            table = doc.cssselect('.participant-list')[0]
+            page_lines[page] = []
+            matched[page] = self.match_table(table, page_lines[page])
+            if page == len(urls) - 1:
+                last_doc = doc
+
+        lst = []
+        for page in sorted(matched):
+            lst.extend(matched[page])
+            lines.extend(page_lines[page])
+        return lst, last_doc
+
+    def follow_pages(self, doc, lines):
+        """
+        Fetch results pages one at a time by following the "Next" links.
+
+        Returns
+        -------
+        list
+            Matching <TR> elements, in page order.
+        """
+        lst = []
+        links = doc.cssselect('.pagination a[rel]')
         while True:
             if len(links) == 0:
                 break
 
-            lst = [link for link in links if link.text.startswith('Next')]
-            if len(lst) == 0:
+            lst2 = [link for link in links if link.text.startswith('Next')]
+            if len(lst2) == 0:
                 break
 
-            anchor = lst[0]
+            anchor = lst2[0]
             next_rel_url = anchor.get('href')
             print('\t\t{}'.format(next_rel_url))
-            r = requests.get('http://results.active.com' + next_rel_url)
+            r = self.fetcher.fetch(self.base_url + next_rel_url)
             doc = html.document_fromstring(r.content)
             table = doc.cssselect('.participant-list')[0]
-            tables.append(table)
+            lst.extend(self.match_table(table, lines))
 
             links = doc.cssselect('.pagination a[rel]')
+        return lst
 
-        # Search the tables.                
-        lst = []
-        for table in tables:
-            trs = table.cssselect('tr')
-            # first row has stuff we don't want
-            for tr in trs[1:]:
-                tds = tr.getchildren()
-                if len(tds) < 2:
-                    continue
-                for regex in self.regex:
-                    if regex.match(tds[2].text_content()):
-                        lst.append(tr)
+    def match_table(self, table, lines):
+        """
+        Search a table of results for members.
 
-        if len(lst) > 0:
-            # Ok we found some results.  Insert the header for the first table.
-            header_row = tables[0].cssselect('tr')[0]
-            lst.insert(0, header_row)
-            self.webify_results(leadin_doc, lst, url)
+        Parameters
+        ----------
+        table : lxml.html.HtmlElement
+            A ".participant-list" table.
+        lines : list
+            Every finisher is appended to this, if documents are indexed.
+
+        Returns
+        -------
+        list
+            Copies of the matching <TR> elements, so that the page they came
+            from need not be kept.
+        """
+        lst = []
+        trs = table.cssselect('tr')
+        # first row has stuff we don't want
+        for tr in trs[1:]:
+            if self.document_index is not None:
+                lines.append(' '.join(tr.text_content().split()))
+            tds = tr.getchildren()
+            if len(tds) < 2:
+                continue
+            for regex in self.regex:
+                if regex.match(tds[2].text_content()):
+                    lst.append(copy.deepcopy(tr))
+                    self.add_match_row(tr)
+        return lst
 
     def webify_results(self, leadin_doc, lst, url):
         """
@@ -241,6 +432,8 @@ class ActiveRR(RaceResults):
         attribution_div.append(p)
         div.append(attribution_div)
 
+        self.downloaded_url = url
+
         table = etree.Element('table')
         for tr in lst:
             tr_elt = etree.Element('tr')
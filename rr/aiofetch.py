@@ -0,0 +1,502 @@
+"""
+asyncio backend for the HTTP layer.
+"""
+import asyncio
+import collections
+import copy
+import http.client
+import http.cookiejar
+import io
+import os
+import queue
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+import zlib
+
+from .fetch import (ACCEPT_ENCODING, CHUNK_SIZE, FetchError, FetchStats,
+                    PartialBody, Response, USER_AGENT, build_url)
+from .retry import RetryPolicy
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+
+class _CookieResponse:
+    """
+    Just enough of a urllib response for the cookie jar.
+    """
+    def __init__(self, headers):
+        self._headers = headers
+
+    def info(self):
+        return self._headers
+
+
+class AsyncFetcher:
+    """
+    Retrieve documents with asyncio instead of threads.
+
+    A single event loop runs in a background thread and multiplexes every
+    request over pooled keep-alive connections, so hundreds of requests may
+    be in flight at once for the cost of a coroutine each.  Completed
+    documents are handed back to the calling thread, which does the
+    CPU-bound parsing and matching, so the loop never stalls on them.
+
+    This has the same interface as rr.fetch.Fetcher, plus fetch_all, which
+    rr.scheduler.FetchScheduler uses in place of its thread pool.
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds to wait for any single request.
+    max_connections : int
+        Number of idle connections kept open to each host.
+    cookie_file : str
+        If set, cookies are loaded from and saved to this file.
+    cookies : http.cookiejar.LWPCookieJar
+        Shared by all requests.
+    deadline : float
+        If set, seconds from now after which every outstanding request is
+        cancelled.
+    cache : rr.cache.HttpCache
+        If set, GET requests are answered from and stored in this cache.
+    stats : rr.fetch.FetchStats
+        Bytes downloaded from each host.
+    retry : rr.retry.RetryPolicy
+        When to try failed downloads again.
+    """
+    def __init__(self, user_agent=USER_AGENT, timeout=30, max_connections=4,
+                 cookie_file=None, deadline=None, cache=None, retry=None):
+        """
+        Parameters
+        ----------
+        user_agent : str
+            Masquerade as a browser because some sites do not like Python.
+        timeout : float
+            Seconds to wait for any single request.
+        max_connections : int
+            Number of idle connections kept open to each host.
+        cookie_file : str
+            If set, cookies are loaded from and saved to this file.
+        deadline : float
+            If set, seconds from now after which every outstanding request
+            is cancelled.
+        cache : rr.cache.HttpCache
+            If set, GET requests are answered from and stored in this cache.
+        retry : rr.retry.RetryPolicy
+            When to try failed downloads again.  By default, a couple of
+            times with a short backoff.
+        """
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cookie_file = cookie_file
+        self.deadline = deadline
+        self.cache = cache
+        self.stats = FetchStats()
+        self.retry = RetryPolicy() if retry is None else retry
+
+        self.cookies = http.cookiejar.LWPCookieJar(cookie_file)
+        if cookie_file is not None and os.path.exists(cookie_file):
+            self.cookies.load(ignore_discard=True)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        if deadline is None:
+            self._deadline = None
+        else:
+            self._deadline = self.loop.time() + deadline
+
+        # Idle connections, keyed by (scheme, host, port).
+        self._pool = collections.defaultdict(list)
+
+        # Set on fetchers made by isolated, which own none of this.
+        self._shared = False
+
+    def isolated(self):
+        """
+        A fetcher with a cookie jar of its own that otherwise shares this
+        one's loop, connections, cache, statistics and retry budget.
+
+        Its cookies are not saved, and closing it does nothing.
+        """
+        other = copy.copy(self)
+        other.cookie_file = None
+        other.cookies = http.cookiejar.LWPCookieJar()
+        other._shared = True
+        return other
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def fetch(self, url, params=None, data=None, headers=None,
+              immutable=False):
+        """
+        Retrieve a document.
+
+        Parameters
+        ----------
+        url : str
+            The URL to retrieve
+        params : dict
+            Query string parameters.
+        data : dict
+            If given, POST these form parameters instead of doing a GET.
+        headers : dict
+            Additional request headers.
+        immutable : bool
+            If True, the document is not expected to change once it is old
+            enough, so an old enough cached copy is used without asking the
+            server.
+
+        Returns
+        -------
+        rr.fetch.Response
+            The document.
+
+        Raises
+        ------
+        rr.fetch.FetchError
+            If there is no response, the server reports an error, or the
+            deadline passes.
+        """
+        return self._run(self.afetch(url, params=params, data=data,
+                                     headers=headers, immutable=immutable))
+
+    def fetch_all(self, requests, jobs=1, per_host=None):
+        """
+        Download a batch of documents on the event loop.
+
+        Parameters
+        ----------
+        requests : iterable
+            URLs, or (URL, dict) pairs where the dictionary holds keyword
+            arguments for fetch.  It is consumed lazily, never more than
+            jobs requests ahead of the caller.
+        jobs : int
+            Number of requests in flight at once, across all hosts.
+        per_host : int
+            Number of requests in flight at once to any single host.
+
+        Yields
+        ------
+        tuple
+            (url, response, error) for each request as it completes.
+        """
+        if per_host is None:
+            per_host = self.max_connections
+        done = queue.Queue()
+        hosts = collections.defaultdict(lambda: asyncio.Semaphore(per_host))
+
+        # Requests are taken from the iterable as slots free up, so it may
+        # be a generator that is still discovering them.  A slot is held
+        # until its result has been taken by the caller.
+        slots = threading.Semaphore(max(1, jobs))
+        stop = threading.Event()
+        futures = []
+
+        async def fetch_one(url, kwargs):
+            host = urllib.parse.urlsplit(url).netloc
+            async with hosts[host]:
+                try:
+                    response = await self.afetch(url, **kwargs)
+                except FetchError as error:
+                    done.put((url, None, error))
+                except Exception as error:
+                    done.put((url, None, FetchError(url, reason=error)))
+                else:
+                    done.put((url, response, None))
+
+        def feed():
+            count = 0
+            try:
+                for request in requests:
+                    if isinstance(request, str):
+                        request = (request, {})
+                    slots.acquire()
+                    if stop.is_set():
+                        break
+                    futures.append(asyncio.run_coroutine_threadsafe(
+                        fetch_one(*request), self.loop))
+                    count += 1
+            except BaseException as error:
+                done.put(error)
+            finally:
+                done.put(count)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        submitted = None
+        received = 0
+        try:
+            while submitted is None or received < submitted:
+                item = done.get()
+                if isinstance(item, BaseException):
+                    raise item
+                if isinstance(item, int):
+                    submitted = item
+                    continue
+                received += 1
+                slots.release()
+                yield item
+        finally:
+            # The caller may have stopped early.
+            stop.set()
+            slots.release()
+            feeder.join()
+            for future in futures:
+                future.cancel()
+
+    async def afetch(self, url, params=None, data=None, headers=None,
+                     immutable=False):
+        """
+        Coroutine version of fetch.  Must be run on the fetcher's loop.
+        """
+        url = build_url(url, params)
+
+        entry = None
+        use_cache = self.cache is not None and data is None
+        if use_cache:
+            cached, entry, headers = self.cache.before(url, headers,
+                                                       immutable=immutable)
+            if cached is not None:
+                return cached
+
+        partial = PartialBody()
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(url, data, headers, partial)
+                break
+            except FetchError as error:
+                if self._deadline_reached():
+                    raise
+                delay = self.retry.backoff(error, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        self.stats.add(url, partial.received, len(response.content))
+        if use_cache:
+            response = self.cache.after(url, entry, response)
+        return response
+
+    def _deadline_reached(self):
+        return (self._deadline is not None
+                and self.loop.time() >= self._deadline)
+
+    async def _attempt(self, url, data, headers, partial):
+        """
+        Make a single attempt at a request, within the timeout.
+        """
+        timeout = self.timeout
+        if self._deadline is not None:
+            remaining = self._deadline - self.loop.time()
+            if remaining <= 0:
+                raise FetchError(url, reason='run deadline reached')
+            timeout = min(timeout, remaining)
+
+        try:
+            response = await asyncio.wait_for(
+                self._follow(url, data, headers, partial), timeout)
+        except asyncio.TimeoutError:
+            if self._deadline_reached():
+                raise FetchError(url, reason='run deadline reached')
+            raise FetchError(url, reason='timed out')
+        except (OSError, EOFError, ValueError, zlib.error,
+                asyncio.IncompleteReadError, http.client.HTTPException) as e:
+            raise FetchError(url, reason=e) from e
+
+        if response.status >= 400:
+            raise FetchError(url, status=response.status)
+        return response
+
+    async def _follow(self, url, data, headers, partial):
+        """
+        Make the request, following any redirects.
+        """
+        method = 'GET' if data is None else 'POST'
+        for _ in range(MAX_REDIRECTS):
+            response = await self._request(method, url, data, headers,
+                                           partial)
+            if response.status not in REDIRECTS:
+                return response
+            url = urllib.parse.urljoin(url, response.headers['Location'])
+            if response.status in (301, 302, 303):
+                method, data = 'GET', None
+        raise FetchError(url, reason='too many redirects')
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        while self._pool[key]:
+            reader, writer = self._pool[key].pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        context = ssl.create_default_context() if scheme == 'https' else None
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        return reader, writer, False
+
+    def _release(self, key, reader, writer, reusable):
+        if reusable and len(self._pool[key]) < self.max_connections:
+            self._pool[key].append((reader, writer))
+        else:
+            writer.close()
+
+    async def _request(self, method, url, data, headers, partial):
+        """
+        Make a single HTTP/1.1 request.
+        """
+        parts = urllib.parse.urlsplit(url)
+        default_port = 443 if parts.scheme == 'https' else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        all_headers = {'Host': parts.netloc,
+                       'User-Agent': self.user_agent,
+                       'Accept': '*/*',
+                       'Accept-Encoding': ACCEPT_ENCODING,
+                       'Connection': 'keep-alive'}
+        body = b''
+        if data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            all_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            all_headers['Content-Length'] = str(len(body))
+        all_headers.update(headers or {})
+        all_headers.update(partial.range_headers())
+
+        cookie_request = urllib.request.Request(url, headers=all_headers,
+                                                method=method)
+        self.cookies.add_cookie_header(cookie_request)
+        if cookie_request.has_header('Cookie'):
+            all_headers['Cookie'] = cookie_request.get_header('Cookie')
+
+        lines = ['{0} {1} HTTP/1.1'.format(method, target)]
+        lines += ['{0}: {1}'.format(k, v) for k, v in all_headers.items()]
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin1')
+
+        reader, writer, reused = await self._connect(key)
+        try:
+            try:
+                writer.write(head + body)
+                await writer.drain()
+                status_line = await reader.readline()
+            except ConnectionError:
+                if not reused:
+                    raise
+                status_line = b''
+            if not status_line and reused:
+                # The server closed an idle connection.  Try a fresh one.
+                writer.close()
+                return await self._request(method, url, data, headers,
+                                           partial)
+            version, status, raw_headers = await self._read_head(status_line,
+                                                                 reader)
+            message = http.client.parse_headers(io.BytesIO(raw_headers))
+            content, reusable = await self._read_body(method, status,
+                                                      message, reader,
+                                                      partial)
+        except BaseException:
+            writer.close()
+            raise
+        if version != 'HTTP/1.1' or 'close' in message.get('Connection', ''):
+            reusable = False
+        self._release(key, reader, writer, reusable)
+
+        self.cookies.extract_cookies(_CookieResponse(message), cookie_request)
+        return Response(url, partial.status, partial.headers, content)
+
+    async def _iter_body(self, method, status, message, reader):
+        """
+        Yield the raw body in chunks, then whether the connection may be
+        reused.
+        """
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            yield True
+            return
+        if message.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip any trailers.
+                    while (await reader.readline()) not in (b'\r\n', b'\n',
+                                                             b''):
+                        pass
+                    yield True
+                    return
+                yield await reader.readexactly(size)
+                await reader.readline()
+        if message.get('Content-Length') is not None:
+            remaining = int(message['Content-Length'])
+            while remaining > 0:
+                chunk = await reader.read(min(remaining, CHUNK_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                remaining -= len(chunk)
+                yield chunk
+            yield True
+            return
+        while True:
+            chunk = await reader.read(CHUNK_SIZE)
+            if not chunk:
+                yield False
+                return
+            yield chunk
+
+    async def _read_head(self, status_line, reader):
+        parts = status_line.decode('latin1').split(None, 2)
+        if len(parts) < 2:
+            raise http.client.BadStatusLine(status_line)
+        raw_headers = b''
+        while True:
+            line = await reader.readline()
+            raw_headers += line
+            if line in (b'\r\n', b'\n', b''):
+                break
+        return parts[0], int(parts[1]), raw_headers
+
+    async def _read_body(self, method, status, message, reader, partial):
+        """
+        Read and decompress the body as it streams in.
+
+        Returns the body and whether the connection may be reused.
+        """
+        partial.start(status, message)
+        async for chunk in self._iter_body(method, status, message, reader):
+            if isinstance(chunk, bool):
+                reusable = chunk
+                break
+            partial.feed(chunk)
+        return partial.finish(), reusable
+
+    def close(self):
+        """
+        Save the cookies, close all the connections and stop the loop.
+        """
+        if self._shared:
+            # The loop belongs to the fetcher this was made from.
+            return
+        if self.cookie_file is not None:
+            self.cookies.save(ignore_discard=True)
+
+        async def close_pool():
+            for connections in self._pool.values():
+                for _, writer in connections:
+                    writer.close()
+            self._pool.clear()
+
+        if self.loop.is_running():
+            self._run(close_pool())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
@@ -0,0 +1,185 @@
+"""
+Record and replay HTTP traffic.
+"""
+import base64
+import collections
+import gzip
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from requests.structures import CaseInsensitiveDict
+
+from .fetch import FetchError, Response, build_url
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode + 't', encoding='utf-8')
+
+
+def _key(method, url, data):
+    """
+    What identifies a request in an archive.
+    """
+    body = None if data is None else urllib.parse.urlencode(sorted(
+        data.items()))
+    return method, url, body
+
+
+class RecordingFetcher:
+    """
+    Wrap a fetcher and write every request and response made through it to
+    an archive file.
+
+    Each entry holds the method, URL, POSTed form data, any cookies sent,
+    the status, headers and body of the response and how long it took, so
+    that a run can later be replayed offline with ReplayFetcher.  Failed
+    requests are recorded too.
+
+    Attributes
+    ----------
+    fetcher : rr.fetch.Fetcher
+        Does the actual downloading.
+    path : str
+        Archive file, JSON Lines, compressed if it ends in ".gz".
+    """
+    def __init__(self, fetcher, path):
+        """
+        Parameters
+        ----------
+        fetcher : rr.fetch.Fetcher
+            Does the actual downloading.
+        path : str
+            Archive file to write, compressed if it ends in ".gz".
+        """
+        self.fetcher = fetcher
+        self.path = path
+        self.max_connections = fetcher.max_connections
+        self.stats = getattr(fetcher, 'stats', None)
+        self._lock = threading.Lock()
+        self._fptr = _open(path, 'w')
+
+    def _cookies(self, url):
+        jar = getattr(self.fetcher, 'cookies', None)
+        if jar is None:
+            jar = self.fetcher.session.cookies
+        request = urllib.request.Request(url)
+        jar.add_cookie_header(request)
+        return request.get_header('Cookie')
+
+    def fetch(self, url, params=None, data=None, headers=None,
+              immutable=False):
+        """
+        Retrieve a document with the wrapped fetcher and record the exchange.
+        """
+        url = build_url(url, params)
+        entry = {'method': 'GET' if data is None else 'POST',
+                 'url': url,
+                 'data': data,
+                 'cookies': self._cookies(url)}
+        start = time.monotonic()
+        try:
+            response = self.fetcher.fetch(url, data=data, headers=headers,
+                                          immutable=immutable)
+        except FetchError as error:
+            entry['elapsed'] = time.monotonic() - start
+            entry['status'] = error.status
+            entry['error'] = str(error)
+            self._write(entry)
+            raise
+        entry['elapsed'] = time.monotonic() - start
+        entry['status'] = response.status
+        entry['final_url'] = response.url
+        entry['headers'] = list(response.headers.items())
+        entry['content'] = base64.b64encode(response.content).decode('ascii')
+        self._write(entry)
+        return response
+
+    def _write(self, entry):
+        with self._lock:
+            self._fptr.write(json.dumps(entry) + '\n')
+            self._fptr.flush()
+
+    def close(self):
+        """
+        Close the archive and the wrapped fetcher.
+        """
+        self._fptr.close()
+        self.fetcher.close()
+
+
+class ReplayFetcher:
+    """
+    Serve the responses from an archive written by RecordingFetcher instead
+    of going to the network.
+
+    Requests are matched on method, URL and POSTed form data.  If the same
+    request was made several times during the recording, the responses are
+    served in the order they were recorded, and the last one is repeated
+    after that.
+
+    Attributes
+    ----------
+    path : str
+        Archive file.
+    latency : bool
+        If True, each response is delayed by as long as it originally took,
+        otherwise responses are served as fast as possible.
+    max_connections : int
+        Only there for rr.scheduler.FetchScheduler.
+    """
+    def __init__(self, path, latency=False, max_connections=4):
+        """
+        Parameters
+        ----------
+        path : str
+            Archive file written by RecordingFetcher.
+        latency : bool
+            If True, reproduce the recorded response times.
+        max_connections : int
+            Only there for rr.scheduler.FetchScheduler.
+        """
+        self.path = path
+        self.latency = latency
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self._entries = collections.defaultdict(collections.deque)
+        with _open(path, 'r') as fptr:
+            for line in fptr:
+                entry = json.loads(line)
+                key = _key(entry['method'], entry['url'], entry['data'])
+                self._entries[key].append(entry)
+
+    def fetch(self, url, params=None, data=None, headers=None,
+              immutable=False):
+        """
+        Retrieve a recorded document.
+
+        Raises
+        ------
+        rr.fetch.FetchError
+            If the request was not recorded, or failed when it was.
+        """
+        url = build_url(url, params)
+        key = _key('GET' if data is None else 'POST', url, data)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise FetchError(url, reason='not in the archive')
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        if self.latency:
+            time.sleep(entry['elapsed'])
+        if 'error' in entry:
+            raise FetchError(url, status=entry['status'],
+                             reason='recorded failure')
+        return Response(entry['final_url'], entry['status'],
+                        CaseInsensitiveDict(entry['headers']),
+                        base64.b64decode(entry['content']))
+
+    def close(self):
+        pass
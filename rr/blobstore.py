@@ -0,0 +1,301 @@
+"""
+Content-addressed store for downloaded documents.
+"""
+import hashlib
+import lzma
+import mmap
+import os
+import sqlite3
+import tempfile
+import time
+import zlib
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    raw_size INTEGER NOT NULL,
+    pack TEXT,
+    offset INTEGER,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_last_used ON blobs (last_used);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    season INTEGER,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_digest ON urls (digest);
+CREATE INDEX IF NOT EXISTS urls_season ON urls (season);
+"""
+
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+
+
+def _read_mapped(path, offset=0, size=None):
+    """
+    Read part of a file through a memory map.
+    """
+    with open(path, 'rb') as fptr:
+        with mmap.mmap(fptr.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if size is None:
+                size = len(mm) - offset
+            return mm[offset:offset + size]
+
+
+class BlobStore:
+    """
+    Keep every downloaded document, compressed and stored once by content.
+
+    Each document is stored under the SHA-256 of its content, so identical
+    pages (for example a master page that has not changed since the last
+    run) take no extra space, and concurrent runs never clobber each other's
+    files.  A SQLite index maps each URL to the digest of the latest content
+    seen for it.
+
+    Loose blobs count against a size budget and the least recently used are
+    evicted when it is exceeded.  The blobs of a finished season can be
+    compacted into a single pack file, indexed by offset, which is exempt
+    from eviction.
+
+    Attributes
+    ----------
+    directory : str
+        Where the store lives.
+    codec : str
+        Either "zlib" (fast) or "lzma" (small).
+    max_bytes : int
+        Budget for the compressed size of the loose blobs.  None means no
+        limit.
+    """
+    def __init__(self, directory, codec='zlib', max_bytes=None):
+        """
+        Parameters
+        ----------
+        directory : str
+            Where the store lives.  Created if necessary.
+        codec : str
+            Either "zlib" (fast) or "lzma" (small).  Only applies to new
+            blobs; existing blobs are read with whatever codec wrote them.
+        max_bytes : int
+            Budget for the compressed size of the loose blobs.  None means
+            no limit.
+        """
+        if codec not in CODECS:
+            raise ValueError('Unknown codec {0}'.format(codec))
+        self.directory = directory
+        self.codec = codec
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'packs'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest[2:])
+
+    def _pack_path(self, season):
+        return os.path.join(self.directory, 'packs', '{0}.pack'.format(season))
+
+    def loose_size(self):
+        """
+        Compressed size of all the loose blobs, in bytes.
+        """
+        sql = 'SELECT COALESCE(SUM(size), 0) FROM blobs WHERE pack IS NULL'
+        return self.conn.execute(sql).fetchone()[0]
+
+    def put(self, url, content, season=None):
+        """
+        Store a document.
+
+        Parameters
+        ----------
+        url : str
+            Where the document came from.
+        content : bytes
+            The document.
+        season : int
+            Year the document belongs to, so that it can be packed with the
+            rest of that season.
+
+        Returns
+        -------
+        str
+            Digest of the content.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        with self.conn:
+            row = self.conn.execute('SELECT 1 FROM blobs WHERE digest = ?',
+                                    (digest,)).fetchone()
+            if row is None:
+                compress, _ = CODECS[self.codec]
+                blob = compress(content)
+                path = self._object_path(digest)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(path),
+                                               prefix='.rr', suffix='.tmp')
+                with os.fdopen(fd, 'wb') as fptr:
+                    fptr.write(blob)
+                os.replace(tmpfile, path)
+                self.conn.execute('INSERT INTO blobs '
+                                  '(digest, codec, size, raw_size, last_used) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  (digest, self.codec, len(blob),
+                                   len(content), now))
+            else:
+                self.conn.execute('UPDATE blobs SET last_used = ? '
+                                  'WHERE digest = ?', (now, digest))
+            self.conn.execute('INSERT OR REPLACE INTO urls '
+                              '(url, digest, season, stored_at) '
+                              'VALUES (?, ?, ?, ?)',
+                              (url, digest, season, now))
+        if self.max_bytes is not None:
+            self.evict(keep=digest)
+        return digest
+
+    def digest(self, url):
+        """
+        Digest of the latest content stored for a URL, or None.
+        """
+        row = self.conn.execute('SELECT digest FROM urls WHERE url = ?',
+                                (url,)).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, url):
+        """
+        Retrieve the latest content stored for a URL.
+
+        Returns
+        -------
+        bytes
+            The document, or None if it is not in the store.
+        """
+        digest = self.digest(url)
+        if digest is None:
+            return None
+        return self.get_blob(digest)
+
+    def get_blob(self, digest):
+        """
+        Retrieve a document by the digest of its content.
+
+        Returns
+        -------
+        bytes
+            The document, or None if it is not in the store.
+        """
+        row = self.conn.execute('SELECT codec, size, pack, offset '
+                                'FROM blobs WHERE digest = ?',
+                                (digest,)).fetchone()
+        if row is None:
+            return None
+        codec, size, pack, offset = row
+        try:
+            if pack is None:
+                blob = _read_mapped(self._object_path(digest))
+            else:
+                blob = _read_mapped(os.path.join(self.directory, pack),
+                                    offset, size)
+        except (OSError, ValueError):
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE blobs SET last_used = ? '
+                              'WHERE digest = ?', (time.time(), digest))
+        _, decompress = CODECS[codec]
+        return decompress(blob)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used loose blobs until the store is within
+        its size budget.
+
+        Parameters
+        ----------
+        keep : str
+            Digest of a blob that must not be evicted, e.g. the one just
+            stored.
+
+        Returns
+        -------
+        int
+            Number of blobs removed.
+        """
+        if self.max_bytes is None:
+            return 0
+        excess = self.loose_size() - self.max_bytes
+        if excess <= 0:
+            return 0
+        sql = ('SELECT digest, size FROM blobs WHERE pack IS NULL '
+               'ORDER BY last_used')
+        victims = []
+        for digest, size in self.conn.execute(sql).fetchall():
+            if excess <= 0:
+                break
+            if digest == keep:
+                continue
+            victims.append(digest)
+            excess -= size
+        with self.conn:
+            for digest in victims:
+                self.conn.execute('DELETE FROM blobs WHERE digest = ?',
+                                  (digest,))
+                self.conn.execute('DELETE FROM urls WHERE digest = ?',
+                                  (digest,))
+        for digest in victims:
+            try:
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+        return len(victims)
+
+    def pack(self, season):
+        """
+        Compact the loose blobs of a season into that season's pack file.
+
+        Packed blobs are read in place through a memory map and are never
+        evicted.
+
+        Parameters
+        ----------
+        season : int
+            Year to compact.
+
+        Returns
+        -------
+        int
+            Number of blobs packed.
+        """
+        sql = ('SELECT DISTINCT b.digest FROM blobs AS b '
+               'JOIN urls AS u ON u.digest = b.digest '
+               'WHERE u.season = ? AND b.pack IS NULL')
+        digests = [row[0] for row in self.conn.execute(sql, (season,))]
+        if len(digests) == 0:
+            return 0
+
+        path = self._pack_path(season)
+        relpath = os.path.relpath(path, self.directory)
+        locations = []
+        with open(path, 'ab') as fptr:
+            for digest in digests:
+                blob = _read_mapped(self._object_path(digest))
+                locations.append((relpath, fptr.tell(), digest))
+                fptr.write(blob)
+            fptr.flush()
+            os.fsync(fptr.fileno())
+
+        with self.conn:
+            self.conn.executemany('UPDATE blobs SET pack = ?, offset = ? '
+                                  'WHERE digest = ?', locations)
+        for digest in digests:
+            os.remove(self._object_path(digest))
+        return len(digests)
@@ -1,13 +1,15 @@
 """
 Module for BestRace.
 """
+import datetime
 import logging
 import re
-import urllib
+import urllib.parse
 
 from lxml import etree
 
 from .common import RaceResults
+from .schedule import ScheduleEntry
 
 
 class BestRace(RaceResults):
@@ -27,6 +29,7 @@ class BestRace(RaceResults):
             in the membership list, then we want to record that URL in the
             output.
     """
+    provider = 'bestrace'
 
     def __init__(self, verbose='INFO', membership_list=None, output_file=None,
                  **kwargs):
@@ -49,40 +52,59 @@ class BestRace(RaceResults):
         """
         Download the requested results and compile them.
         """
-        self.download_master_file()
-        self.process_master_file()
+        urls = [self.master_file_url(year) for year in self.search_years()]
+        schedules = self.master_schedules(urls, self.parse_master_file)
+        entries = []
+        for url in urls:
+            if url in schedules:
+                entries.extend(self.races_between(schedules[url]))
+        dates = {entry.url: entry.date for entry in entries}
+
+        for url, response in self.fetch_all(list(dates)):
+            self.html = response.text
+            self.downloaded_url = url
+            self.race_date = dates[url]
+            self.compile_race_results()
 
-    def process_master_file(self):
-        """
-        Compile results for the specified state.
+    def master_file_url(self, year):
         """
-        pattern = 'http://www.bestrace.com/results/{}/{}{}'
-        pattern = pattern.format(self.start_date.strftime('%y'),
-                                 self.start_date.strftime('%y'),
-                                 self.start_date.strftime('%m'))
-
-        day_range = '('
-        for day in range(self.start_date.day, self.stop_date.day):
-            day_range += "%02d|" % day
-        day_range += '%02d)' % self.stop_date.day
-
-        pattern += day_range
+        The schedule of a year's races, e.g.
 
-        pattern += r"\w+\.HTM"
-        self.logger.debug('pattern is "%s"' % pattern)
+        http://www.bestrace.com/2012schedule.html
+        """
+        return 'http://www.bestrace.com/{0}schedule.html'.format(year)
 
-        matchiter = re.finditer(pattern, self.html)
-        urls = [matchobj.group() for matchobj in matchiter]
+    def parse_master_file(self, url, html):
+        """
+        Collect the races listed on a year's schedule.  The race date is
+        taken from the result file name.
 
-        for url in urls:
-            self.logger.info('Downloading %s...' % url)
+        Returns
+        -------
+        list
+            rr.schedule.ScheduleEntry for each race.
+        """
+        doc = etree.HTML(html)
+        if doc is None:
+            return []
+        regex = re.compile(r'results/\d\d/(?P<date>\d{6})\w+\.HTM$')
+        entries = []
+        for anchor in doc.iter('a'):
+            href = anchor.get('href')
+            if href is None:
+                continue
+            href = urllib.parse.urljoin(url, href.strip())
+            matchobj = regex.search(href)
+            if matchobj is None:
+                continue
             try:
-                self.download_race(url)
-            except urllib.error.HTTPError as e:
-                print(e)
-                print("Going on to next race...")
+                date = datetime.datetime.strptime(matchobj.group('date'),
+                                                  '%y%m%d').date()
+            except ValueError:
                 continue
-            self.compile_race_results()
+            name = ' '.join(''.join(anchor.itertext()).split()) or None
+            entries.append(ScheduleEntry(date, name, href, None))
+        return entries
 
     def webify_results(self, results_lst):
         """
@@ -139,25 +161,3 @@ class BestRace(RaceResults):
         div.append(pre)
 
         return div
-
-    def download_master_file(self):
-        """Download results for the specified state.
-
-        The URL will have the pattern
-
-        http://www.bestrace.com/YYYYschedule.shtml
-
-        """
-        fmt = 'http://www.bestrace.com/%sschedule.html'
-        url = fmt % self.start_date.strftime('%Y')
-        self.logger.info('Downloading %s.' % url)
-        self.download_file(url)
-
-    def download_race(self, url):
-        """
-        Download a race URL to a local file.
-        """
-        name = url.split('/')[-1]
-        self.logger.info('Downloading %s...' % name)
-        self.download_file(url)
-        self.downloaded_url = url
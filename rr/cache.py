@@ -0,0 +1,220 @@
+"""
+Persistent HTTP cache.
+"""
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from .fetch import Response
+
+
+# Response headers worth keeping with a cached document.
+KEEP_HEADERS = ['Content-Type', 'ETag', 'Last-Modified']
+
+
+class CacheEntry:
+    """
+    A cached document and its validators.
+
+    Attributes
+    ----------
+    url : str
+        Requested URL.
+    meta : dict
+        Final URL, status, kept headers and when the document was first and
+        last fetched.
+    path : str
+        File holding the body.
+    """
+    def __init__(self, url, meta, path):
+        self.url = url
+        self.meta = meta
+        self.path = path
+
+    def validators(self):
+        """
+        Headers that make a request conditional on the document having
+        changed.
+        """
+        headers = {}
+        if 'ETag' in self.meta['headers']:
+            headers['If-None-Match'] = self.meta['headers']['ETag']
+        last_modified = self.meta['headers'].get('Last-Modified')
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def age(self):
+        """
+        Seconds since the document was last modified, going by the server if
+        possible, otherwise by when we first saw it.
+        """
+        modified = self.meta['first_fetched']
+        last_modified = self.meta['headers'].get('Last-Modified')
+        if last_modified is not None:
+            try:
+                parsed = email.utils.parsedate_to_datetime(last_modified)
+                modified = min(modified, parsed.timestamp())
+            except (TypeError, ValueError):
+                pass
+        return time.time() - modified
+
+    def response(self):
+        """
+        The cached document as an rr.fetch.Response.
+        """
+        with open(self.path, 'rb') as fptr:
+            content = fptr.read()
+        return Response(self.meta['url'], self.meta['status'],
+                        CaseInsensitiveDict(self.meta['headers']), content)
+
+
+class HttpCache:
+    """
+    Keep downloaded documents on disk and revalidate them with conditional
+    GETs.
+
+    A cached document is only downloaded again if the server says it has
+    changed; a "304 Not Modified" is answered from disk.  Documents that
+    have not changed for long enough, such as the results of a race run
+    months ago, may be treated as immutable and served from disk without
+    any request at all.
+
+    Attributes
+    ----------
+    directory : str
+        Where the cache lives.
+    immutable_after : datetime.timedelta
+        Age after which a document that the caller says is immutable is no
+        longer revalidated.  None means always revalidate.
+    """
+    def __init__(self, directory, immutable_after=None):
+        """
+        Parameters
+        ----------
+        directory : str
+            Where the cache lives.  Created if necessary.
+        immutable_after : datetime.timedelta
+            Age after which documents flagged as immutable are no longer
+            revalidated.  None means always revalidate.
+        """
+        self.directory = directory
+        self.immutable_after = immutable_after
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        stem = os.path.join(self.directory, digest)
+        return stem + '.json', stem + '.body'
+
+    def _write(self, path, content):
+        fd, tmpfile = tempfile.mkstemp(dir=self.directory, prefix='.rr',
+                                       suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fptr:
+            fptr.write(content)
+        os.replace(tmpfile, path)
+
+    def get(self, url):
+        """
+        Look up a cached document.
+
+        Returns
+        -------
+        CacheEntry
+            Or None if the URL is not cached.
+        """
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, 'rt') as fptr:
+                meta = json.load(fptr)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+        return CacheEntry(url, meta, body_path)
+
+    def put(self, url, response):
+        """
+        Cache a document.
+
+        Parameters
+        ----------
+        url : str
+            Requested URL.
+        response : rr.fetch.Response
+            What the server sent.
+        """
+        meta_path, body_path = self._paths(url)
+        now = time.time()
+        headers = {key: response.headers[key] for key in KEEP_HEADERS
+                   if response.headers.get(key) is not None}
+        meta = {'url': response.url,
+                'status': response.status,
+                'headers': headers,
+                'first_fetched': now,
+                'last_fetched': now}
+        self._write(body_path, response.content)
+        self._write(meta_path, json.dumps(meta).encode())
+
+    def is_immutable(self, entry):
+        """
+        Determine whether a document is old enough not to be revalidated.
+        """
+        if self.immutable_after is None:
+            return False
+        return entry.age() > self.immutable_after.total_seconds()
+
+    def before(self, url, headers, immutable=False):
+        """
+        Consult the cache before making a GET request.
+
+        Parameters
+        ----------
+        url : str
+            Full URL, including any query string.
+        headers : dict
+            Request headers.
+        immutable : bool
+            Whether the document is expected never to change once it is old
+            enough, e.g. a race result page.
+
+        Returns
+        -------
+        tuple
+            (response, entry, headers).  If the response is not None, it
+            should be used without making any request.  Otherwise the request
+            should be made with the returned headers and its response passed
+            to after along with the entry.
+        """
+        entry = self.get(url)
+        if entry is None:
+            return None, None, headers
+        if immutable and self.is_immutable(entry):
+            return entry.response(), entry, headers
+        headers = dict(headers or {})
+        headers.update(entry.validators())
+        return None, entry, headers
+
+    def after(self, url, entry, response):
+        """
+        Update the cache with the response to a GET request.
+
+        Returns
+        -------
+        rr.fetch.Response
+            The cached document if the server said it has not changed,
+            otherwise the response itself.
+        """
+        if response.status == 304 and entry is not None:
+            entry.meta['last_fetched'] = time.time()
+            meta_path, _ = self._paths(url)
+            self._write(meta_path, json.dumps(entry.meta).encode())
+            return entry.response()
+        if response.status == 200:
+            self.put(url, response)
+        return response
@@ -6,10 +6,220 @@ import argparse
 import datetime
 
 from .active import ActiveRR
+from .aiofetch import AsyncFetcher
+from .archive import RecordingFetcher, ReplayFetcher
+from .blobstore import BlobStore
 from .brrr import BestRace
+from .cache import HttpCache
 from .crrr import CoolRunning
 from .csrr import CompuScore
+from .fetch import Fetcher
+from .fragments import FragmentStore
+from .fts import DocumentIndex
+from .ledger import Ledger
+from .metadata import MetadataCache
 from .nyrr import NewYorkRR
+from .retry import RetryPolicy
+from .schedule import ScheduleIndex
+from .sinks import CSVSink, JSONLinesSink
+from .store import ResultsStore
+
+
+# Pipeline stages whose threads can be set with --workers.
+WORKER_STAGES = ['decode', 'fetch page']
+
+
+def add_common_arguments(parser):
+    """
+    Options shared by all the console scripts.
+    """
+    parser.add_argument('--fragments', dest='fragment_dir',
+                        help='render each race into this directory and '
+                             'assemble the output file from it')
+    parser.add_argument('--jsonl', dest='jsonl', action='append', default=[],
+                        help='also write matched results as JSON Lines to '
+                             'this file ("-" for stdout, ".gz" to compress)')
+    parser.add_argument('--csv', dest='csv', action='append', default=[],
+                        help='also write matched results as CSV to this file '
+                             '(".gz" to compress)')
+    parser.add_argument('--db', dest='db',
+                        help='also store matched results in this SQLite '
+                             'database')
+    parser.add_argument('--index', dest='index',
+                        help='add every downloaded race to this SQLite '
+                             'full-text index')
+    parser.add_argument('--ledger', dest='ledger',
+                        help='skip races already processed unchanged, as '
+                             'recorded in this SQLite database (needs '
+                             '--fragments)')
+    parser.add_argument('--schedule', dest='schedule',
+                        help='keep the races parsed from master pages in '
+                             'this SQLite database')
+    parser.add_argument('--schedule-ttl', dest='schedule_ttl', type=float,
+                        default=12,
+                        help='hours before a master page in the schedule '
+                             'database is downloaded again, default is 12')
+    parser.add_argument('--metadata', dest='metadata',
+                        help='remember the date, title, author and format of '
+                             'each race in this SQLite database and skip '
+                             'races already known not to be wanted')
+    parser.add_argument('--new-only', dest='new_only', action='store_true',
+                        help='only fetch races on master pages that no '
+                             'earlier run with the same schedule database '
+                             'fetched')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='process every race even if the ledger says '
+                             'it is unchanged')
+    parser.add_argument('--timeout', dest='timeout', type=float, default=30,
+                        help='seconds to wait on a web site, default is 30')
+    parser.add_argument('--connections', dest='connections', type=int,
+                        default=4,
+                        help='connections kept open per web site, '
+                             'default is 4')
+    parser.add_argument('--cookies', dest='cookie_file',
+                        help='load and save cookies in this file')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of races to download at once, '
+                             'default is 1')
+    parser.add_argument('--workers', dest='workers', action='append',
+                        type=parse_workers, default=[], metavar='STAGE=N',
+                        help='threads for a pipeline stage other than '
+                             'fetch, one of {0}, e.g. "decode=2"'.format(
+                                 ', '.join('"{0}"'.format(stage)
+                                           for stage in WORKER_STAGES)))
+    parser.add_argument('--queue-size', dest='queue_size', type=int,
+                        default=8,
+                        help='most races waiting between pipeline stages, '
+                             'default is 8')
+    parser.add_argument('--backend', dest='backend',
+                        choices=['threads', 'asyncio'], default='threads',
+                        help='how to download concurrently, '
+                             'default is "threads"')
+    parser.add_argument('--deadline', dest='deadline', type=float,
+                        help='give up on any download still outstanding '
+                             'after this many seconds (asyncio only)')
+    parser.add_argument('--cache', dest='cache_dir',
+                        help='keep downloaded pages in this directory and '
+                             'only download them again if they have changed')
+    parser.add_argument('--immutable-after', dest='immutable_after',
+                        type=float, default=30,
+                        help='do not check cached race pages older than '
+                             'this many days for changes, default is 30')
+    parser.add_argument('--retries', dest='retries', type=int, default=2,
+                        help='times to retry a failed download, '
+                             'default is 2')
+    parser.add_argument('--retry-budget', dest='retry_budget', type=int,
+                        default=100,
+                        help='most retries for the whole run, '
+                             'default is 100')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', dest='record',
+                       help='record every request and response in this '
+                            'archive file (".gz" to compress)')
+    group.add_argument('--replay', dest='replay',
+                       help='serve every request from this archive file '
+                            'instead of the network')
+    parser.add_argument('--replay-latency', dest='replay_latency',
+                        action='store_true',
+                        help='when replaying, take as long as each request '
+                             'originally took')
+    parser.add_argument('--store', dest='store_dir',
+                        help='keep every downloaded page, compressed, in '
+                             'this content-addressed store')
+    parser.add_argument('--store-codec', dest='store_codec',
+                        choices=['zlib', 'lzma'], default='zlib',
+                        help='compression for the store, default is "zlib"')
+    parser.add_argument('--store-size', dest='store_size', type=float,
+                        help='evict the least recently used pages when the '
+                             'store grows beyond this many megabytes')
+
+
+def parse_workers(spec):
+    """
+    Turn a "STAGE=N" option into a (stage, threads) pair.  Being an argparse
+    type, any error is reported as a usage error.
+    """
+    stage, _, count = spec.partition('=')
+    if stage not in WORKER_STAGES:
+        msg = 'unknown stage "{0}", expected one of {1}'
+        raise argparse.ArgumentTypeError(
+            msg.format(stage, ', '.join(WORKER_STAGES)))
+    try:
+        count = int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected STAGE=N, got "{0}"'.format(spec))
+    if count < 1:
+        raise argparse.ArgumentTypeError(
+            'expected at least one thread, got "{0}"'.format(spec))
+    return stage, count
+
+
+def common_kwargs(parser, args):
+    """
+    Keyword arguments for the race results classes from the shared options.
+    Options that cannot be used together are reported as usage errors.
+    """
+    if args.deadline is not None and args.backend != 'asyncio':
+        parser.error('--deadline needs --backend asyncio')
+    sinks = [JSONLinesSink(path) for path in args.jsonl]
+    sinks += [CSVSink(path) for path in args.csv]
+    if args.db is not None:
+        sinks.append(ResultsStore(args.db))
+    if args.index is not None:
+        document_index = DocumentIndex(args.index)
+    else:
+        document_index = None
+    if args.store_dir is not None:
+        max_bytes = None
+        if args.store_size is not None:
+            max_bytes = int(args.store_size * 1024 * 1024)
+        blob_store = BlobStore(args.store_dir, codec=args.store_codec,
+                               max_bytes=max_bytes)
+    else:
+        blob_store = None
+    if args.cache_dir is not None:
+        immutable_after = datetime.timedelta(days=args.immutable_after)
+        cache = HttpCache(args.cache_dir, immutable_after=immutable_after)
+    else:
+        cache = None
+    if args.schedule is not None:
+        ttl = datetime.timedelta(hours=args.schedule_ttl)
+        schedule_index = ScheduleIndex(args.schedule, ttl=ttl)
+    else:
+        schedule_index = None
+    retry = RetryPolicy(attempts=args.retries + 1, budget=args.retry_budget)
+    if args.backend == 'asyncio':
+        fetcher = AsyncFetcher(timeout=args.timeout,
+                               max_connections=args.connections,
+                               cookie_file=args.cookie_file,
+                               deadline=args.deadline,
+                               cache=cache, retry=retry)
+    else:
+        fetcher = Fetcher(timeout=args.timeout,
+                          max_connections=args.connections,
+                          cookie_file=args.cookie_file,
+                          cache=cache, retry=retry)
+    if args.replay is not None:
+        fetcher.close()
+        fetcher = ReplayFetcher(args.replay, latency=args.replay_latency,
+                                max_connections=args.connections)
+    elif args.record is not None:
+        fetcher = RecordingFetcher(fetcher, args.record)
+    return {'fragment_dir': args.fragment_dir,
+            'sinks': sinks,
+            'document_index': document_index,
+            'blob_store': blob_store,
+            'ledger': None if args.ledger is None else Ledger(args.ledger),
+            'schedule_index': schedule_index,
+            'new_only': args.new_only,
+            'metadata_cache': (None if args.metadata is None
+                               else MetadataCache(args.metadata)),
+            'force': args.force,
+            'fetcher': fetcher,
+            'jobs': args.jobs,
+            'workers': dict(args.workers),
+            'queue_size': args.queue_size}
 
 
 def run_active():
@@ -39,6 +249,7 @@ def run_active():
                                  'critical'],
                         default='info',
                         help='verbosity level, default is "info"')
+    add_common_arguments(parser)
     args = parser.parse_args()
 
     year = int(args.year)
@@ -59,7 +270,8 @@ def run_active():
                  membership_list=args.membership_list,
                  verbose=args.verbose,
                  states=states,
-                 output_file=args.output_file)
+                 output_file=args.output_file,
+                 **common_kwargs(parser, args))
     o.run()
 
 def run_bestrace():
@@ -90,6 +302,7 @@ def run_bestrace():
                         help='membership list', required=True)
     group.add_argument('--rl', dest='race_list',
                        help='race list')
+    add_common_arguments(parser)
     args = parser.parse_args()
 
     year = int(args.year)
@@ -109,7 +322,8 @@ def run_bestrace():
                  membership_list=args.membership_list,
                  race_list=args.race_list,
                  output_file=args.output_file,
-                 verbose=args.verbose)
+                 verbose=args.verbose,
+                 **common_kwargs(parser, args))
     o.run()
 
 
@@ -155,6 +369,7 @@ def run_coolrunning():
     group.add_argument('--rl',
                        dest='race_list',
                        help='race list')
+    add_common_arguments(parser)
     args = parser.parse_args()
 
     year = int(args.year)
@@ -174,7 +389,8 @@ def run_coolrunning():
                     race_list=args.race_list,
                     output_file=args.output_file,
                     states=args.states,
-                    verbose=args.verbose)
+                    verbose=args.verbose,
+                    **common_kwargs(parser, args))
     o.run()
 
 
@@ -214,6 +430,7 @@ def run_compuscore():
     group.add_argument('--rl', dest='race_list',
                        help='race list')
 
+    add_common_arguments(parser)
     args = parser.parse_args()
 
     year = int(args.year)
@@ -228,7 +445,8 @@ def run_compuscore():
                    membership_list=args.membership_list,
                    race_list=args.race_list,
                    output_file=args.output_file,
-                   verbose=args.verbose)
+                   verbose=args.verbose,
+                   **common_kwargs(parser, args))
     o.run()
 
 
@@ -265,11 +483,13 @@ def run_nyrr():
                         help='output file, default is results.html')
     parser.add_argument('--team',
                         dest='team',
-                        default='RARI',
-                        help='team code (i.e. "RARI")')
+                        nargs='+',
+                        default=['RARI'],
+                        help='one or more team codes (i.e. "RARI")')
     group.add_argument('--rl', dest='race_list',
                        help='race list')
 
+    add_common_arguments(parser)
     args = parser.parse_args()
 
     year = int(args.year)
@@ -284,5 +504,85 @@ def run_nyrr():
                   team=args.team,
                   race_list=args.race_list,
                   output_file=args.output_file,
-                  verbose=args.verbose)
+                  verbose=args.verbose,
+                  **common_kwargs(parser, args))
     o.run()
+
+
+def run_assemble():
+    the_description = 'Assemble race fragments into a results file'
+    parser = argparse.ArgumentParser(description=the_description)
+    parser.add_argument('fragment_dir',
+                        help='directory of race fragments')
+    parser.add_argument('-o', '--output',
+                        dest='output_file',
+                        default='results.html',
+                        help='output file, default is results.html')
+    args = parser.parse_args()
+
+    FragmentStore(args.fragment_dir).assemble(args.output_file)
+
+
+def run_query():
+    the_description = 'Query a database of race results'
+    parser = argparse.ArgumentParser(description=the_description)
+    parser.add_argument('db', help='SQLite database written with --db')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--member', dest='member',
+                       help='all results for this member, e.g. "Mark Strawn"')
+    group.add_argument('--date', dest='date',
+                       help='all results for races on this date (YYYY-MM-DD)')
+    parser.add_argument('-y', '--year', dest='year', type=int,
+                        help='restrict --member to this year')
+    args = parser.parse_args()
+
+    if args.member is not None and len(args.member.split()) == 0:
+        parser.error('--member needs a name')
+
+    store = ResultsStore(args.db)
+    if args.member is not None:
+        rows = store.results_for_member(args.member, year=args.year)
+    else:
+        date = datetime.datetime.strptime(args.date, '%Y-%m-%d').date()
+        rows = store.results_on(date)
+    store.close()
+
+    for race_date, provider, race, url, _, _, line in rows:
+        print('{0}  {1}  ({2})  {3}'.format(race_date, race, provider, url))
+        print('    {0}'.format(line.strip()))
+
+
+def run_search():
+    the_description = 'Search the full-text index of downloaded races'
+    parser = argparse.ArgumentParser(description=the_description)
+    parser.add_argument('index', help='SQLite index written with --index')
+    parser.add_argument('text', help='name or words to search for')
+    parser.add_argument('--phrase', dest='phrase', action='store_true',
+                        help='words must appear together in order')
+    parser.add_argument('-n', dest='limit', type=int, default=20,
+                        help='maximum number of hits, default is 20')
+    args = parser.parse_args()
+    if len(args.text.split()) == 0:
+        parser.error('nothing to search for')
+
+    document_index = DocumentIndex(args.index)
+    hits = document_index.search(args.text, phrase=args.phrase,
+                                 limit=args.limit)
+    document_index.close()
+
+    for url, title, race_date, line in hits:
+        print('{0}  {1}  {2}'.format(race_date, title, url))
+        print('    {0}'.format(line))
+
+
+def run_pack():
+    the_description = 'Compact a season of stored pages into a pack file'
+    parser = argparse.ArgumentParser(description=the_description)
+    parser.add_argument('store', help='store directory written with --store')
+    parser.add_argument('season', type=int, help='year to compact')
+    args = parser.parse_args()
+
+    blob_store = BlobStore(args.store)
+    count = blob_store.pack(args.season)
+    blob_store.close()
+    print('Packed {0} pages from {1}.'.format(count, args.season))
@@ -2,16 +2,29 @@
 """
 import csv
 import datetime as dt
-import http
-import http.cookiejar
+import hashlib
 import logging
 import re
-import urllib
-import xml.dom.minidom
-import xml.etree.cElementTree as ET
+import threading
 
 from lxml import etree
 
+from .fetch import Fetcher, FetchError, USER_AGENT
+from .fragments import FragmentStore
+from .fts import html_title, result_lines
+from .ledger import line_hash
+from .metadata import RaceMetadata
+from .output import HtmlWriter
+from .pipeline import Pipeline
+from .schedule import Schedule, as_date
+from .scheduler import FetchScheduler
+from .variants import VariantStats, document_lines, result_format
+
+
+# Bump this whenever a change to the matching would change which lines of
+# an already processed race are matched.
+MATCHER_VERSION = 1
+
 
 class RaceResults:
     """
@@ -22,9 +35,62 @@ class RaceResults:
     memb_list:  membership list
     output_file : str
         All race results written to this file
+    writer : HtmlWriter
+        Streams race results into the output file during a run.
+    fragment_dir : str
+        If set, each race is rendered into its own fragment in this directory
+        and the output file is assembled from all the fragments at the end of
+        the run.
+    sinks : list
+        Each sink receives every matched result as a structured record.
+    document_index : rr.fts.DocumentIndex
+        If set, the result lines of every downloaded race document are
+        indexed, whether or not anyone in the membership list is found.
+    blob_store : rr.blobstore.BlobStore
+        If set, every downloaded document is kept here, filed under the
+        season being searched.
+    ledger : rr.ledger.Ledger
+        If set, race documents that were already processed with the same
+        content and membership list are skipped.  Use with fragment_dir so
+        that the output file still has their results.
+    schedule_index : rr.schedule.ScheduleIndex
+        If set, the races listed on master pages are kept here, so that a
+        master page is only downloaded and parsed again once it is stale.
+    metadata_cache : rr.metadata.MetadataCache
+        If set, the date, title, author and format of each race document
+        are kept here the first time it is seen, so that later runs can
+        decide to skip it without downloading it.
+    new_only : bool
+        If True, only the races on master pages that no earlier run using
+        the schedule index handed on to be fetched are fetched.
+    force : bool
+        If True, process every race document even if the ledger says it is
+        unchanged.
+    fetch_failures : int
+        Race documents that could not be downloaded during the run.
+    corrections : list
+        (url, lines added, lines removed) for each race whose results were
+        re-posted with changes since the ledger last saw them.
+    provider : str
+        Identifies the web site in fragment keys and records.
+    race_date : datetime.date
+        Date of the race currently being processed, if known.
     logger: handles verbosity of program execution.  All is logged to
             standard output.
-    cookies : NYRR requires cookies
+    fetcher : rr.fetch.Fetcher
+        All downloads go through this, so that connections and cookies are
+        shared.  NYRR requires cookies.
+    jobs : int
+        Number of race documents to download at once.
+    workers : dict
+        Number of threads for each pipeline stage other than "fetch", e.g.
+        {'decode': 2}.
+    queue_size : int
+        Most race documents waiting between any two pipeline stages.
+    stage_stats : dict
+        rr.pipeline.StageStats keyed by stage name, for the whole run.
+    variant_stats : rr.variants.VariantStats
+        Result files downloaded in a lighter format than the default.
     html : str
             HTML from downloaded web page
     user_agent:  masquerade as browser because some sites do not like
@@ -32,6 +98,7 @@ class RaceResults:
     downloaded_url:  URL to a race that has been downloaded.  We link back
             to it in the resulting output.
     """
+    provider = None
 
     def __init__(self, verbose='INFO', membership_list=None,
                  start_date=dt.datetime.now() - dt.timedelta(days=7),
@@ -48,6 +115,30 @@ class RaceResults:
         self.start_date = start_date
         self.stop_date = stop_date
         self.output_file = output_file
+        self.writer = None
+        self.race_list = None
+        self.fragment_dir = None
+        self.fragment_store = None
+        self.sinks = []
+        self.document_index = None
+        self.blob_store = None
+        self.ledger = None
+        self.schedule_index = None
+        self.new_only = False
+        # Races taken off master pages this run, to be recorded in the
+        # schedule index as handed on once the run completes.
+        self.races_handed_on = []
+        self.metadata_cache = None
+        self.force = False
+        self.fetch_failures = 0
+        self._failure_lock = threading.Lock()
+        self.matched_urls = set()
+        self.matched_lines = {}
+        self.previous_versions = {}
+        self.corrections = []
+        self.matches = []
+        self.regex = []
+        self.members = []
 
         # Set up a logger for relaying progress back to the user.
         self.logger = logging.getLogger('race_results')
@@ -58,20 +149,34 @@ class RaceResults:
 
         # This may be overridden by a subclass run time.
         self.downloaded_url = None
+        self.race_date = None
 
-        # Not clear if this works or not.
-        user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_6_8) "
-        user_agent += "AppleWebKit/535.19 (KHTML, like Gecko) "
-        user_agent += "Chrome/18.0.1025.45 "
-        user_agent += "Safari/535.19"
-        self.user_agent = user_agent
+        self.user_agent = USER_AGENT
+        self.fetcher = Fetcher(user_agent=self.user_agent)
+        self.jobs = 1
+        self.workers = {}
+        self.queue_size = 8
+        self.stage_stats = {}
+        self.variant_stats = VariantStats()
 
         self.html = None
-        self.cookies = None
 
         self.first_name_regex = None
         self.last_name_regex = None
 
+    def line_matches(self, line):
+        """
+        Match a line of the current race file against the membership list,
+        unless it is unchanged from the version of the race last processed,
+        in which case the earlier decision stands.
+        """
+        previous = self.previous_versions.get(self.downloaded_url)
+        if previous is not None:
+            hashes, matched = previous
+            if line_hash(line) in hashes:
+                return line in matched
+        return self.match_against_membership(line)
+
     def match_against_membership(self, line):
         """
         We have a line of text from the race file.  Match it against the
@@ -82,6 +187,20 @@ class RaceResults:
                 return(True)
         return(False)
 
+    def find_member(self, line):
+        """
+        Determine who in the membership list a line of text matches.
+
+        Returns
+        -------
+        tuple
+            (last name, first name), or None if nobody matches.
+        """
+        for regex, member in zip(self.regex, self.members):
+            if regex.search(line):
+                return member
+        return None
+
     def load_membership_list(self, csv_file):
         """
         Construct regular expressions for each person in the membership list.
@@ -92,7 +211,8 @@ class RaceResults:
             CSV file of club membership
         """
         regex = []
-        for last_name, first_name in self.parse_membership_list(csv_file):
+        self.members = self.parse_membership_list(csv_file)
+        for last_name, first_name in self.members:
             # Use word boundaries to prevent false positives, e.g. "Ed Ford"
             # does not cause every fricking person from "New Bedford" to
             # match.  Here's an example line to match.
@@ -134,71 +254,512 @@ class RaceResults:
         provided list.
         """
         self.initialize_output_file()
-        if self.race_list is None:
-            self.compile_web_results()
-        else:
-            self.compile_local_results()
+        completed = False
+        try:
+            if self.race_list is None:
+                self.compile_web_results()
+                self.record_handed_on()
+            else:
+                self.compile_local_results()
+            completed = True
+        finally:
+            self.finalize_output_file(completed)
+            self.log_corrections()
+            self.log_fetch_stats()
+            self.log_stage_stats()
+            self.log_variant_stats()
+            self.fetcher.close()
+
+    def fetch_failed(self, error, action='going on to next race'):
+        """
+        Log a race document that could not be downloaded.  Such a race is
+        neither processed nor recorded anywhere, so the run must not count
+        it as seen.
+        """
+        with self._failure_lock:
+            self.fetch_failures += 1
+        self.logger.warning('{0}, {1}...'.format(error, action))
+
+    def record_handed_on(self):
+        """
+        Record in the schedule index the races this run took off master
+        pages, once a web run has completed.  If any race could not be
+        downloaded, none are recorded, so that --new-only tries them again.
+        """
+        if self.schedule_index is None or len(self.races_handed_on) == 0:
+            return
+        if self.fetch_failures > 0:
+            msg = ('{0} downloads failed, so the {1} races of this run are '
+                   'not recorded as fetched.')
+            self.logger.warning(msg.format(self.fetch_failures,
+                                           self.provider))
+            return
+        self.schedule_index.hand_on(self.provider, self.races_handed_on)
+        self.races_handed_on = []
+
+    def matcher_version(self):
+        """
+        Identify the membership matching, so that races are processed again
+        when the membership list or the matching code changes.
+        """
+        sha1 = hashlib.sha1(str(MATCHER_VERSION).encode())
+        for last_name, first_name in self.members:
+            sha1.update('\n{0},{1}'.format(last_name, first_name).encode())
+        return sha1.hexdigest()
+
+    def already_processed(self, url, content):
+        """
+        Determine whether a race document can be skipped because the ledger
+        says it was already processed as it is.
+
+        Parameters
+        ----------
+        url : str
+            Where the document came from.
+        content : bytes
+            The document.
+        """
+        if self.ledger is None or self.force:
+            return False
+        digest = hashlib.sha256(content).hexdigest()
+        if self.ledger.unchanged(url, digest, self.matcher_version()):
+            self.logger.info('Skipping unchanged {0}'.format(url))
+            return True
+        return False
+
+    def load_previous_version(self, url):
+        """
+        If the ledger has an earlier version of a race document, processed
+        with the same matcher, remember its lines so that only the lines
+        that have changed are matched again.
+        """
+        if self.ledger is None or self.force:
+            return
+        row = self.ledger.get(url)
+        if row is None or row[1] != self.matcher_version():
+            return
+        previous = self.ledger.previous(url)
+        if previous is not None:
+            self.previous_versions[url] = previous
+
+    def discard_results(self, url):
+        """
+        Forget what earlier runs wrote for a race document whose results
+        were corrected.  Whatever still matches is written again.
+        """
+        for sink in self.sinks:
+            sink.discard(url)
+        if self.fragment_store is not None:
+            self.fragment_store.discard(self.provider, url)
+
+    def document_format(self, url):
+        """
+        Format of a race document, e.g. "csv", if the provider knows it
+        better than the URL does.  None to go by the URL.
+        """
+        return None
+
+    def record_processed(self, url, content):
+        """
+        Record in the ledger that a race document has been processed.
+        """
+        if self.ledger is None:
+            return
+        try:
+            text = content.decode('utf-8')
+        except UnicodeDecodeError:
+            text = content.decode('latin1')
+        lines = document_lines(text, url, self.document_format(url))
+        matched_lines = self.matched_lines.pop(url, [])
+        matched = url in self.matched_urls
+
+        previous = self.previous_versions.pop(url, None)
+        if previous is not None:
+            hashes = {line_hash(line) for line in lines}
+            added = len(hashes - previous[0])
+            removed = len(previous[0] - hashes)
+            self.corrections.append((url, added, removed))
+
+        digest = hashlib.sha256(content).hexdigest()
+        self.ledger.record(url, digest, self.matcher_version(), matched,
+                           lines=lines, matched_lines=matched_lines)
+
+    def log_corrections(self):
+        """
+        Log which races had corrected results posted since the last run.
+        """
+        for url, added, removed in self.corrections:
+            msg = 'Corrected results at {0}: {1} lines added, {2} removed'
+            self.logger.info(msg.format(url, added, removed))
+
+    def log_stage_stats(self):
+        """
+        Log what each pipeline stage did, so that the bottleneck shows.
+        """
+        for stats in self.stage_stats.values():
+            self.logger.info(stats.report())
 
-    def local_tidy(self, local_file=None):
+    def log_variant_stats(self):
+        """
+        Log how much was saved by downloading lighter result files.
+        """
+        for line in self.variant_stats.report():
+            self.logger.info(line)
+
+    def log_fetch_stats(self):
+        """
+        Log how many bytes came from each host, compressed and decoded.
+        """
+        stats = getattr(self.fetcher, 'stats', None)
+        if stats is None:
+            return
+        for line in stats.report():
+            self.logger.info(line)
+
+    def local_tidy(self, html):
         """
         Tidy up the HTML.
         """
-        parser = etree.HTMLParser()
-        tree = etree.parse(local_file, parser)
-        root = tree.getroot()
-        result = etree.tostring(root, pretty_print=True, method="html")
-        with open(local_file, 'wb') as fptr:
-            fptr.write(result)
+        root = etree.fromstring(html, etree.HTMLParser())
+        return etree.tostring(root, pretty_print=True, method="html",
+                              encoding='unicode')
+
+    def index_document(self, lines=None, title=None):
+        """
+        Add the current race document to the full-text index.
+
+        Parameters
+        ----------
+        lines : list
+            Result lines.  By default they are taken from the HTML.
+        title : str
+            Race name.  By default it is taken from the HTML title.
+        """
+        if self.document_index is None or self.downloaded_url is None:
+            return
+        if lines is None:
+            lines = result_lines(self.html)
+        if title is None and self.html is not None:
+            title = html_title(self.html)
+        self.document_index.add(self.downloaded_url, lines,
+                                provider=self.provider, title=title,
+                                date=self.race_date)
+
+    def add_match(self, line, columns=None):
+        """
+        Remember a matched result for the structured outputs.
+
+        Parameters
+        ----------
+        line : str
+            The result as it appears in the race file.
+        columns : list
+            The individual fields of the result.  If not given, the line is
+            split on runs of two or more spaces.
+        """
+        if columns is None:
+            columns = re.split(r'\s{2,}', line.strip())
+        self.matches.append((line, columns))
+        if self.ledger is not None:
+            lines = self.matched_lines.setdefault(self.downloaded_url, [])
+            lines.append(line)
+
+    def add_match_row(self, tr):
+        """
+        Remember a matched table row for the structured outputs.
+
+        Parameters
+        ----------
+        tr : lxml.etree.Element
+            <TR> element with one <TD> per field.
+        """
+        columns = [' '.join(''.join(td.itertext()).split())
+                   for td in tr.getchildren()]
+        self.add_match(' '.join(columns), columns)
+
+    def write_records(self, race):
+        """
+        Send the matches for the current race to each of the sinks.
+
+        Parameters
+        ----------
+        race : str
+            Race name.
+        """
+        if self.race_date is None:
+            race_date = None
+        else:
+            race_date = self.race_date.isoformat()
+        for line, columns in self.matches:
+            record = {'provider': self.provider,
+                      'race': race,
+                      'date': race_date,
+                      'url': self.downloaded_url,
+                      'line': line,
+                      'columns': columns,
+                      'member': self.find_member(line)}
+            for sink in self.sinks:
+                sink.write(record)
+        self.matches = []
 
     def insert_race_results(self, results):
         """
         Insert HTML-ized results into the output file.
         """
-        parser = etree.HTMLParser()
-        tree = etree.parse(self.output_file, parser)
-        root = tree.getroot()
-        body = root.findall('.//body')[0]
-        body.append(results)
+        race = results.findtext('.//h1') or results.findtext('.//h2') or ''
+        self.write_records(race.strip())
+        self.matched_urls.add(self.downloaded_url)
+        self.write_race(results)
 
-        result = etree.tostring(root, pretty_print=True, method="html")
-        with open(self.output_file, 'wb') as fptr:
-            fptr.write(result)
-        self.local_tidy(local_file=self.output_file)
+    def write_race(self, results):
+        """
+        Write a rendered race to the fragment store or the output file.
+        """
+        if self.fragment_store is not None:
+            self.fragment_store.put(self.provider, self.race_date,
+                                    self.downloaded_url, results)
+        else:
+            self.writer.write(results)
 
-    def download_file(self, url, local_file=None, params=None):
+    def download_file(self, url, params=None):
         """
-        Download a URL to a local file.
+        Download a URL into self.html.
 
         Args
         ----
             url:  The URL to retrieve
-            local_file:  Name of the file where we will store the web page.
-            params:  POST parameters to supply
+            params:  dictionary of POST parameters to supply
         """
         # Store the url in case we need it later.
         self.downloaded_url = url
 
-        # cookie support needed for NYRR results.
-        if self.cookies is None:
-            self.cookies = http.cookiejar.LWPCookieJar()
-        cookie_processor = urllib.request.HTTPCookieProcessor(self.cookies)
-        opener = urllib.request.build_opener(cookie_processor)
-        urllib.request.install_opener(opener)
-
-        headers = {'User-Agent': self.user_agent}
-        req = urllib.request.Request(url, None, headers)
-        response = urllib.request.urlopen(req, params)
-        html = response.readall()
-        try:
-            html = html.decode('utf-8')
-        except UnicodeDecodeError:
-            html = html.decode('latin1')
+        response = self.fetcher.fetch(url, data=params)
+        self.store_document(url, response)
+        self.html = response.text
 
-        if local_file is not None:
-            with open(local_file, 'wb') as fptr:
-                fptr.write(html.encode())
+    def store_document(self, url, response):
+        """
+        Keep a downloaded document in the blob store, if there is one.
+        """
+        if self.blob_store is None:
+            return
+        self.blob_store.put(url, response.content,
+                            season=self.start_date.year)
+
+    def search_years(self):
+        """
+        The years covered by the date range, for providers with a master
+        page per year.
+        """
+        return range(self.start_date.year, self.stop_date.year + 1)
+
+    def cached_schedule(self, key):
+        """
+        The races of a master page, if the schedule index has them and they
+        are not stale.
+
+        Parameters
+        ----------
+        key : str
+            Master page, as given by rr.schedule.schedule_key.
+        """
+        if self.schedule_index is None:
+            return None
+        schedule = self.schedule_index.get(self.provider, key)
+        if schedule is not None:
+            self.logger.info('Using the schedule indexed for {0}'.format(key))
+        return schedule
+
+    def save_schedule(self, key, entries):
+        """
+        Keep the races just parsed from a master page in the schedule index.
+
+        Returns
+        -------
+        rr.schedule.Schedule
+        """
+        if self.schedule_index is None:
+            return Schedule(entries)
+        return self.schedule_index.put(self.provider, key, entries)
+
+    def races_between(self, schedule):
+        """
+        The races of a master page that are in the date range and, if only
+        new races are wanted, were not handed on by an earlier run.
+
+        Returns
+        -------
+        list
+            rr.schedule.ScheduleEntry for each race.
+        """
+        entries = schedule.between(self.start_date, self.stop_date)
+        if self.schedule_index is None:
+            return entries
+        if self.new_only:
+            handed_on = self.schedule_index.handed_on(self.provider)
+            new = [entry for entry in entries if entry.url not in handed_on]
+            msg = 'Skipping {0} races fetched by an earlier run...'
+            self.logger.info(msg.format(len(entries) - len(new)))
+            entries = new
+        self.races_handed_on.extend(entry.url for entry in entries)
+        return entries
+
+    def master_schedules(self, urls, parse):
+        """
+        The races listed on master pages.  Those pages that the schedule
+        index does not have are downloaded all at once and parsed.
+
+        Parameters
+        ----------
+        urls : list
+            Master page URLs.
+        parse : callable
+            Takes the URL and text of a master page and returns a list of
+            rr.schedule.ScheduleEntry.
+
+        Returns
+        -------
+        dict
+            rr.schedule.Schedule keyed by URL.  Pages that could not be
+            downloaded are logged and left out.
+        """
+        schedules = {}
+        missing = []
+        for url in urls:
+            schedule = self.cached_schedule(url)
+            if schedule is None:
+                missing.append(url)
+            else:
+                schedules[url] = schedule
+        if len(missing) == 0:
+            return schedules
+
+        scheduler = FetchScheduler(self.fetcher)
+        for url, response, error in scheduler.fetch_all(missing,
+                                                        jobs=len(missing)):
+            if error is not None:
+                self.logger.warning('{0}, skipping it...'.format(error))
+                continue
+            self.logger.info('Downloaded {0}.'.format(url))
+            self.store_document(url, response)
+            schedules[url] = self.save_schedule(url,
+                                                parse(url, response.text))
+        return schedules
+
+    def race_metadata(self, url):
+        """
+        What the metadata cache knows about a race document.
+
+        Returns
+        -------
+        rr.metadata.RaceMetadata
+            Or None if there is no cache or the document has not been seen.
+        """
+        if self.metadata_cache is None:
+            return None
+        return self.metadata_cache.get(url)
+
+    def remember_metadata(self, url, date=None, title=None, author=None,
+                          fmt=None):
+        """
+        Fill in the metadata cache for a race document.  The format goes by
+        the URL unless given.
+        """
+        if self.metadata_cache is None or url is None:
+            return
+        if fmt is None:
+            fmt = result_format(url)
+        metadata = RaceMetadata(date, title, author, fmt)
+        self.metadata_cache.put(url, metadata)
+
+    def date_known_out_of_range(self, url):
+        """
+        Whether the metadata cache says that a race was run outside the date
+        range, in which case it need not be downloaded.
+        """
+        metadata = self.race_metadata(url)
+        if metadata is None or metadata.date is None:
+            return False
+        return not (as_date(self.start_date) <= metadata.date
+                    <= as_date(self.stop_date))
+
+    def fetch_all(self, urls):
+        """
+        Download a batch of race documents concurrently.
+
+        Parameters
+        ----------
+        urls : list
+            URLs, or (URL, dict) pairs where the dictionary holds keyword
+            arguments for the fetcher.
+
+        Yields
+        ------
+        tuple
+            (url, response) for each document as it arrives.  Documents that
+            could not be downloaded are logged and skipped, as are documents
+            the ledger says are unchanged.  Each document is recorded in the
+            ledger once the caller has processed it.
+        """
+        scheduler = FetchScheduler(self.fetcher, jobs=self.jobs)
+
+        def discover():
+            # Race results rarely change once they are old enough, so a
+            # cached copy may be used without asking the server.
+            for url in urls:
+                url, kwargs = (url, {}) if isinstance(url, str) else url
+                if kwargs.get('data') is None:
+                    kwargs = dict(kwargs, immutable=True)
+                yield url, kwargs
+
+        def fetch(request):
+            url, kwargs = request
+            self.logger.info('Downloading {0}...'.format(url))
+            try:
+                return url, scheduler.fetch(url, kwargs)
+            except FetchError as error:
+                self.fetch_failed(error)
+                return None
+
+        def fetch_all():
+            # The fetcher's own fetch_all multiplexes the downloads, e.g. on
+            # an event loop, rather than holding a thread for each.
+            for url, response, error in scheduler.fetch_all(discover()):
+                if error is not None:
+                    self.fetch_failed(error)
+                    continue
+                self.logger.info('Downloaded {0}.'.format(url))
+                yield url, response
+
+        def decode(item):
+            # The decoded text is cached on the response.
+            item[1].text
+            return item
+
+        # Downloading and decoding run ahead on their own threads while
+        # this one matches and renders, but never more than a few races
+        # ahead.
+        if hasattr(self.fetcher, 'fetch_all'):
+            pipeline = Pipeline(fetch_all(), name='fetch',
+                                queue_size=self.queue_size,
+                                stats=self.stage_stats)
         else:
-            self.html = html
+            pipeline = Pipeline(discover(), queue_size=self.queue_size,
+                                stats=self.stage_stats)
+            pipeline.add_stage('fetch', fetch, workers=self.jobs)
+        pipeline.add_stage('decode', decode,
+                           workers=self.workers.get('decode', 1))
+        for url, response in pipeline:
+            self.store_document(url, response)
+            if self.already_processed(url, response.content):
+                continue
+            self.load_previous_version(url)
+            if url in self.previous_versions:
+                self.discard_results(url)
+            # Nothing learned about the last race carries over to this one.
+            self.race_date = None
+            yield url, response
+            self.record_processed(url, response.content)
 
     def construct_source_url_reference(self, source):
         """
@@ -227,10 +788,14 @@ class RaceResults:
         """
         Go through a single race file and collect results.
         """
+        self.matches = []
+        self.index_document()
         results = []
-        for line in self.html.split('\n'):
-            if self.match_against_membership(line):
+        for line in document_lines(self.html, self.downloaded_url,
+                                   self.document_format(self.downloaded_url)):
+            if self.line_matches(line):
                 results.append(line)
+                self.add_match(line)
 
         if len(results) > 0:
             results = self.webify_results(results)
@@ -244,12 +809,12 @@ class RaceResults:
                 filename = line.rstrip()
                 with open(filename, 'rt') as fptr:
                     self.html = fptr.read()
+                self.race_date = None
                 self.compile_race_results()
 
     def initialize_output_file(self):
         """
-        Construct a skeleton of the results of parsing race results from
-        BestRace.
+        Start streaming a skeleton of the results of parsing race results.
 
         <html>
             <head>
@@ -259,24 +824,51 @@ class RaceResults:
                 STUFF TO GO HERE
             </body>
         </html>
-        """
-        ofile = ET.Element('html')
-        head = ET.SubElement(ofile, 'head')
-        link = ET.SubElement(head, 'link')
-        link.set('rel', 'stylesheet')
-        link.set('href', 'rr.css')
-        link.set('type', 'text/css')
-        ET.SubElement(ofile, 'body')
-        ET.ElementTree(ofile).write(self.output_file)
-        pretty_print_xml(self.output_file)
 
+        If a fragment directory was given, races go there instead and the
+        output file is assembled when the run is finalized.  Without one, a
+        race the ledger would skip would be missing from the output file, so
+        every race is processed.
+        """
+        if self.fragment_dir is not None:
+            self.fragment_store = FragmentStore(self.fragment_dir)
+        else:
+            self.writer = HtmlWriter(self.output_file)
+            if self.ledger is not None and not self.force:
+                msg = ('The ledger needs a fragment directory to skip '
+                       'races, processing all of them.')
+                self.logger.warning(msg)
+                self.force = True
+
+    def finalize_output_file(self, completed=True):
+        """
+        Close out the body and move the finished output file into place.
 
-def pretty_print_xml(xml_file):
-    """
-    Taken from StackOverflow
-    """
-    xml_string = xml.dom.minidom.parse(xml_file)
-    pp_string = xml_string.toprettyxml()
-    fptr = open(xml_file, 'w')
-    fptr.write(pp_string)
-    fptr.close()
+        Parameters
+        ----------
+        completed : bool
+            If False, the run failed part way, so the output file is left
+            as it was rather than replaced by partial results.
+        """
+        if not completed:
+            msg = 'Run did not complete, leaving {0} as it was.'
+            self.logger.warning(msg.format(self.output_file))
+        if self.fragment_store is not None and completed:
+            self.fragment_store.assemble(self.output_file)
+        if self.writer is not None:
+            if completed:
+                self.writer.close()
+            else:
+                self.writer.abort()
+        for sink in self.sinks:
+            sink.close()
+        if self.document_index is not None:
+            self.document_index.close()
+        if self.blob_store is not None:
+            self.blob_store.close()
+        if self.ledger is not None:
+            self.ledger.close()
+        if self.schedule_index is not None:
+            self.schedule_index.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.close()
@@ -2,6 +2,7 @@
 Backend class for handling CoolRunning race results.
 """
 
+import datetime
 import logging
 import re
 import tempfile
@@ -11,6 +12,28 @@ import lxml
 from lxml import etree
 
 from .common import RaceResults
+from .fetch import FetchError
+from .fts import html_title
+from .pipeline import Pipeline
+from .schedule import ScheduleEntry
+from .scheduler import FetchScheduler
+
+
+# Races on a state's master file, e.g. /results/07/ma/Jan16_Coloni_set1.shtml
+STATE_MASTER_LINK = re.compile(r"""(?P<path>/results/
+                                   (?P<year>\d\d)/
+                                   (?P<state>[a-z]+)/
+                                   (?P<day>[A-Z][a-z]{2}\d{1,2})_
+                                   [^"'<>\s]*?\.shtml)""", re.VERBOSE)
+
+# Authors whose result files compile_race_results does not parse.
+SKIPPED_AUTHORS = ['colonial', 'opportunity', 'Harriers', 'jalfano',
+                   'DavidWill', 'FFAST', 'lungne', 'northeastracers', 'sri',
+                   'WCRCSCOTT']
+
+# Links from the first result file of a race to the others, such as
+# <a href="./Jan16_Coloni_set2.shtml">.
+SECONDARY_LINK = re.compile(r'<a href="\./(?P<race_file>[^"/]+\.shtml)">')
 
 
 class CoolRunning(RaceResults):
@@ -22,7 +45,12 @@ class CoolRunning(RaceResults):
     author : str
         Identifier for the authority or racing company that produced the
         results.
+    race_sections : list
+        Rendered result files of the race being assembled, or None if each
+        result file is written out on its own.
     """
+    provider = 'coolrunning'
+
     def __init__(self, verbose='INFO', states=None,
                  membership_list=None, output_file=None, **kwargs):
         """
@@ -47,95 +75,267 @@ class CoolRunning(RaceResults):
         self.base_url = 'http://www.coolrunning.com'
 
         self.author = None
+        self.race_sections = None
 
     def compile_web_results(self):
         """
         Download the requested results and compile them.
         """
-        for state in self.states:
-            self.download_state_master_file(state)
-            self.process_state_master_file(state)
+        # Every state's master file is needed before anything else can
+        # happen, so fetch them all at once.
+        masters = {state: [self.state_master_url(state, year)
+                           for year in self.search_years()]
+                   for state in self.states}
+        schedules = self.master_schedules(
+            [url for state in self.states for url in masters[state]],
+            self.parse_state_master_file)
 
-    def construct_state_match_pattern(self, state):
+        for state in self.states:
+            urls = []
+            for url in masters[state]:
+                if url not in schedules:
+                    continue
+                entries = self.races_between(schedules[url])
+                urls.extend(entry.url for entry in entries
+                            if not self.author_skipped(entry.url))
+            self.logger.info('Processing %s...' % state)
+            for race in self.fetch_races(urls):
+                self.process_race_sets(race)
+
+    def get_race_date(self, url):
         """
-        Want to match strings like
+        Determine the race date from a race URL such as
 
         http://www.coolrunning.com/results/07/ma/Jan16_Coloni_set1.shtml
+        """
+        parts = url.split('/')
+        datestr = parts[-3] + parts[-1].split('_')[0]
+        return datetime.datetime.strptime(datestr, '%y%b%d').date()
 
-        So we construct a regular expression to match against
-        all the dates in the specified range.
+    def parse_state_master_file(self, url, html):
         """
-        pattern = '/results/'
-        pattern += self.start_date.strftime('%y')
-        pattern += '/'
-        pattern += state
-        pattern += '/'
-        pattern += self.start_date.strftime('%b')
+        Collect the races listed on a state's master file.  Only the first
+        set of each race is listed, e.g.
 
-        # continue with a regexp to match any of the days in the range.
-        # It's a non-capturing group.
-        day_range = '(?:'
-        for day in range(self.start_date.day, self.stop_date.day):
-            day_range += "%d_|" % day
-        day_range += '%d_)' % self.stop_date.day
+        http://www.coolrunning.com/results/07/ma/Jan16_Coloni_set1.shtml
 
-        pattern += day_range
+        and the race date is taken from the URL.
 
-        pattern += '.*shtml'
-        self.logger.debug('Match pattern is %s' % pattern)
-        regex = re.compile(pattern)
-        return regex
+        Returns
+        -------
+        list
+            rr.schedule.ScheduleEntry for each race.
+        """
+        entries = []
+        seen = set()
+        for matchobj in STATE_MASTER_LINK.finditer(html):
+            race_url = 'http://www.coolrunning.com' + matchobj.group('path')
+            if race_url in seen:
+                continue
+            seen.add(race_url)
+            datestr = matchobj.group('year') + matchobj.group('day')
+            try:
+                date = datetime.datetime.strptime(datestr, '%y%b%d').date()
+            except ValueError:
+                continue
+            entries.append(ScheduleEntry(date, None, race_url,
+                                         matchobj.group('state')))
+        return entries
 
-    def process_state_master_file(self, state):
+    def author_skipped(self, url):
         """
-        Compile results for the specified state.
-        We assume that we have the state file stored locally.
+        Whether the metadata cache says that a race was posted by someone
+        whose results are not parsed, in which case it need not be
+        downloaded.
         """
-        local_state_file = state + '.shtml'
-        regex = self.construct_state_match_pattern(state)
-
-        with open(local_state_file, 'r') as fptr:
-            markup = fptr.read()
-
-        relative_urls = regex.findall(markup)
+        metadata = self.race_metadata(url)
+        if metadata is None or metadata.author not in SKIPPED_AUTHORS:
+            return False
+        msg = 'Skipping {0}, posted by {1}.'
+        self.logger.info(msg.format(url, metadata.author))
+        return True
+
+    def fetch_races(self, urls):
+        """
+        Download races concurrently, each along with its secondary result
+        files.
 
-        for relative_url in relative_urls:
+        Parameters
+        ----------
+        urls : list
+            URLs of the first result file of each race.
+
+        Yields
+        ------
+        list
+            (url, response) for each result file of a race, first result
+            file first.  A race is skipped if the ledger says none of its
+            result files have changed.
+        """
+        scheduler = FetchScheduler(self.fetcher, jobs=self.jobs)
+
+        def fetch(url):
+            self.logger.info('Downloading {0}...'.format(url))
+            try:
+                response = scheduler.fetch(url, {'immutable': True})
+            except FetchError as error:
+                self.fetch_failed(error)
+                return None
+            return fetch_secondaries((url, response))
+
+        def fetch_all():
+            # The fetcher's own fetch_all multiplexes the first result files,
+            # e.g. on an event loop, rather than holding a thread for each.
+            requests = ((url, {'immutable': True}) for url in urls)
+            for url, response, error in scheduler.fetch_all(requests):
+                if error is not None:
+                    self.fetch_failed(error)
+                    continue
+                self.logger.info('Downloaded {0}.'.format(url))
+                yield url, response
+
+        def fetch_secondaries(first):
+            url, response = first
+
+            # The other result files are only known once the first has
+            # arrived, but they can then all be fetched at once.
+            inner_urls = self.secondary_urls(url, response.text)
+            requests = [(inner_url, {'immutable': True})
+                        for inner_url in inner_urls]
+            inner = {}
+            for inner_url, inner_response, error in scheduler.fetch_all(
+                    requests, jobs=max(1, len(requests))):
+                if error is not None:
+                    self.fetch_failed(error, 'skipping it')
+                    continue
+                inner_response.text
+                inner[inner_url] = inner_response
+            return [(url, response)] + [(inner_url, inner[inner_url])
+                                        for inner_url in inner_urls
+                                        if inner_url in inner]
+
+        def decode(race):
+            # The decoded text is cached on the response.
+            race[0][1].text
+            return race
+
+        if hasattr(self.fetcher, 'fetch_all'):
+            pipeline = Pipeline(fetch_all(), name='fetch',
+                                queue_size=self.queue_size,
+                                stats=self.stage_stats)
+            # These workers only wait on the fetcher for each race's
+            # secondary result files.
+            pipeline.add_stage('fetch sets', fetch_secondaries,
+                               workers=self.jobs)
+        else:
+            pipeline = Pipeline(iter(urls), queue_size=self.queue_size,
+                                stats=self.stage_stats)
+            pipeline.add_stage('fetch', fetch, workers=self.jobs)
+        pipeline.add_stage('decode', decode,
+                           workers=self.workers.get('decode', 1))
+        for race in pipeline:
+            for url, response in race:
+                self.store_document(url, response)
+            # A race is rendered as a whole, so if any of its result files
+            # changed, all of them are processed again.
+            if all(self.already_processed(url, response.content)
+                   for url, response in race):
+                continue
+            for url, _ in race:
+                self.load_previous_version(url)
+            if any(url in self.previous_versions for url, _ in race):
+                for url, _ in race:
+                    self.discard_results(url)
+            yield race
+            for url, response in race:
+                self.record_processed(url, response.content)
+
+    def process_race_sets(self, race):
+        """
+        Compile results from all the result files of a race into a single
+        section of the output.
 
-            top_level_url = 'http://www.coolrunning.com' + relative_url
-            race_file = top_level_url.split('/')[-1]
-            self.logger.info(top_level_url)
-            self.download_file(top_level_url)
-            self.compile_race_results()
+        Parameters
+        ----------
+        race : list
+            (url, response) for each result file, first result file first.
+        """
+        self.race_sections = []
+        try:
+            for url, response in race:
+                self.process_race(url, response)
+        finally:
+            sections, self.race_sections = self.race_sections, None
+        if len(sections) == 0:
+            return
 
-            # Now collect any secondary result files.
-            markup = self.html
+        # The first section keeps its race header, the others contribute
+        # their source reference and results.
+        section = sections[0]
+        for other in sections[1:]:
+            for elt in list(other):
+                if elt.tag not in ['hr', 'h1', 'h2']:
+                    section.append(elt)
+
+        top_level_url = race[0][0]
+        self.downloaded_url = top_level_url
+        self.race_date = self.get_race_date(top_level_url)
+        # The section is kept under the first result file's URL.
+        self.matched_urls.add(top_level_url)
+        RaceResults.write_race(self, section)
+
+    def write_race(self, results):
+        """
+        Hold on to a rendered result file if the rest of its race is still
+        being compiled.
+        """
+        if self.race_sections is not None:
+            self.race_sections.append(results)
+        else:
+            RaceResults.write_race(self, results)
 
-            # construct the secondary pattern.  If the race name is something
-            # like "TheRaceSet1.shtml", then the secondary races will be
-            # "TheRaceSet[2345].shmtl" etc.
-            parts = race_file.split('.')
-            base = parts[-2][0:-1]
-            pat = r'<a href="(?P<inner_url>\.\/' + base + r'\d+\.shtml)">'
-            inner_regex = re.compile(pat)
-            for matchobj in inner_regex.finditer(markup):
+    def process_race(self, url, response):
+        """
+        Compile results from a downloaded race file.
+        """
+        self.downloaded_url = url
+        self.race_date = self.get_race_date(url)
+        self.html = response.text
+        self.compile_race_results()
 
-                relative_inner_url = matchobj.group('inner_url')
-                if relative_inner_url in top_level_url:
-                    # Already seen this one.
-                    continue
+    def secondary_urls(self, top_level_url, markup):
+        """
+        Collect the URLs of any secondary result files linked from the first
+        result file of a race.
+        """
+        # construct the secondary pattern.  If the race name is something
+        # like "TheRaceSet1.shtml", then the secondary races will be
+        # "TheRaceSet[2345].shmtl" etc.
+        race_file = top_level_url.split('/')[-1]
+        parts = race_file.split('.')
+        base = parts[-2][0:-1]
+
+        inner_urls = []
+        seen = {race_file}
+        for matchobj in SECONDARY_LINK.finditer(markup):
+
+            inner_race_file = matchobj.group('race_file')
+            setnum = inner_race_file[len(base):-len('.shtml')]
+            if not inner_race_file.startswith(base) or not setnum.isdigit():
+                # Some other link.
+                continue
+            if inner_race_file in seen:
+                # Already seen this one.
+                continue
+            seen.add(inner_race_file)
 
-                # Strip off the leading "./" to get the name we use for the
-                # local file.
-                race_file = relative_inner_url[2:]
+            # Form the full inner url by swapping out the top level
+            # url
+            lst = top_level_url.split('/')
+            lst[-1] = inner_race_file
+            inner_urls.append('/'.join(lst))
 
-                # Form the full inner url by swapping out the top level
-                # url
-                lst = top_level_url.split('/')
-                lst[-1] = race_file
-                inner_url = '/'.join(lst)
-                self.logger.info(inner_url)
-                self.download_file(inner_url)
-                self.compile_race_results()
+        return inner_urls
 
     def compile_vanilla_results(self):
         """
@@ -155,8 +355,9 @@ class CoolRunning(RaceResults):
         text = matchobj.group('race_text')
         results = []
         for line in text.split('\n'):
-            if self.match_against_membership(line):
+            if self.line_matches(line):
                 results.append(line)
+                self.add_match(line)
 
         return results
 
@@ -197,6 +398,7 @@ class CoolRunning(RaceResults):
                 lregex = self.last_name_regex[idx]
                 if fregex.search(runner_name) and lregex.search(runner_name):
                     results.append(tr)
+                    self.add_match_row(tr)
 
         if len(results) > 0:
             # Prepend the header.
@@ -239,8 +441,13 @@ class CoolRunning(RaceResults):
         """
         Go through a race file and collect results.
         """
+        self.matches = []
+        self.index_document()
         html = None
         self.get_author()
+        self.remember_metadata(self.downloaded_url, date=self.race_date,
+                               title=html_title(self.html),
+                               author=self.author)
         if self.author in ['CapeCodRoadRunners']:
             self.logger.debug('Cape Cod Road Runners pattern')
             results = self.compile_ccrr_race_results()
@@ -405,18 +612,14 @@ class CoolRunning(RaceResults):
                              r'&amp;', banner_text)
         return banner_text
 
-    def download_state_master_file(self, state):
+    def state_master_url(self, state, year=None):
         """
-        Download results for the specified state.
-
-        The URL will have the pattern
+        URL of the master file listing a state's races in a year, e.g.
 
         http://www.coolrunning.com/results/[YY]/[STATE].shtml
-
         """
-        self.logger.info('Processing %s...' % state)
+        if year is None:
+            year = self.start_date.year
         state_file = '{0}.shtml'.format(state)
-        url = 'http://www.coolrunning.com/results/{0}/{1}'
-        url = url.format(self.start_date.strftime('%y'), state_file)
-        self.logger.info('Downloading {0}.'.format(url))
-        self.download_file(url, local_file=state_file)
+        url = 'http://www.coolrunning.com/results/{0:02d}/{1}'
+        return url.format(year % 100, state_file)
@@ -3,18 +3,23 @@ Module for parsing Compuscore race results.
 """
 
 import datetime
+import json
 import logging
 import re
-import requests
-import urllib
 import warnings
 
 from lxml import etree
 
 from .common import RaceResults
+from .fetch import FetchError, Response
+from .scheduler import FetchScheduler
+from .variants import choose_variant, result_format, variant_format
 
 logging.basicConfig()
 
+# Most events asked about in a single event-detail request.
+DETAIL_BATCH_SIZE = 25
+
 # Need to match the month of the search window to the month strings that
 # Compuscore uses.
 MONTHSTRS = {1: 'janfeb',
@@ -31,10 +36,33 @@ MONTHSTRS = {1: 'janfeb',
              12: 'novdec', }
 
 
+def event_date(details):
+    """
+    Date of an event from its details in the API, or None if they do not
+    give one.
+    """
+    for key in ['date', 'start_date', 'event_date']:
+        value = details.get(key)
+        if not value:
+            continue
+        try:
+            return datetime.date.fromisoformat(str(value)[:10])
+        except ValueError:
+            continue
+    return None
+
+
 class CompuScore(RaceResults):
     """
     Class for handling compuscore results.
+
+    Attributes
+    ----------
+    api_url : str
+        Root of the race results API.
     """
+    provider = 'compuscore'
+
     def __init__(self, verbose='INFO', membership_list=None,
                  output_file=None, **kwargs):
         """
@@ -53,6 +81,7 @@ class CompuScore(RaceResults):
         RaceResults.__init__(self, verbose=verbose,
                              membership_list=membership_list,
                              output_file=output_file)
+        self.api_url = 'http://www.compuscore.com/api/races'
         self.__dict__.update(**kwargs)
 
         if self.start_date is not None:
@@ -61,43 +90,181 @@ class CompuScore(RaceResults):
         # Need to remember the current URL.
         self.downloaded_url = None
 
+        # Race name, date and format from the API, keyed by result file
+        # URL, for result files that do not carry them, such as plain text
+        # exports.
+        self.race_info = {}
+
     def compile_web_results(self):
         """
         Download the requested results and compile them.
         """
-        fmt = 'http://www.compuscore.com/api/races/events?date_range={},{}'
-        url = fmt.format(self.start_date.strftime('%Y-%m-%d'),
+        fmt = '{}/events?date_range={},{}'
+        url = fmt.format(self.api_url, self.start_date.strftime('%Y-%m-%d'),
                          self.stop_date.strftime('%Y-%m-%d'))
-        response = requests.get(url)
+        response = self.fetcher.fetch(url)
+        ids = [event['id'] for event in response.json()['events']]
 
-        # Get the list of races from the json dump.
-        for event in response.json()['events']:
+        # And finally, download the races themselves.  They start
+        # downloading while the details of later events are still coming in.
+        for url, race_resp in self.fetch_all(self.result_file_urls(ids)):
+            self.downloaded_url = url
+            self.html = race_resp.text
+            self.compile_race_results()
+            # The result file's own date, if it has one, beats the event's.
+            if self.race_date is not None:
+                self.remember_metadata(url, date=self.race_date)
 
-            # Now get the race details, from where we get the race URL.
-            url2 = 'http://www.compuscore.com/api/races/event-detail?ids={}'
-            url2 = url2.format(event['id'])
-            details = requests.get(url2).json()
-            race_name = details['events'][0]['name']
+    def result_file_urls(self, ids):
+        """
+        Generate the URL of the result file of each race of some events.
+        """
+        for details in self.event_details(ids):
+            race_name = details['name']
             print('Examining {}'.format(race_name))
-            for sub_event in details['events'][0]['races']:
+            for sub_event in details['races']:
                 print('    Examining {}'.format(sub_event['name']))
-                try:
-                    web_details = sub_event['result_files'][0]
-                except IndexError:
+                variants = self.result_file_variants(sub_event)
+                chosen = choose_variant(variants)
+                if chosen is None:
                     print('Skipping {}'.format(race_name))
                     continue
+                url = chosen[0]
+                if self.date_known_out_of_range(url):
+                    self.logger.info('Date of {0} not in range...'.format(url))
+                    continue
+                self.variant_stats.add(self.provider, chosen, variants[0])
+                name = ' - '.join(part for part in [race_name,
+                                                    sub_event.get('name')]
+                                  if part)
+                race_date = event_date(details)
+                self.race_info[url] = (name, race_date, chosen[2])
+                if self.race_metadata(url) is None:
+                    self.remember_metadata(url, date=race_date, title=name,
+                                           fmt=chosen[2])
+                yield url
 
-                # And finally, download the race itself.
-                url3 = 'http://{site}{rel_url}'
-                url3 = url3.format(site=web_details['webfile']['domain'],
-                                   rel_url=web_details['webfile']['resource'])
-                race_resp = requests.get(url3)
-                self.downloaded_url = url3
-                try:
-                    self.html = race_resp.content.decode('utf-8')
-                except UnicodeDecodeError:
-                    self.html = race_resp.content.decode('latin1')
-                self.compile_race_results()
+    def result_file_variants(self, sub_event):
+        """
+        Every file a race's results are published in.
+
+        Each entry of a race's "result_files" may list more than one file,
+        e.g. a "webfile" next to a text or CSV export.
+
+        Returns
+        -------
+        list
+            (url, size, format) tuples, the first being the HTML "webfile"
+            of the first entry if there is one.  The size is None unless the
+            API lists it.  The format goes by the listed content type or
+            the key the file is listed under before the URL.
+        """
+        variants = []
+        for result_file in sub_event.get('result_files', []):
+            # The "webfile" is what has always been downloaded.
+            files = sorted(result_file.items(),
+                           key=lambda item: item[0] != 'webfile')
+            for key, details in files:
+                if not isinstance(details, dict) or 'resource' not in details:
+                    continue
+                url = 'http://{site}{rel_url}'
+                url = url.format(site=details['domain'],
+                                 rel_url=details['resource'])
+                size = details.get('size')
+                content_type = (details.get('content_type')
+                                or details.get('mime_type'))
+                variants.append((url, None if size is None else int(size),
+                                 variant_format(url, key, content_type)))
+        return variants
+
+    def document_format(self, url):
+        """
+        Format of a result file as the API listed it.
+        """
+        return self.race_info.get(url, (None, None, None))[2]
+
+    def event_detail_url(self, ids):
+        """
+        URL of the details of one or more events.
+        """
+        return '{}/event-detail?ids={}'.format(
+            self.api_url, ','.join(str(event_id) for event_id in ids))
+
+    def event_details(self, ids):
+        """
+        Look up the details of events, where the URLs of their result files
+        are to be found.
+
+        Details are requested for many events at once, and each event's
+        details are cached on their own, so that an event already seen is
+        not asked about again once its details are old enough not to
+        change.
+
+        Parameters
+        ----------
+        ids : list
+            Event IDs.
+
+        Yields
+        ------
+        dict
+            Details of each event that could be looked up, in the order
+            given.
+        """
+        cache = getattr(self.fetcher, 'cache', None)
+        details = {}
+        missing = []
+        for event_id in ids:
+            entry = None
+            if cache is not None:
+                entry = cache.get(self.event_detail_url([event_id]))
+            if entry is not None and cache.is_immutable(entry):
+                details[event_id] = entry.response().json()['events'][0]
+            else:
+                missing.append(event_id)
+
+        urls = [self.event_detail_url(missing[j:j + DETAIL_BATCH_SIZE])
+                for j in range(0, len(missing), DETAIL_BATCH_SIZE)]
+        scheduler = FetchScheduler(self.fetcher)
+        for url, response, error in scheduler.fetch_all(
+                urls, jobs=max(1, len(urls))):
+            if error is not None:
+                self.logger.warning(str(error))
+                continue
+            for event in response.json()['events']:
+                details[event['id']] = event
+                if cache is not None:
+                    self.cache_event_details(cache, event)
+
+        # Ask about anything a batch did not answer for on its own.
+        for event_id in missing:
+            if event_id in details:
+                continue
+            url = self.event_detail_url([event_id])
+            try:
+                events = self.fetcher.fetch(url).json()['events']
+            except FetchError as error:
+                self.logger.warning(str(error))
+                continue
+            if len(events) > 0:
+                details[event_id] = events[0]
+
+        for event_id in ids:
+            if event_id in details:
+                yield details[event_id]
+
+    def cache_event_details(self, cache, event):
+        """
+        Cache the details of a single event as if they had been requested on
+        their own.  Unchanged details are left alone so that they age.
+        """
+        url = self.event_detail_url([event['id']])
+        content = json.dumps({'events': [event]}, sort_keys=True).encode()
+        entry = cache.get(url)
+        if entry is not None and entry.response().content == content:
+            return
+        headers = {'Content-Type': 'application/json'}
+        cache.put(url, Response(url, 200, headers, content))
 
     def process_master_file(self):
         """
@@ -112,15 +279,13 @@ class CompuScore(RaceResults):
         matchiter = re.finditer(pattern, self.html)
         urls = [matchobj.group() for matchobj in matchiter]
 
-        for url in urls:
-            self.logger.info('Downloading {0}...'.format(url))
-
-            response = urllib.request.urlopen(url)
+        for url, response in self.fetch_all(urls):
             try:
-                self.html = response.read().decode('utf-8')
+                self.html = response.content.decode('utf-8')
             except UnicodeDecodeError as err:
                 msg = "Problem with {0}, skipping....  \"{1}\"."
                 warnings.warn(msg.format(url, err))
+                continue
 
             self.downloaded_url = url
             if self.race_date_in_range():
@@ -178,19 +343,30 @@ class CompuScore(RaceResults):
         hr_elt.set('class', 'race_header')
         div.append(hr_elt)
 
+        # Plain text and CSV result files have neither a heading nor a
+        # date, but the API gave them.
+        race_name, race_date, _ = self.race_info.get(self.downloaded_url,
+                                                     (None, None, None))
+        fmt = self.document_format(self.downloaded_url)
+        if fmt is None:
+            fmt = result_format(self.downloaded_url)
+        is_html = fmt in [None, 'html']
+
         # The single H2 element in the file has the race name.
         regex = re.compile(r'<h2.*>(?P<h2>.*)</h2>')
-        matchobj = regex.search(self.html)
+        matchobj = regex.search(self.html) if is_html else None
         h2_elt = etree.Element('h2')
-        if matchobj is None:
-            h2_elt.text = ''
-        else:
+        if matchobj is not None:
             h2_elt.text = matchobj.group('h2')
+        else:
+            h2_elt.text = race_name or ''
         div.append(h2_elt)
 
         # The single H3 element in the file has the race date.
         # If it's there, that is.
-        race_date = self.get_race_date()
+        if is_html:
+            race_date = self.get_race_date() or race_date
+        self.race_date = race_date
         if race_date is not None:
             h3_elt = etree.Element('h3')
             h3_elt.text = race_date.strftime('Race Date:  %b %d, %Y')
@@ -0,0 +1,483 @@
+"""
+HTTP layer shared by all the race results providers.
+"""
+import collections
+import copy
+import http.cookiejar
+import json
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+
+from .retry import RetryPolicy
+
+
+# Not clear if this works or not.
+USER_AGENT = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_6_8) "
+              "AppleWebKit/535.19 (KHTML, like Gecko) "
+              "Chrome/18.0.1025.45 "
+              "Safari/535.19")
+
+# Only ask for what Decoder can undo.
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Bodies are read and decompressed this many bytes at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def build_url(url, params=None):
+    """
+    Append query string parameters to a URL.
+    """
+    if params:
+        sep = '&' if urllib.parse.urlsplit(url).query else '?'
+        url += sep + urllib.parse.urlencode(params)
+    return url
+
+
+class FetchError(RuntimeError):
+    """
+    A document could not be retrieved.
+
+    Attributes
+    ----------
+    url : str
+        What we were trying to retrieve.
+    status : int
+        HTTP status code, or None if no response was received.
+    """
+    def __init__(self, url, status=None, reason=None):
+        self.url = url
+        self.status = status
+        msg = 'Could not retrieve {0}'.format(url)
+        if status is not None:
+            msg += ' (HTTP {0})'.format(status)
+        if reason is not None:
+            msg += ': {0}'.format(reason)
+        RuntimeError.__init__(self, msg)
+
+
+class Decoder:
+    """
+    Incrementally undo the Content-Encoding of a response body.
+
+    Attributes
+    ----------
+    encoding : str
+        "gzip", "deflate" or "identity".
+    """
+    def __init__(self, encoding=None):
+        """
+        Parameters
+        ----------
+        encoding : str
+            Value of the Content-Encoding header, if any.
+
+        Raises
+        ------
+        ValueError
+            If the encoding is not supported.
+        """
+        self.encoding = (encoding or 'identity').strip().lower()
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._obj = zlib.decompressobj()
+        elif self.encoding == 'identity':
+            self._obj = None
+        else:
+            msg = 'Unsupported Content-Encoding {0}'.format(self.encoding)
+            raise ValueError(msg)
+        self._started = False
+
+    def decompress(self, chunk):
+        """
+        Decode the next chunk of the body.
+        """
+        if self._obj is None:
+            return chunk
+        try:
+            data = self._obj.decompress(chunk)
+        except zlib.error:
+            if self.encoding != 'deflate' or self._started:
+                raise
+            # Some servers send raw deflate data without the zlib header.
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._obj.decompress(chunk)
+        self._started = True
+        return data
+
+    def flush(self):
+        """
+        Decode whatever is left once the body has been read.
+        """
+        if self._obj is None:
+            return b''
+        return self._obj.flush()
+
+
+class PartialBody:
+    """
+    The part of a response body received so far.
+
+    If a transfer drops part way through, the download can be resumed from
+    where it stopped with a Range request, provided the server accepts byte
+    ranges and gave a validator for If-Range, so that we never splice
+    together two versions of a document.  Decoding simply carries on with
+    the resumed bytes.
+
+    Attributes
+    ----------
+    status : int
+        Status of the response that started the body.
+    headers : dict
+        Headers of the response that started the body.
+    wire : int
+        Bytes of the body received so far, before decoding.
+    received : int
+        All body bytes received, over every attempt.
+    """
+    def __init__(self):
+        self.status = None
+        self.headers = None
+        self.wire = 0
+        self.received = 0
+        self._chunks = []
+        self._decoder = None
+        self._validator = None
+
+    def range_headers(self):
+        """
+        Headers that ask for the rest of the body, if it can be resumed.
+        """
+        if self.wire == 0 or self._validator is None:
+            return {}
+        return {'Range': 'bytes={0}-'.format(self.wire),
+                'If-Range': self._validator}
+
+    def start(self, status, headers):
+        """
+        Begin a response, either a fresh body or the rest of this one.
+
+        Raises
+        ------
+        ValueError
+            If the body is encoded in a way we cannot undo.
+        """
+        prefix = 'bytes {0}-'.format(self.wire)
+        if (status == 206 and self.wire > 0
+                and headers.get('Content-Range', '').startswith(prefix)):
+            return
+        self.status = status
+        self.headers = headers
+        self.wire = 0
+        self._chunks = []
+        self._decoder = Decoder(headers.get('Content-Encoding'))
+        self._validator = None
+        if (status == 200
+                and headers.get('Accept-Ranges', '').lower() == 'bytes'):
+            etag = headers.get('ETag')
+            if etag is not None and not etag.startswith('W/'):
+                self._validator = etag
+            else:
+                self._validator = headers.get('Last-Modified')
+
+    def feed(self, chunk):
+        """
+        Take the next chunk of the body off the wire.
+        """
+        self.wire += len(chunk)
+        self.received += len(chunk)
+        self._chunks.append(self._decoder.decompress(chunk))
+
+    def finish(self):
+        """
+        Returns
+        -------
+        bytes
+            The whole decoded body.
+        """
+        self._chunks.append(self._decoder.flush())
+        return b''.join(self._chunks)
+
+
+class FetchStats:
+    """
+    Bytes downloaded from each host, as they came over the wire and once
+    decompressed.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = collections.defaultdict(lambda: [0, 0, 0])
+
+    def add(self, url, wire, decoded):
+        """
+        Account for one response body.
+
+        Parameters
+        ----------
+        url : str
+            What was requested.
+        wire : int
+            Size of the body as received.
+        decoded : int
+            Size of the body after decompression.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            counts = self._hosts[host]
+            counts[0] += 1
+            counts[1] += wire
+            counts[2] += decoded
+
+    def hosts(self):
+        """
+        Returns
+        -------
+        dict
+            (requests, wire bytes, decoded bytes) keyed by host.
+        """
+        with self._lock:
+            return {host: tuple(counts)
+                    for host, counts in self._hosts.items()}
+
+    def report(self):
+        """
+        One line per host, suitable for logging.
+        """
+        lines = []
+        for host, (count, wire, decoded) in sorted(self.hosts().items()):
+            ratio = decoded / wire if wire else 1.0
+            line = ('{0}: {1} responses, {2} bytes on the wire, '
+                    '{3} bytes decoded ({4:.1f}x)')
+            lines.append(line.format(host, count, wire, decoded, ratio))
+        return lines
+
+
+class Response:
+    """
+    A downloaded document.
+
+    Attributes
+    ----------
+    url : str
+        Final URL of the document, after any redirects.
+    status : int
+        HTTP status code.
+    headers : dict
+        Response headers.  Lookups are case-insensitive when the response
+        came off the wire.
+    content : bytes
+        Body of the response.
+    """
+    def __init__(self, url, status, headers, content):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self._text = None
+
+    @property
+    def text(self):
+        """
+        The body decoded as UTF-8, or as Latin-1 if that fails.
+        """
+        if self._text is None:
+            try:
+                self._text = self.content.decode('utf-8')
+            except UnicodeDecodeError:
+                self._text = self.content.decode('latin1')
+        return self._text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Fetcher:
+    """
+    Retrieve documents over pooled keep-alive connections.
+
+    Every provider goes through a single Fetcher, so connections (and DNS
+    lookups) are reused across requests to the same host, cookies are shared
+    across requests, and timeouts and concurrency are tuned in one place.
+
+    Attributes
+    ----------
+    session : requests.Session
+        Holds the connection pools and the cookie jar.
+    timeout : float
+        Seconds to wait to connect to a server or for it to send data.
+    max_connections : int
+        Number of connections kept open to each host.  This is also the most
+        requests that may be usefully in flight to a host at once.
+    cookie_file : str
+        If set, cookies are loaded from and saved to this file.
+    cache : rr.cache.HttpCache
+        If set, GET requests are answered from and stored in this cache.
+    stats : FetchStats
+        Bytes downloaded from each host.
+    retry : rr.retry.RetryPolicy
+        When to try failed downloads again.
+    """
+    def __init__(self, user_agent=USER_AGENT, timeout=30, max_connections=4,
+                 cookie_file=None, cache=None, retry=None):
+        """
+        Parameters
+        ----------
+        user_agent : str
+            Masquerade as a browser because some sites do not like
+            "python-requests".
+        timeout : float
+            Seconds to wait to connect to a server or for it to send data.
+        max_connections : int
+            Number of connections kept open to each host.
+        cookie_file : str
+            If set, cookies are loaded from and saved to this file.
+        cache : rr.cache.HttpCache
+            If set, GET requests are answered from and stored in this cache.
+        retry : rr.retry.RetryPolicy
+            When to try failed downloads again.  By default, a couple of
+            times with a short backoff.
+        """
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.cookie_file = cookie_file
+        self.cache = cache
+        self.stats = FetchStats()
+        self.retry = RetryPolicy() if retry is None else retry
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        adapter = HTTPAdapter(pool_connections=16,
+                              pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Cookie support needed for NYRR results.
+        self.session.cookies = http.cookiejar.LWPCookieJar(cookie_file)
+        if cookie_file is not None and os.path.exists(cookie_file):
+            self.session.cookies.load(ignore_discard=True)
+
+        # Set on fetchers made by isolated, which own none of this.
+        self._shared = False
+
+    def isolated(self):
+        """
+        A fetcher with a cookie jar of its own, e.g. for a search whose
+        state is kept in cookies, that otherwise shares this one's
+        connections, cache, statistics and retry budget.
+
+        Its cookies are not saved, and closing it does nothing.
+        """
+        other = copy.copy(self)
+        other.cookie_file = None
+        other.session = requests.Session()
+        other.session.headers = self.session.headers.copy()
+        other.session.adapters = self.session.adapters
+        other.session.cookies = http.cookiejar.LWPCookieJar()
+        other._shared = True
+        return other
+
+    def fetch(self, url, params=None, data=None, headers=None,
+              immutable=False):
+        """
+        Retrieve a document.
+
+        Parameters
+        ----------
+        url : str
+            The URL to retrieve
+        params : dict
+            Query string parameters.
+        data : dict
+            If given, POST these form parameters instead of doing a GET.
+        headers : dict
+            Additional request headers.
+        immutable : bool
+            If True, the document is not expected to change once it is old
+            enough, so an old enough cached copy is used without asking the
+            server.
+
+        Returns
+        -------
+        Response
+            The document.
+
+        Raises
+        ------
+        FetchError
+            If there is no response or the server reports an error, even
+            after retrying.
+        """
+        url = build_url(url, params)
+        method = 'GET' if data is None else 'POST'
+
+        entry = None
+        if self.cache is not None and method == 'GET':
+            cached, entry, headers = self.cache.before(url, headers,
+                                                       immutable=immutable)
+            if cached is not None:
+                return cached
+
+        partial = PartialBody()
+        attempt = 0
+        while True:
+            try:
+                response = self._request(method, url, data, headers, partial)
+                break
+            except FetchError as error:
+                delay = self.retry.backoff(error, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+        if self.cache is not None and method == 'GET':
+            response = self.cache.after(url, entry, response)
+        return response
+
+    def _request(self, method, url, data, headers, partial):
+        """
+        Make a single attempt at a request, resuming a partially received
+        body if possible.
+        """
+        headers = dict(headers or {}, **partial.range_headers())
+        try:
+            r = self.session.request(method, url, data=data, headers=headers,
+                                     timeout=self.timeout, stream=True)
+            if r.status_code >= 400:
+                r.close()
+                raise FetchError(url, status=r.status_code, reason=r.reason)
+            try:
+                partial.start(r.status_code, r.headers)
+                for chunk in r.raw.stream(CHUNK_SIZE, decode_content=False):
+                    partial.feed(chunk)
+                content = partial.finish()
+            except BaseException:
+                r.close()
+                raise
+            r.raw.release_conn()
+        except (requests.RequestException, urllib3.exceptions.HTTPError,
+                zlib.error, ValueError) as error:
+            raise FetchError(url, reason=error) from error
+
+        self.stats.add(url, partial.received, len(content))
+        return Response(r.url, partial.status, partial.headers, content)
+
+    def close(self):
+        """
+        Save the cookies and close all the connections.
+        """
+        if self._shared:
+            # The connections belong to the fetcher this was made from.
+            return
+        if self.cookie_file is not None:
+            self.session.cookies.save(ignore_discard=True)
+        self.session.close()
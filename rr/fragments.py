@@ -0,0 +1,132 @@
+"""
+Store rendered races as independent fragments.
+"""
+import hashlib
+import os
+import tempfile
+
+from lxml import etree
+
+from .output import HtmlWriter
+
+
+class FragmentStore:
+    """
+    Directory of rendered races, one file per race.
+
+    Each fragment is named after its race date, provider and a digest of its
+    URL, so races may be rendered in any order (or re-rendered) without
+    touching any other race.  Sorting the file names gives the order of the
+    assembled document:  by race date, then by provider.
+
+    Attributes
+    ----------
+    directory : str
+        Where the fragments live.
+    """
+    suffix = '.html'
+
+    def __init__(self, directory):
+        """
+        Parameters
+        ----------
+        directory : str
+            Where the fragments live.  Created if necessary.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, provider, race_date, url, markup):
+        """
+        Construct the file name of a fragment.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "coolrunning" or "bestrace".
+        race_date : datetime.date
+            Date of the race, or None if not known.
+        url : str
+            Where the race came from, or None for local files, in which case
+            the fragment is keyed by its own contents.
+        markup : bytes
+            The serialized race.
+        """
+        if race_date is None:
+            datestr = 'undated'
+        else:
+            datestr = race_date.strftime('%Y-%m-%d')
+        digest = hashlib.sha1(markup if url is None else url.encode())
+        return '{0}_{1}_{2}{3}'.format(datestr, provider, digest.hexdigest(),
+                                       self.suffix)
+
+    def discard(self, provider, url):
+        """
+        Remove a race's fragment, e.g. because corrected results no longer
+        include anyone in the membership list.  The race date it was filed
+        under need not be known.
+        """
+        suffix = self.key(provider, None, url, b'')[len('undated'):]
+        for name in os.listdir(self.directory):
+            if not name.endswith(suffix):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def put(self, provider, race_date, url, element):
+        """
+        Write a rendered race to the store, replacing any earlier version.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "coolrunning" or "bestrace".
+        race_date : datetime.date
+            Date of the race, or None if not known.
+        url : str
+            Where the race came from.
+        element : lxml.etree.Element
+            Usually the <div class="race"> produced by a webify method.
+
+        Returns
+        -------
+        str
+            Path to the fragment.
+        """
+        markup = etree.tostring(element, pretty_print=True, method='html')
+        path = os.path.join(self.directory,
+                            self.key(provider, race_date, url, markup))
+
+        # Write it beside its final name so that assembly never sees a
+        # partial fragment.
+        fd, tmpfile = tempfile.mkstemp(dir=self.directory, prefix='.rr',
+                                       suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fptr:
+            fptr.write(markup)
+        os.replace(tmpfile, path)
+        return path
+
+    def fragments(self):
+        """
+        Paths of all the fragments in assembly order.
+        """
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith(self.suffix)
+                       and not name.startswith('.'))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def assemble(self, output_file):
+        """
+        Concatenate every fragment into a single results document.
+
+        Parameters
+        ----------
+        output_file : str
+            Final destination of the HTML document.
+        """
+        with HtmlWriter(output_file) as writer:
+            for path in self.fragments():
+                with open(path, 'rb') as fptr:
+                    writer.copy(fptr)
@@ -0,0 +1,182 @@
+"""
+Full-text index of downloaded race documents.
+"""
+import datetime
+import hashlib
+import re
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS indexed_documents (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    provider TEXT,
+    title TEXT,
+    date TEXT,
+    digest TEXT NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS document_lines USING fts5 (
+    line,
+    document_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Result lines have both a place or time and a name.
+RESULT_LINE = re.compile(r'(?=.*\d)(?=.*[A-Za-z])')
+TAG = re.compile(r'<[^>]*>')
+TITLE = re.compile(r'<title>(?P<title>.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def result_lines(html):
+    """
+    Pick out the lines of a race document that look like results.
+
+    Parameters
+    ----------
+    html : str
+        Race document.
+
+    Returns
+    -------
+    list
+        Lines with the markup removed.
+    """
+    lines = []
+    for line in TAG.sub('', html).split('\n'):
+        line = ' '.join(line.split())
+        if RESULT_LINE.match(line):
+            lines.append(line)
+    return lines
+
+
+def html_title(html):
+    """
+    Content of the <title> element of a document, or None.
+    """
+    matchobj = TITLE.search(html)
+    if matchobj is None:
+        return None
+    return ' '.join(matchobj.group('title').split())
+
+
+class DocumentIndex:
+    """
+    SQLite FTS5 index over the result lines of every race document seen.
+
+    Each document is indexed once.  Indexing a URL again is a no-op unless
+    its content has changed, in which case its lines are replaced.
+
+    Attributes
+    ----------
+    path : str
+        SQLite database file.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database file, created if necessary.  It may be the same
+            file as a ResultsStore.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, url, lines, provider=None, title=None, date=None):
+        """
+        Index the result lines of a document.
+
+        Parameters
+        ----------
+        url : str
+            Where the document came from.
+        lines : list
+            Result lines of the document.
+        provider : str
+            Such as "coolrunning".
+        title : str
+            Race name, if known.
+        date : datetime.date
+            Race date, if known.
+
+        Returns
+        -------
+        bool
+            True if the document was (re-)indexed, False if it was already
+            indexed with the same content.
+        """
+        digest = hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+        row = self.conn.execute('SELECT id, digest FROM indexed_documents '
+                                'WHERE url = ?', (url,)).fetchone()
+        if row is not None and row[1] == digest:
+            return False
+
+        if date is not None:
+            date = date.isoformat()
+        now = datetime.datetime.now().isoformat()
+        with self.conn:
+            if row is not None:
+                document_id = row[0]
+                self.conn.execute('DELETE FROM document_lines '
+                                  'WHERE document_id = ?', (document_id,))
+                self.conn.execute('UPDATE indexed_documents '
+                                  'SET provider = ?, title = ?, date = ?, '
+                                  'digest = ?, indexed_at = ? WHERE id = ?',
+                                  (provider, title, date, digest, now,
+                                   document_id))
+            else:
+                cursor = self.conn.execute(
+                    'INSERT INTO indexed_documents '
+                    '(url, provider, title, date, digest, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (url, provider, title, date, digest, now))
+                document_id = cursor.lastrowid
+            self.conn.executemany('INSERT INTO document_lines '
+                                  '(line, document_id) VALUES (?, ?)',
+                                  [(line, document_id) for line in lines])
+        return True
+
+    def search(self, text, phrase=False, limit=20):
+        """
+        Find result lines, best matches first.
+
+        Parameters
+        ----------
+        text : str
+            Words to search for, e.g. a name.  Every word must appear in the
+            same result line.
+        phrase : bool
+            If True, the words must appear together in the given order.
+        limit : int
+            Maximum number of hits.
+
+        Returns
+        -------
+        list
+            (url, title, date, line) tuples.
+
+        Raises
+        ------
+        ValueError
+            If there are no words to search for.
+        """
+        if len(text.split()) == 0:
+            raise ValueError('nothing to search for')
+        words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+        if phrase:
+            query = '"' + ' '.join(words).replace('"', '') + '"'
+        else:
+            query = ' '.join(words)
+        sql = ('SELECT d.url, d.title, d.date, l.line '
+               'FROM document_lines AS l '
+               'JOIN indexed_documents AS d ON d.id = l.document_id '
+               'WHERE document_lines MATCH ? '
+               'ORDER BY l.rank LIMIT ?')
+        return self.conn.execute(sql, (query, limit)).fetchall()
@@ -0,0 +1,152 @@
+"""
+Ledger of race documents already processed.
+"""
+import datetime
+import hashlib
+import json
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    matcher TEXT NOT NULL,
+    matched INTEGER NOT NULL,
+    processed_at TEXT NOT NULL,
+    line_hashes BLOB,
+    matched_lines TEXT
+);
+"""
+
+# Columns added since the table was first created.
+NEW_COLUMNS = [('line_hashes', 'BLOB'), ('matched_lines', 'TEXT')]
+
+HASH_SIZE = 8
+
+
+def line_hash(line):
+    """
+    Short digest of a line of a race document.
+    """
+    return hashlib.blake2b(line.encode('utf-8'),
+                           digest_size=HASH_SIZE).digest()
+
+
+class Ledger:
+    """
+    Remember which race documents have been processed, what their content
+    was and which membership list they were matched against.
+
+    A document whose content and matcher are both unchanged since it was
+    last processed need not be parsed, matched or rendered again.  For a
+    document that has changed, e.g. because corrected results were posted,
+    a digest of every line and the lines that matched are kept, so that only
+    the lines that differ need to be matched again.
+
+    Attributes
+    ----------
+    path : str
+        SQLite database file.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database file, created if necessary.  It may be the same
+            file as a ResultsStore or DocumentIndex.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.conn.execute('PRAGMA table_info(processed)')]
+        for name, decl in NEW_COLUMNS:
+            if name not in columns:
+                self.conn.execute('ALTER TABLE processed ADD COLUMN '
+                                  '{0} {1}'.format(name, decl))
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, url):
+        """
+        Look up a document.
+
+        Returns
+        -------
+        tuple
+            (digest, matcher, matched), or None if the URL has not been
+            processed.
+        """
+        row = self.conn.execute('SELECT digest, matcher, matched '
+                                'FROM processed WHERE url = ?',
+                                (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], bool(row[2])
+
+    def unchanged(self, url, digest, matcher):
+        """
+        Determine whether a document was already processed with the same
+        content and matcher.
+        """
+        row = self.get(url)
+        return row is not None and row[:2] == (digest, matcher)
+
+    def previous(self, url):
+        """
+        The lines of the version of a document that was last processed.
+
+        Returns
+        -------
+        tuple
+            (set of line digests, set of matched lines), or None if they
+            were not recorded.
+        """
+        row = self.conn.execute('SELECT line_hashes, matched_lines '
+                                'FROM processed WHERE url = ?',
+                                (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        blob = row[0]
+        hashes = {blob[j:j + HASH_SIZE]
+                  for j in range(0, len(blob), HASH_SIZE)}
+        return hashes, set(json.loads(row[1] or '[]'))
+
+    def record(self, url, digest, matcher, matched, lines=None,
+               matched_lines=None):
+        """
+        Record that a document has been processed.
+
+        Parameters
+        ----------
+        url : str
+            Where the document came from.
+        digest : str
+            Hash of the document's content.
+        matcher : str
+            Version of the membership matching it was processed with.
+        matched : bool
+            Whether anyone in the membership list was found.
+        lines : list
+            Lines of the document, so that a later version can be compared
+            with this one.
+        matched_lines : list
+            Those lines that matched.
+        """
+        now = datetime.datetime.now().isoformat()
+        line_hashes = None
+        if lines is not None:
+            line_hashes = b''.join(sorted({line_hash(line)
+                                           for line in lines}))
+        if matched_lines is not None:
+            matched_lines = json.dumps(sorted(set(matched_lines)))
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO processed '
+                              '(url, digest, matcher, matched, processed_at, '
+                              'line_hashes, matched_lines) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, digest, matcher, int(matched), now,
+                               line_hashes, matched_lines))
@@ -4,11 +4,11 @@ Module for L & M Computer Sports timing company.
 import datetime
 import logging
 import re
-import urllib
 
 from lxml import etree as ET
 
 from .common import RaceResults
+from .schedule import ScheduleEntry
 
 
 class LMSports(RaceResults):
@@ -28,6 +28,7 @@ class LMSports(RaceResults):
             in the membership list, then we want to record that URL in the
             output.
     """
+    provider = 'lmsports'
 
     def __init__(self, verbose='INFO', membership_list=None,
                  output_file=None, **kwargs):
@@ -50,13 +51,39 @@ class LMSports(RaceResults):
         """
         Download the requested results and compile them.
         """
-        self.download_master_file()
-        self.process_master_file()
+        urls = [self.master_file_url(year) for year in self.search_years()]
+        schedules = self.master_schedules(urls, self.parse_master_file)
+        race_dates = {}
+        for url in urls:
+            if url not in schedules:
+                continue
+            for entry in self.races_between(schedules[url]):
+                race_dates[entry.url] = entry.date
+
+        for url, response in self.fetch_all(race_dates.keys()):
+            self.downloaded_url = url
+            self.race_date = race_dates[url]
+            self.html = response.content.decode('utf-8')
+            self.compile_race_results()
+
+    def master_file_url(self, year):
+        """
+        The results for an entire year, e.g.
 
-    def process_master_file(self):
+        http://www.lmsports.com/resultsYY.htm
+
+        where YY is the two-digit year.
         """
-        We have the full year of results, now fish out the ones that are in
-        the specified time range.
+        return '{0}results{1:02d}.htm'.format(self.base_url, year % 100)
+
+    def parse_master_file(self, url, html):
+        """
+        Collect the races listed on a year's results page.
+
+        Returns
+        -------
+        list
+            rr.schedule.ScheduleEntry for each race.
         """
         # <a href="trail13.htm">Trail of Two Cities 5k Run</a>
         # - Saturday, November 2, 2013 - OC/Somers Point, NJ -
@@ -69,27 +96,25 @@ class LMSports(RaceResults):
                       (?P<day_of_week>[A-Z][a-z]*?),\s*
                       (?P<month>.*?)\s+
                       (?P<day>\d+),\s+
-                      (?P<year>\d+)\s*-"""
-        pattern = pattern.format(year=self.start_date.strftime('%y'))
+                      (?P<year>\d+)\s*-
+                      (?:[ \t]*(?P<location>[^<\r\n-][^<\r\n]*?)\s*-)?"""
+        year = re.search(r'results(\d\d)\.htm$', url).group(1)
+        pattern = pattern.format(year=year)
         regex = re.compile(pattern, re.VERBOSE | re.DOTALL | re.IGNORECASE)
-        for matchobj in regex.finditer(self.html):
+        entries = []
+        for matchobj in regex.finditer(html):
             datestring = '{0} {1:02d}, {2}'.format(matchobj.group('month'),
                                                    int(matchobj.group('day')),
                                                    matchobj.group('year'))
-            dt = datetime.datetime.strptime(datestring, "%B %d, %Y")
-            dt = datetime.date(dt.year, dt.month, dt.day)
-            if not (self.start_date <= dt and dt <= self.stop_date):
-                msg = 'Skipping {0}...'.format(matchobj.group('race_name'))
-                self.logger.info(msg)
+            try:
+                dt = datetime.datetime.strptime(datestring, "%B %d, %Y")
+            except ValueError:
                 continue
-
             url = self.base_url + matchobj.group('href')
-            self.logger.info('Downloading {0}.'.format(url))
-
-            self.downloaded_url = url
-            response = urllib.request.urlopen(url)
-            self.html = response.readall().decode('utf-8')
-            self.compile_race_results()
+            entries.append(ScheduleEntry(dt.date(),
+                                         matchobj.group('race_name'), url,
+                                         matchobj.group('location')))
+        return entries
 
     def webify_results(self, results_lst):
         """
@@ -138,18 +163,3 @@ class LMSports(RaceResults):
         div.append(pre)
 
         return div
-
-    def download_master_file(self):
-        """Download results for the entire year.
-
-        The URL will have the pattern
-
-        http://www.lmsports.com/resultsYY.htm
-
-        where YY is the two-digit year.
-        """
-        url = 'http://www.lmsports.com/results{0}.htm'
-        url = url.format(self.start_date.strftime('%y'))
-        self.logger.info('Downloading {0}.'.format(url))
-        response = urllib.request.urlopen(url)
-        self.html = response.read().decode('utf-8')
@@ -0,0 +1,121 @@
+"""
+Sidecar cache of what was learned about each race document.
+"""
+import collections
+import datetime
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS race_metadata (
+    url TEXT PRIMARY KEY,
+    date TEXT,
+    title TEXT,
+    author TEXT,
+    format TEXT
+);
+"""
+
+
+RaceMetadata = collections.namedtuple('RaceMetadata',
+                                      ['date', 'title', 'author', 'format'])
+RaceMetadata.__doc__ = """
+What was learned about a race document the first time it was seen.
+
+Attributes
+----------
+date : datetime.date
+    When the race was run, or None if not known.
+title : str
+    Race name, or None if not known.
+author : str
+    The timing company or club that posted the results, or None if not
+    known.
+format : str
+    Such as "html" or "txt", or None if not known.
+"""
+
+
+class MetadataCache:
+    """
+    Map race document URLs to their date, title, author and format.
+
+    Whether a race is in the date range, or was posted by someone whose
+    results are never parsed, is usually only known once the race has been
+    downloaded.  Keeping that here means that a later run can make the
+    same decision without downloading the race at all.
+
+    Attributes
+    ----------
+    path : str
+        SQLite database file.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database file, created if necessary.  It may be the same
+            file as a Ledger or ScheduleIndex.
+        """
+        self.path = path
+        # Providers may look races up while discovering them on another
+        # thread.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def get(self, url):
+        """
+        Look up a race document.
+
+        Returns
+        -------
+        RaceMetadata
+            Or None if the URL has not been seen.
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT date, title, author, format '
+                                    'FROM race_metadata WHERE url = ?',
+                                    (url,)).fetchone()
+        if row is None:
+            return None
+        date, title, author, fmt = row
+        if date is not None:
+            date = datetime.date.fromisoformat(date)
+        return RaceMetadata(date, title, author, fmt)
+
+    def put(self, url, metadata):
+        """
+        Record a race document.  Fields that are None leave anything already
+        known about the document alone.
+
+        Parameters
+        ----------
+        url : str
+            Race document.
+        metadata : RaceMetadata
+            What was learned about it.
+        """
+        date = metadata.date
+        if isinstance(date, datetime.datetime):
+            date = date.date()
+        if date is not None:
+            date = date.isoformat()
+        with self._lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO race_metadata (url) '
+                              'VALUES (?)', (url,))
+            self.conn.execute('UPDATE race_metadata SET '
+                              'date = coalesce(?, date), '
+                              'title = coalesce(?, title), '
+                              'author = coalesce(?, author), '
+                              'format = coalesce(?, format) '
+                              'WHERE url = ?',
+                              (date, metadata.title, metadata.author,
+                               metadata.format, url))
@@ -5,18 +5,32 @@ Module for compiling NYRR race resuts.
 import datetime
 import logging
 import re
-import urllib.request
 import warnings
 
 from lxml import etree
 
 from .common import RaceResults
+from .fetch import FetchError
+from .pipeline import Pipeline
+from .schedule import ScheduleEntry, schedule_key
+
+
+ARCHIVE_URL = ('http://web2.nyrrc.org'
+               '/cgi-bin/start.cgi/aes-programs/results/resultsarchive.htm')
 
 
 class NewYorkRR(RaceResults):
     """
     Handles race results from New York Road Runners website.
+
+    Attributes
+    ----------
+    teams : list
+        Team codes to search each event for, e.g. "RARI" for Raritan Valley
+        Road Runners.
     """
+    provider = 'nyrr'
+
     def __init__(self, membership_list=None, verbose='INFO',
                  output_file=None, **kwargs):
         """
@@ -31,6 +45,9 @@ class NewYorkRR(RaceResults):
                              output_file=output_file, verbose=verbose)
         self.__dict__.update(**kwargs)
 
+        teams = getattr(self, 'team', 'RARI')
+        self.teams = [teams] if isinstance(teams, str) else list(teams)
+
         # Need to remember the current URL.
         self.downloaded_url = None
 
@@ -41,23 +58,56 @@ class NewYorkRR(RaceResults):
         self.result_url_base = "http://web2.nyrrc.org/cgi-bin/start.cgi/"
         self.result_url_base += "aes-programs/results/startup.html"
 
-    def run(self):
+    def compile_web_results(self):
+        """
+        Search each event in the date range for the teams.  The archive has
+        a list of races for each year.
         """
-        This page has the URLs for the recent results.
+        events = []
+        for year in self.search_years():
+            schedule = self.year_schedule(year)
+            for entry in self.races_between(schedule):
+                self.logger.info("Keeping {0}".format(entry.name))
+                events.append((entry.url, entry.date))
+
+        def search(event):
+            url, race_date = event
+            try:
+                return url, race_date, self.search_event(url)
+            except FetchError as error:
+                self.fetch_failed(error)
+                return None
+
+        # The searches for each event run concurrently if each can have
+        # cookies of its own.
+        workers = self.jobs if hasattr(self.fetcher, 'isolated') else 1
+        pipeline = Pipeline(iter(events), queue_size=self.queue_size,
+                            stats=self.stage_stats)
+        pipeline.add_stage('search', search, workers=workers)
+        for url, race_date, searches in pipeline:
+            self.race_date = race_date
+            self.process_event(url, searches)
+
+    def year_schedule(self, year):
         """
-        self.initialize_output_file()
+        The races run in a year, from the schedule index if possible.
 
-        url = 'http://web2.nyrrc.org'
-        url += '/cgi-bin/start.cgi/aes-programs/results/resultsarchive.htm'
+        Returns
+        -------
+        rr.schedule.Schedule
+        """
+        params = {'NYRRYEAR': str(year), 'AESTIVACVNLIST': 'NYRRYEAR'}
+        key = schedule_key(ARCHIVE_URL, {'NYRRYEAR': str(year)})
+        schedule = self.cached_schedule(key)
+        if schedule is not None:
+            return schedule
 
-        local_file = 'resultsarchive.html'
-        self.download_file(url, local_file)
+        self.download_file(ARCHIVE_URL)
 
         # There are two forms used for searches.  The one that we want (list
         # all the results for an entire year) is the 2nd on that this regex
         # retrieves.
-        with open(local_file) as fptr:
-            html = fptr.read()
+        html = self.html
         regex = re.compile(r"""<form
                                \s+name="(?P<name>\w+)"
                                \s+method=post
@@ -69,76 +119,75 @@ class NewYorkRR(RaceResults):
             raise RuntimeError(msg)
         url = lst[0][1]
 
-        # The page for POSTing the search needs POST params.
-        post_params = {}
-        post_params['NYRRYEAR'] = str(self.start_date.year)
-        post_params['AESTIVACVNLIST'] = 'NYRRYEAR'
-        data = urllib.parse.urlencode(post_params)
-        data = data.encode()
+        # Download the race list page for the specified year.  The page for
+        # POSTing the search needs POST params.
+        self.download_file(url, params)
 
-        # Download the race list page for the specified year
-        local_file = 'nyrrraces.html'
-        self.download_file(url, local_file, data)
+        entries = [ScheduleEntry(race_date, race_name, url, None)
+                   for url, race_name, race_date in self.race_links(self.html)]
+        return self.save_schedule(key, entries)
 
+    def race_links(self, html):
+        """
+        Parse out the list of races from the race list page for a year.
+
+        Each race is an anchor leading to the race's search page, followed
+        by the race date, e.g.
+
+            <a href="...startup.html?result.id=b21209&result.year=2012">
+              Jingle Bell Jog
+            </a> 12/09/12
+
+        Returns
+        -------
+        list
+            (url, race name, race date) for each race.
+        """
         # This is not valid HTML.  Need to get rid of some bad FORMs,
         # none of which are needed.
-        with open(local_file, 'r', encoding='utf-8') as fptr:
-            html = fptr.read()
         html = html.replace('form', 'div')
-        with open(local_file, 'w') as fptr:
-            fptr.write(html)
-
-        self.local_tidy(local_file)
-
-        # Parse out the list of races.  They are all in a
-        # particular table.
-        with open(local_file, 'r') as fptr:
-            markup = fptr.read()
-
-        pattern = r"""<a\shref="(?P<url>{0}         # This part too long
-                      \?result.id=
-                      (?P<result_id>[0-9a-z]*)&amp; # Unique for each result.
-                      result.year=\d\d\d\d)">       # End of URL
-                      (?P<race_name>.*?)            # Name of the race.
-                      </a>\s*                       # End of anchor.
-                      (?P<month>\d\d)/
-                      (?P<day>\d\d)/
-                      (?P<year>\d\d)"""             # Race date.
-        pattern = pattern.format(self.result_url_base)
-        regex = re.compile(pattern, re.VERBOSE | re.DOTALL)
-        for matchobj in regex.finditer(markup):
-
-            url = matchobj.group('url')
-            url = re.sub('&amp;', '&', url)
+        root = etree.fromstring(html, etree.HTMLParser())
+
+        prefix = self.result_url_base + '?result.id='
+        regex = re.compile(r"""result.id=[0-9a-z]*&
+                               result.year=\d\d\d\d$""", re.VERBOSE)
+        date_regex = re.compile(r"""\s*(?P<month>\d\d)/
+                                    (?P<day>\d\d)/
+                                    (?P<year>\d\d)""", re.VERBOSE)
+        races = []
+        for anchor in root.iter('a'):
+            url = anchor.get('href', '')
+            if not url.startswith(prefix) or regex.search(url) is None:
+                continue
+            matchobj = date_regex.match(anchor.tail or '')
+            if matchobj is None:
+                continue
 
             # Get rid of leading and trailing white space in the race name.
-            race_name = matchobj.group('race_name')
-            race_name = re.sub(r'^\s*', '', race_name)
-            race_name = re.sub(r'\s*$', '', race_name)
+            race_name = ''.join(anchor.itertext()).strip()
 
             race_date = datetime.date(int(matchobj.group('year')) + 2000,
                                       int(matchobj.group('month')),
                                       int(matchobj.group('day')))
+            races.append((url, race_name, race_date))
+        return races
 
-            if self.start_date <= race_date and race_date <= self.stop_date:
-                self.logger.info("Keeping {0}".format(race_name))
-                self.process_event(url)
-            else:
-                self.logger.info("Skipping %s" % race_name)
-
-    def process_event(self, url):
-        """We have the URL of a single event.  The URL does not lead to the
-        results, however, it leads to a search page.
+    def search_event(self, url):
         """
-        local_file = 'event_search.html'
-        self.download_file(url, local_file)
+        Search an event for each team.  The URL of an event does not lead to
+        the results, however, it leads to a search page.
 
-        try:
-            with open(local_file, 'r', encoding='utf-8') as fptr:
-                markup = fptr.read()
-        except UnicodeDecodeError:
-            with open(local_file, 'r', encoding='latin1') as fptr:
-                markup = fptr.read()
+        The search is made with cookies of its own if the fetcher allows
+        it, so that searches of several events may run at once.
+
+        Returns
+        -------
+        list
+            (team code, response) for each team.
+        """
+        isolated = getattr(self.fetcher, 'isolated', None)
+        fetcher = self.fetcher if isolated is None else isolated()
+        markup = fetcher.fetch(url).text
 
         # There should be a single form.
         regex = re.compile(r"""<form\s*
@@ -150,10 +199,19 @@ class NewYorkRR(RaceResults):
             warnings.warn("Unable to match the expected form.")
         url = matchobj.group('action')
 
-        # The page for POSTing the search needs POST params.
-        # Provide all the search parameters for this race.  This includes, most
-        # importantly, the team code, i.e. RARI for Raritan Valley Road
-        # Runners.
+        searches = []
+        for team in self.teams:
+            post_params = self.search_params(team)
+            searches.append((team, fetcher.fetch(url, data=post_params)))
+        return searches
+
+    def search_params(self, team):
+        """
+        The page for POSTing the search needs POST params.
+        Provide all the search parameters for this race.  This includes, most
+        importantly, the team code, i.e. RARI for Raritan Valley Road
+        Runners.
+        """
         post_params = {}
         post_params['search.method'] = 'search.team'
         post_params['input.lname'] = ''
@@ -163,30 +221,92 @@ class NewYorkRR(RaceResults):
         post_params['input.agegroup.m'] = '12 to 19'
         post_params['input.agegroup.f'] = '12 to 19'
         post_params['teamgender'] = ''
-        post_params['team_code'] = self.team
+        post_params['team_code'] = team
         post_params['items.display'] = '500'
         post_params['AESTIVACVNLIST'] = 'overalltype,input.agegroup.m,'
         post_params['AESTIVACVNLIST'] += 'input.agegroup.f,teamgender'
         post_params['AESTIVACVNLIST'] += 'team_code'
-        data = urllib.parse.urlencode(post_params)
-        data = data.encode()
+        return post_params
+
+    def search_key(self, event_url, team):
+        """
+        Identifies a team's search of an event in the ledger and the index.
+        """
+        return '{0}#team_code={1}'.format(event_url, team)
 
-        local_file = 'nyrrresult.html'
-        self.download_file(url, local_file, data)
-        self.local_tidy(local_file)
+    def process_event(self, url, searches=None):
+        """
+        Compile the results of every team at an event into a single section
+        of the output.
 
+        Parameters
+        ----------
+        url : str
+            URL of the event's search page.
+        searches : list
+            (team code, response) for each team, if already searched.
+        """
+        if searches is None:
+            searches = self.search_event(url)
+        keys = [self.search_key(url, team) for team, _ in searches]
+        for key, (_, response) in zip(keys, searches):
+            self.store_document(key, response)
+
+        # The teams share a section, so if any team's results changed, all
+        # of them are compiled again.
+        if all(self.already_processed(key, response.content)
+               for key, (_, response) in zip(keys, searches)):
+            return
+        for key in keys:
+            self.load_previous_version(key)
+        if any(key in self.previous_versions for key in keys):
+            self.discard_results(url)
+
+        divs = []
+        for key, (team, response) in zip(keys, searches):
+            self.html = response.text
+            div = self.compile_event_results(key)
+            if div is None:
+                continue
+            if len(self.teams) > 1:
+                h2 = etree.Element('h2')
+                h2.text = 'Team {0}'.format(team)
+                div.find('table').addprevious(h2)
+            self.matched_urls.add(key)
+            divs.append(div)
+
+        if len(divs) > 0:
+            # The first team's section keeps the race metadata, the others
+            # contribute their results.
+            div = divs[0]
+            for other in divs[1:]:
+                for elt in list(other):
+                    if elt.tag in ['h2', 'table']:
+                        div.append(elt)
+            self.downloaded_url = url
+            self.insert_race_results(div)
+
+        for key, (_, response) in zip(keys, searches):
+            self.record_processed(key, response.content)
+
+    def compile_event_results(self, event_url):
+        """
+        Compile the team results for an event just downloaded.
+
+        Returns
+        -------
+        lxml.etree.Element
+            The rendered results, or None if the team had no results.
+        """
         # If there were no results for the specified team, then the html will
         # contain some red text to the effect of "Your search returns no
         # match."
-        with open(local_file, 'r', encoding='utf-8') as fptr:
-            html = fptr.read()
-        if re.search("Your search returns no match.", html) is not None:
+        if re.search("Your search returns no match.", self.html) is not None:
             return
 
-        # So now we have a result.  Parse it for the result table.
-        parser = etree.HTMLParser()
-        tree = etree.parse(local_file, parser)
-        root = tree.getroot()
+        # So now we have a result.  Parse it, just the once, for the result
+        # table.
+        root = etree.fromstring(self.html, etree.HTMLParser())
 
         # 3rd table is the one we want.
         pattern = './/table'
@@ -195,8 +315,12 @@ class NewYorkRR(RaceResults):
         if len(tables) < 3:
             return
 
-        div = self.webify_results(tables)
-        self.insert_race_results(div)
+        self.downloaded_url = event_url
+        lines = [' '.join(''.join(tr.itertext()).split())
+                 for tr in tables[3].getchildren()[1:]]
+        self.index_document(lines, title=root.findtext('.//title'))
+
+        return self.webify_results(tables)
 
     def webify_results(self, tables):
         """Turn the results into the output form that we want.
@@ -282,6 +406,7 @@ class NewYorkRR(RaceResults):
 
         # And append the race results as-is.
         for tr in trs[1:]:
+            self.add_match_row(tr)
             new_table.append(tr)
 
         return(new_table)
@@ -0,0 +1,135 @@
+"""
+Streaming HTML output for race results.
+"""
+import os
+import shutil
+import tempfile
+
+from lxml import etree
+
+
+HEADER = """<html>
+<head>
+<link rel="stylesheet" href="{stylesheet}" type="text/css">
+</head>
+<body>
+"""
+
+FOOTER = """</body>
+</html>
+"""
+
+# The umask can only be read by setting it, which is not safe once other
+# threads may be creating files, so read it once on import.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class HtmlWriter:
+    """
+    Write race results to an HTML file one race at a time.
+
+    The document is kept open for the duration of the run.  Each race
+    fragment is appended and flushed as soon as it is finished, so a run
+    with many races never re-reads or re-parses the output.  Everything is
+    written to a temporary file in the same directory as the output file,
+    which is atomically renamed into place once the closing tags have been
+    written, or discarded if the run fails.
+
+    Attributes
+    ----------
+    output_file : str
+        Final destination of the HTML document.
+    """
+    def __init__(self, output_file, stylesheet='rr.css'):
+        """
+        Parameters
+        ----------
+        output_file : str
+            Final destination of the HTML document.
+        stylesheet : str
+            Linked from the document head.
+        """
+        self.output_file = output_file
+
+        dirname = os.path.dirname(os.path.abspath(output_file))
+        fd, self._tmpfile = tempfile.mkstemp(dir=dirname, prefix='.rr',
+                                             suffix='.tmp')
+
+        # mkstemp is private to the owner, but the output is not.
+        os.fchmod(fd, 0o666 & ~_UMASK)
+
+        self._fptr = os.fdopen(fd, 'wb')
+        self.write_raw(HEADER.format(stylesheet=stylesheet).encode())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # A run that failed part way must not replace a good document.
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def closed(self):
+        return self._fptr is None
+
+    def write(self, element):
+        """
+        Append a race to the document.
+
+        Parameters
+        ----------
+        element : lxml.etree.Element
+            Usually the <div class="race"> produced by a webify method.
+        """
+        self.write_raw(etree.tostring(element, pretty_print=True,
+                                      method='html'))
+
+    def write_raw(self, markup):
+        """
+        Append already serialized markup to the document.
+
+        Parameters
+        ----------
+        markup : bytes
+            HTML fragment.
+        """
+        self._fptr.write(markup)
+        self._fptr.flush()
+
+    def copy(self, fptr):
+        """
+        Append the contents of an open file to the document.
+
+        Parameters
+        ----------
+        fptr : file
+            Binary file object holding an HTML fragment.
+        """
+        shutil.copyfileobj(fptr, self._fptr)
+        self._fptr.flush()
+
+    def close(self):
+        """
+        Write the closing tags and move the document into place.
+        """
+        if self.closed:
+            return
+        self.write_raw(FOOTER.encode())
+        os.fsync(self._fptr.fileno())
+        self._fptr.close()
+        self._fptr = None
+        os.replace(self._tmpfile, self.output_file)
+
+    def abort(self):
+        """
+        Discard the document, leaving any existing output file untouched.
+        """
+        if self.closed:
+            return
+        self._fptr.close()
+        self._fptr = None
+        os.remove(self._tmpfile)
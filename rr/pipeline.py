@@ -0,0 +1,242 @@
+"""
+Run the stages of a race results run concurrently.
+"""
+import queue
+import threading
+import time
+
+
+# How often blocked workers check whether the pipeline has been stopped.
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class StageStats:
+    """
+    What a stage did during a run.
+
+    Attributes
+    ----------
+    name : str
+        Such as "fetch".
+    workers : int
+        Number of threads running the stage.
+    items : int
+        Items taken off the stage's input queue.
+    busy : float
+        Seconds spent working on items, summed over the workers.
+    blocked : float
+        Seconds spent waiting for room in the next queue, i.e. held back
+        because a later stage could not keep up.
+    max_depth : int
+        Longest the stage's input queue got.
+    """
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.max_depth = 0
+        self._depth_total = 0
+        self._lock = threading.Lock()
+
+    def add(self, depth, busy=0.0, blocked=0.0):
+        with self._lock:
+            self.items += 1
+            self.busy += busy
+            self.blocked += blocked
+            self.max_depth = max(self.max_depth, depth)
+            self._depth_total += depth
+
+    @property
+    def mean_depth(self):
+        return self._depth_total / self.items if self.items else 0.0
+
+    def report(self):
+        """
+        One line suitable for logging.
+        """
+        msg = ('{0}: {1} items, {2} workers, busy {3:.1f}s, '
+               'blocked {4:.1f}s, queue depth max {5} mean {6:.1f}')
+        return msg.format(self.name, self.items, self.workers, self.busy,
+                          self.blocked, self.max_depth, self.mean_depth)
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, each run by its own threads.
+
+    The first stage walks an iterable, e.g. the race URLs discovered on a
+    master page.  Every later stage applies a function to each item coming
+    off its input queue, with as many worker threads as it needs, and passes
+    the result on unless it is None.  Iterating over the pipeline yields what
+    comes out of the last stage, so the final stage of the run happens on
+    the calling thread.
+
+    Since every queue is bounded, a slow stage holds back those before it
+    instead of letting work pile up in memory, and the queue depths show
+    where the bottleneck is.  With one worker per stage, items come out in
+    the order they went in.
+
+    Attributes
+    ----------
+    queue_size : int
+        Most items waiting between any two stages.
+    stats : dict
+        StageStats keyed by stage name.  It may be shared between pipelines
+        so that a run reports its totals.
+    """
+    def __init__(self, source, name='discover', queue_size=8, stats=None,
+                 consumer='process'):
+        """
+        Parameters
+        ----------
+        source : iterable
+            Items to feed into the pipeline.
+        name : str
+            Name of the stage walking the source.
+        queue_size : int
+            Most items waiting between any two stages.
+        stats : dict
+            StageStats keyed by stage name, updated as the pipeline runs.
+        consumer : str
+            Name of the stage that iterates over the pipeline.
+        """
+        self.queue_size = queue_size
+        self.stats = {} if stats is None else stats
+        self._stages = [(name, None, 1)]
+        self._consumer = consumer
+        self._source = source
+        self._stop = threading.Event()
+        self._error = None
+
+    def add_stage(self, name, func, workers=1):
+        """
+        Append a stage.
+
+        Parameters
+        ----------
+        name : str
+            Such as "fetch".
+        func : callable
+            Takes an item and returns the item for the next stage, or None
+            to drop it.
+        workers : int
+            Number of threads running the stage.
+        """
+        self._stages.append((name, func, max(1, workers)))
+        return self
+
+    def _stats(self, name, workers):
+        if name not in self.stats:
+            self.stats[name] = StageStats(name, workers)
+        return self.stats[name]
+
+    def _put(self, outbox, item):
+        """
+        Returns seconds spent waiting for room, or None if stopped.
+        """
+        t0 = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                outbox.put(item, timeout=POLL_INTERVAL)
+                return time.monotonic() - t0
+            except queue.Full:
+                pass
+        return None
+
+    def _get(self, inbox):
+        while not self._stop.is_set():
+            try:
+                return inbox.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _run_source(self, stats, outbox, downstream):
+        try:
+            for item in self._source:
+                blocked = self._put(outbox, item)
+                if blocked is None:
+                    return
+                stats.add(0, blocked=blocked)
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            for _ in range(downstream):
+                self._put(outbox, _DONE)
+
+    def _run_worker(self, func, stats, inbox, outbox, finished, downstream):
+        try:
+            while True:
+                depth = inbox.qsize()
+                item = self._get(inbox)
+                if item is _DONE:
+                    return
+                t0 = time.monotonic()
+                result = func(item)
+                busy = time.monotonic() - t0
+                blocked = 0.0
+                if result is not None:
+                    blocked = self._put(outbox, result)
+                    if blocked is None:
+                        return
+                stats.add(depth, busy=busy, blocked=blocked)
+        except BaseException as error:
+            self._fail(error)
+        finally:
+            # The last worker of a stage to finish tells the next stage.
+            with finished['lock']:
+                finished['count'] -= 1
+                last = finished['count'] == 0
+            if last:
+                for _ in range(downstream):
+                    self._put(outbox, _DONE)
+
+    def __iter__(self):
+        queues = [queue.Queue(self.queue_size) for _ in self._stages]
+        threads = []
+        for j, (name, func, workers) in enumerate(self._stages):
+            stats = self._stats(name, workers)
+            if j + 1 < len(self._stages):
+                downstream = self._stages[j + 1][2]
+            else:
+                downstream = 1
+            if func is None:
+                threads.append(threading.Thread(
+                    target=self._run_source,
+                    args=(stats, queues[j], downstream), daemon=True))
+                continue
+            finished = {'lock': threading.Lock(), 'count': workers}
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._run_worker,
+                    args=(func, stats, queues[j - 1], queues[j], finished,
+                          downstream), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        consumer = self._stats(self._consumer, 1)
+        outbox = queues[-1]
+        try:
+            while True:
+                depth = outbox.qsize()
+                item = self._get(outbox)
+                if item is _DONE:
+                    break
+                t0 = time.monotonic()
+                yield item
+                consumer.add(depth, busy=time.monotonic() - t0)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        if self._error is not None:
+            raise self._error
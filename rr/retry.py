@@ -0,0 +1,84 @@
+"""
+Retry policy for the HTTP layer.
+"""
+import logging
+import random
+import threading
+
+
+# Server responses worth trying again.
+TRANSIENT_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+class RetryPolicy:
+    """
+    Decide whether and when to retry a failed download.
+
+    Delays grow exponentially with each attempt, with full jitter so that
+    many downloads failing together do not all come back at once.  Every
+    retry is paid for out of a budget shared by the whole run, so a host that
+    is down cannot stall the run with endless retries.
+
+    Attributes
+    ----------
+    attempts : int
+        Most times to try any one download, including the first.
+    base_delay : float
+        Seconds to wait, at most, before the first retry.  Doubles with
+        each further retry.
+    max_delay : float
+        Cap on the delay before any retry.
+    budget : int
+        Retries left for the run.  None means no limit.
+    """
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=30.0,
+                 budget=100):
+        """
+        Parameters
+        ----------
+        attempts : int
+            Most times to try any one download, including the first.
+        base_delay : float
+            Seconds to wait, at most, before the first retry.
+        max_delay : float
+            Cap on the delay before any retry.
+        budget : int
+            Retries allowed for the whole run.  None means no limit.
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retries = 0
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('race_results')
+
+    def backoff(self, error, attempt):
+        """
+        Decide whether to retry after a failed attempt.
+
+        Parameters
+        ----------
+        error : rr.fetch.FetchError
+            Why the attempt failed.
+        attempt : int
+            How many attempts have failed so far, less one.
+
+        Returns
+        -------
+        float
+            Seconds to wait before trying again, or None to give up.
+        """
+        if error.status is not None and error.status not in TRANSIENT_STATUSES:
+            return None
+        if attempt + 1 >= self.attempts:
+            return None
+        with self._lock:
+            if self.budget is not None and self.retries >= self.budget:
+                return None
+            self.retries += 1
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.base_delay * 2 ** attempt))
+        msg = '{0}, retrying in {1:.1f}s...'.format(error, delay)
+        self.logger.info(msg)
+        return delay
@@ -0,0 +1,272 @@
+"""
+Index of the races listed on each provider's master pages.
+"""
+import bisect
+import collections
+import datetime
+import sqlite3
+import time
+import urllib.parse
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedules (
+    provider TEXT NOT NULL,
+    url TEXT NOT NULL,
+    parsed_at REAL NOT NULL,
+    PRIMARY KEY (provider, url)
+);
+CREATE TABLE IF NOT EXISTS schedule_entries (
+    provider TEXT NOT NULL,
+    url TEXT NOT NULL,
+    date TEXT NOT NULL,
+    name TEXT,
+    race_url TEXT NOT NULL,
+    location TEXT,
+    first_seen REAL
+);
+CREATE INDEX IF NOT EXISTS schedule_entries_url
+    ON schedule_entries (provider, url);
+CREATE TABLE IF NOT EXISTS handed_on (
+    provider TEXT NOT NULL,
+    race_url TEXT NOT NULL,
+    handed_on REAL NOT NULL,
+    PRIMARY KEY (provider, race_url)
+);
+"""
+
+# Columns added since the table was first created.
+NEW_COLUMNS = [('first_seen', 'REAL')]
+
+
+ScheduleEntry = collections.namedtuple('ScheduleEntry',
+                                       ['date', 'name', 'url', 'location'])
+ScheduleEntry.__doc__ = """
+A race listed on a master page.
+
+Attributes
+----------
+date : datetime.date
+    When the race was run.
+name : str
+    Race name, or None if the master page does not give it.
+url : str
+    Where the results are.
+location : str
+    Where the race was run, or None if the master page does not say.
+"""
+
+
+def schedule_key(url, data=None):
+    """
+    Identify a master page, including any form data POSTed to get it.
+    """
+    if data:
+        url += '#' + urllib.parse.urlencode(sorted(data.items()))
+    return url
+
+
+def as_date(value):
+    """
+    Dates are compared as dates, even if given as datetimes.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+class Schedule:
+    """
+    The races of a master page, ordered by date.
+
+    Attributes
+    ----------
+    entries : list
+        ScheduleEntry for each race, in date order.  Races on the same day
+        are in the order the master page lists them.
+    first_seen : dict
+        When each race was first listed on the master page, as seconds since
+        the epoch keyed by race URL.  Empty unless the schedule came from a
+        ScheduleIndex.
+    """
+    def __init__(self, entries, first_seen=None):
+        self.entries = sorted(entries, key=lambda entry: entry.date)
+        self.first_seen = {} if first_seen is None else first_seen
+        self._dates = [entry.date for entry in self.entries]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def between(self, start_date, stop_date):
+        """
+        The races run from one date to another, inclusive.
+        """
+        lo = bisect.bisect_left(self._dates, as_date(start_date))
+        hi = bisect.bisect_right(self._dates, as_date(stop_date))
+        return self.entries[lo:hi]
+
+
+class ScheduleIndex:
+    """
+    Keep each master page's races once it has been parsed, so that finding
+    the races in a date range does not need the page to be downloaded and
+    parsed again until it is stale.
+
+    Master pages only grow as results are posted, so each new version of a
+    page is diffed against the last one to tell when each race was first
+    listed.  The races that a run handed on to be fetched are recorded per
+    provider, so that a later run can ask for only the others, whatever
+    date range each run covered.
+
+    Attributes
+    ----------
+    path : str
+        SQLite database file.
+    ttl : datetime.timedelta
+        How long a parsed master page is good for.
+    """
+    def __init__(self, path, ttl=datetime.timedelta(hours=12)):
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database file, created if necessary.  It may be the same
+            file as a Ledger or DocumentIndex.
+        ttl : datetime.timedelta
+            How long a parsed master page is good for.  Master pages gain
+            races as results are posted.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.conn.execute('PRAGMA table_info(schedule_entries)')]
+        for name, decl in NEW_COLUMNS:
+            if name not in columns:
+                self.conn.execute('ALTER TABLE schedule_entries ADD COLUMN '
+                                  '{0} {1}'.format(name, decl))
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, provider, url, stale=False):
+        """
+        Look up the races of a master page.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "coolrunning".
+        url : str
+            Master page, as given by schedule_key.
+        stale : bool
+            If True, return the races even if the page is due to be parsed
+            again.
+
+        Returns
+        -------
+        Schedule
+            Or None if the page has not been parsed, or not recently enough.
+        """
+        row = self.conn.execute('SELECT parsed_at FROM schedules '
+                                'WHERE provider = ? AND url = ?',
+                                (provider, url)).fetchone()
+        if row is None:
+            return None
+        if not stale and time.time() - row[0] > self.ttl.total_seconds():
+            return None
+        rows = self.conn.execute('SELECT date, name, race_url, location, '
+                                 'first_seen FROM schedule_entries '
+                                 'WHERE provider = ? AND url = ? '
+                                 'ORDER BY rowid', (provider, url))
+        entries = []
+        first_seen = {}
+        for date, name, race_url, location, seen in rows:
+            entries.append(ScheduleEntry(datetime.date.fromisoformat(date),
+                                         name, race_url, location))
+            if seen is not None:
+                first_seen[race_url] = seen
+        return Schedule(entries, first_seen)
+
+    def put(self, provider, url, entries):
+        """
+        Replace the races of a master page with a newer version.  Races
+        that the last version listed keep the time they were first seen.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "coolrunning".
+        url : str
+            Master page, as given by schedule_key.
+        entries : iterable
+            ScheduleEntry for each race.
+
+        Returns
+        -------
+        Schedule
+            The races, with when each was first seen.
+        """
+        entries = list(entries)
+        now = time.time()
+        rows = self.conn.execute('SELECT race_url, first_seen '
+                                 'FROM schedule_entries '
+                                 'WHERE provider = ? AND url = ?',
+                                 (provider, url))
+        first_seen = {race_url: seen for race_url, seen in rows
+                      if seen is not None}
+        first_seen = {entry.url: first_seen.get(entry.url, now)
+                      for entry in entries}
+        with self.conn:
+            self.conn.execute('DELETE FROM schedule_entries '
+                              'WHERE provider = ? AND url = ?',
+                              (provider, url))
+            self.conn.executemany('INSERT INTO schedule_entries '
+                                  '(provider, url, date, name, race_url, '
+                                  'location, first_seen) '
+                                  'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                  [(provider, url, entry.date.isoformat(),
+                                    entry.name, entry.url, entry.location,
+                                    first_seen[entry.url])
+                                   for entry in entries])
+            self.conn.execute('INSERT OR REPLACE INTO schedules '
+                              '(provider, url, parsed_at) VALUES (?, ?, ?)',
+                              (provider, url, now))
+        return Schedule(entries, first_seen)
+
+    def handed_on(self, provider):
+        """
+        The races of a provider that have been handed on to be fetched.
+
+        Returns
+        -------
+        dict
+            When each race was first handed on, as seconds since the epoch
+            keyed by race URL.
+        """
+        rows = self.conn.execute('SELECT race_url, handed_on FROM handed_on '
+                                 'WHERE provider = ?', (provider,))
+        return dict(rows)
+
+    def hand_on(self, provider, urls, when=None):
+        """
+        Record races as handed on to be fetched.  Races already recorded
+        keep the time they were first handed on.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "coolrunning".
+        urls : iterable
+            Race URLs.
+        when : float
+            Seconds since the epoch, the current time by default.
+        """
+        if when is None:
+            when = time.time()
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO handed_on '
+                                  '(provider, race_url, handed_on) '
+                                  'VALUES (?, ?, ?)',
+                                  [(provider, url, when) for url in urls])
@@ -0,0 +1,125 @@
+"""
+Download many documents at once.
+"""
+import collections
+import concurrent.futures
+import threading
+import urllib.parse
+
+from .fetch import FetchError
+
+
+class FetchScheduler:
+    """
+    Fetch a batch of URLs on a bounded thread pool, or on the fetcher's own
+    event loop if it has one.
+
+    No more than a fixed number of requests are in flight to any one host,
+    so that many races can be downloaded at once without hammering a single
+    timing company's web site.
+
+    Attributes
+    ----------
+    fetcher : rr.fetch.Fetcher
+        Does the actual downloading.
+    jobs : int
+        Number of downloads in flight at once, across all hosts.
+    per_host : int
+        Number of downloads in flight at once to any single host.
+    """
+    def __init__(self, fetcher, jobs=1, per_host=None):
+        """
+        Parameters
+        ----------
+        fetcher : rr.fetch.Fetcher
+            Does the actual downloading.
+        jobs : int
+            Number of downloads in flight at once, across all hosts.
+        per_host : int
+            Number of downloads in flight at once to any single host.  By
+            default, the number of connections the fetcher keeps per host.
+        """
+        self.fetcher = fetcher
+        self.jobs = jobs
+        if per_host is None:
+            per_host = fetcher.max_connections
+        self.per_host = per_host
+
+        self._lock = threading.Lock()
+        self._hosts = collections.defaultdict(
+            lambda: threading.BoundedSemaphore(self.per_host))
+
+    def fetch(self, url, kwargs=None):
+        """
+        Download a single document, waiting for a free slot for its host.
+
+        Raises
+        ------
+        rr.fetch.FetchError
+            If the document could not be retrieved.
+        """
+        return self._fetch(url, kwargs or {})
+
+    def _fetch(self, url, kwargs):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._hosts[host]
+        with semaphore:
+            return self.fetcher.fetch(url, **kwargs)
+
+    def fetch_all(self, requests, jobs=None):
+        """
+        Download a batch of documents.
+
+        Parameters
+        ----------
+        requests : iterable
+            URLs, or (URL, dict) pairs where the dictionary holds keyword
+            arguments for the fetcher, such as POST data.  A fetcher with a
+            fetch_all of its own consumes them lazily, as does a single
+            job; otherwise they are all read up front.
+        jobs : int
+            Number of downloads in flight at once for this batch, if not
+            the scheduler's own.  The limit per host still applies.
+
+        Yields
+        ------
+        tuple
+            (url, response, error) for each request as it completes.  Either
+            the response or the error is None.  With a single job, requests
+            complete in the order given.
+        """
+        requests = ((request, {}) if isinstance(request, str) else request
+                    for request in requests)
+        if jobs is None:
+            jobs = self.jobs
+
+        if hasattr(self.fetcher, 'fetch_all'):
+            # The fetcher multiplexes requests itself, e.g. with asyncio,
+            # and takes them as they are discovered.
+            yield from self.fetcher.fetch_all(requests, jobs=jobs,
+                                              per_host=self.per_host)
+            return
+
+        if jobs <= 1:
+            for url, kwargs in requests:
+                try:
+                    yield url, self._fetch(url, kwargs), None
+                except FetchError as error:
+                    yield url, None, error
+            return
+
+        executor = concurrent.futures.ThreadPoolExecutor(jobs)
+        futures = {executor.submit(self._fetch, url, kwargs): url
+                   for url, kwargs in requests}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except FetchError as error:
+                    yield futures[future], None, error
+        finally:
+            # The caller may have stopped early.
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
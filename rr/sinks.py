@@ -0,0 +1,112 @@
+"""
+Machine-readable outputs for matched race results.
+"""
+import csv
+import gzip
+import json
+import sys
+
+
+# Size of the write buffer for sinks backed by files.
+BUFSIZE = 64 * 1024
+
+FIELDS = ['provider', 'race', 'date', 'url', 'line']
+
+
+def open_text(path):
+    """
+    Open a text file for buffered writing.
+
+    Parameters
+    ----------
+    path : str
+        Output path.  "-" means standard output, and a ".gz" suffix means
+        the output is gzip-compressed.
+    """
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'wt', encoding='utf-8', newline='', buffering=BUFSIZE)
+
+
+class Sink:
+    """
+    Receives each matched result as a record.
+
+    A record is a dictionary with the keys
+
+        provider : web site, e.g. "coolrunning"
+        race : race name
+        date : race date in ISO format, or None
+        url : where the results came from, or None
+        line : the matched result as it appeared in the race
+        columns : list of the individual fields of the result
+        member : (last name, first name) from the membership list, or None
+    """
+    def write(self, record):
+        raise NotImplementedError
+
+    def discard(self, url):
+        """
+        Forget the records of a race document, before its corrected results
+        are written.  Sinks that can only append leave them be.
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink(Sink):
+    """
+    Write one JSON object per record.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Output path, see open_text.
+        """
+        self.path = path
+        self._fptr = open_text(path)
+
+    def write(self, record):
+        self._fptr.write(json.dumps(record) + '\n')
+
+    def close(self):
+        if self._fptr is sys.stdout:
+            self._fptr.flush()
+        else:
+            self._fptr.close()
+
+
+class CSVSink(Sink):
+    """
+    Write one CSV row per record.
+
+    The fixed fields come first, followed by the individual columns of the
+    result, so rows may vary in length.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            Output path, see open_text.
+        """
+        self.path = path
+        self._fptr = open_text(path)
+        self._writer = csv.writer(self._fptr)
+        self._writer.writerow(FIELDS + ['columns'])
+
+    def write(self, record):
+        row = [record[field] for field in FIELDS]
+        self._writer.writerow(row + record['columns'])
+
+    def close(self):
+        if self._fptr is sys.stdout:
+            self._fptr.flush()
+        else:
+            self._fptr.close()
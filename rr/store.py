@@ -0,0 +1,209 @@
+"""
+SQLite database of matched race results.
+"""
+import json
+import sqlite3
+
+from .sinks import Sink
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    id INTEGER PRIMARY KEY,
+    provider TEXT NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT,
+    UNIQUE (provider, name, date)
+);
+CREATE INDEX IF NOT EXISTS races_date ON races (date);
+CREATE INDEX IF NOT EXISTS races_name ON races (name COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    race_id INTEGER NOT NULL REFERENCES races (id),
+    url TEXT NOT NULL,
+    UNIQUE (url, race_id)
+);
+CREATE INDEX IF NOT EXISTS documents_race ON documents (race_id);
+
+CREATE TABLE IF NOT EXISTS members (
+    id INTEGER PRIMARY KEY,
+    last_name TEXT NOT NULL COLLATE NOCASE,
+    first_name TEXT NOT NULL COLLATE NOCASE,
+    UNIQUE (last_name, first_name)
+);
+CREATE INDEX IF NOT EXISTS members_first_name ON members (first_name);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    member_id INTEGER REFERENCES members (id),
+    line TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    UNIQUE (document_id, line)
+);
+CREATE INDEX IF NOT EXISTS results_member ON results (member_id);
+"""
+
+SELECT_RESULTS = """
+SELECT races.date, races.provider, races.name, documents.url,
+       members.last_name, members.first_name, results.line
+FROM results
+JOIN documents ON documents.id = results.document_id
+JOIN races ON races.id = documents.race_id
+LEFT JOIN members ON members.id = results.member_id
+"""
+
+
+class ResultsStore(Sink):
+    """
+    Persist every matched result into a SQLite database.
+
+    Records are buffered and written in batches, each batch inside a single
+    transaction.  Writing the same result twice is harmless.
+
+    Attributes
+    ----------
+    path : str
+        SQLite database file.
+    batch_size : int
+        Number of records to accumulate before writing them out.
+    """
+    def __init__(self, path, batch_size=500):
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database file, created if necessary.
+        batch_size : int
+            Number of records to accumulate before writing them out.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self._pending = []
+        self._ids = {}
+
+    def write(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out any pending records in a single transaction.
+        """
+        with self.conn:
+            for record in self._pending:
+                self._insert(record)
+        self._pending = []
+
+    def discard(self, url):
+        """
+        Delete the results of a race document, so that corrected results
+        replace them rather than sit beside them.
+        """
+        self.flush()
+        with self.conn:
+            self.conn.execute('DELETE FROM results WHERE document_id IN '
+                              '(SELECT id FROM documents WHERE url = ?)',
+                              (url,))
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _id(self, table, **columns):
+        """
+        Look up the row with the given unique columns, inserting it first if
+        need be.
+        """
+        names = sorted(columns)
+        values = [columns[name] for name in names]
+        key = (table, tuple(values))
+        if key in self._ids:
+            return self._ids[key]
+
+        sql = 'INSERT OR IGNORE INTO {0} ({1}) VALUES ({2})'
+        sql = sql.format(table, ', '.join(names), ', '.join('?' * len(names)))
+        self.conn.execute(sql, values)
+
+        # "IS" rather than "=" so that a NULL date matches.
+        sql = 'SELECT id FROM {0} WHERE {1}'
+        sql = sql.format(table, ' AND '.join(name + ' IS ?' for name in names))
+        self._ids[key] = self.conn.execute(sql, values).fetchone()[0]
+        return self._ids[key]
+
+    def _insert(self, record):
+        race_id = self._id('races', provider=record['provider'],
+                           name=record['race'], date=record['date'])
+        document_id = self._id('documents', race_id=race_id,
+                               url=record['url'] or '')
+        if record.get('member') is None:
+            member_id = None
+        else:
+            last_name, first_name = record['member']
+            member_id = self._id('members', last_name=last_name,
+                                 first_name=first_name)
+        sql = ('INSERT OR IGNORE INTO results '
+               '(document_id, member_id, line, columns) VALUES (?, ?, ?, ?)')
+        self.conn.execute(sql, (document_id, member_id, record['line'],
+                                json.dumps(record['columns'])))
+
+    def results_for_member(self, name, year=None):
+        """
+        Find all results for a member.
+
+        Parameters
+        ----------
+        name : str
+            Each word must match either the first or last name, so "Strawn",
+            "Mark Strawn" and "STRAWN MARK" all work.
+        year : int
+            If given, restrict the search to races in this year.
+
+        Returns
+        -------
+        list
+            (date, provider, race, url, last name, first name, line) tuples
+            ordered by date.
+
+        Raises
+        ------
+        ValueError
+            If the name is empty.
+        """
+        if len(name.split()) == 0:
+            raise ValueError('no member name given')
+        clauses = []
+        params = []
+        for word in name.split():
+            clauses.append('(members.last_name = ? OR members.first_name = ?)')
+            params.extend([word, word])
+        if year is not None:
+            clauses.append('races.date BETWEEN ? AND ?')
+            params.extend(['{0}-01-01'.format(year), '{0}-12-31'.format(year)])
+        sql = SELECT_RESULTS
+        sql += 'WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY races.date, races.name'
+        return self.conn.execute(sql, params).fetchall()
+
+    def results_on(self, date):
+        """
+        Find all results for races on a given date.
+
+        Parameters
+        ----------
+        date : datetime.date
+            Race date.
+
+        Returns
+        -------
+        list
+            (date, provider, race, url, last name, first name, line) tuples
+            ordered by race.
+        """
+        sql = SELECT_RESULTS
+        sql += 'WHERE races.date = ? ORDER BY races.provider, races.name'
+        return self.conn.execute(sql, (date.isoformat(),)).fetchall()
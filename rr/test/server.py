@@ -0,0 +1,151 @@
+"""
+Local stand-in for the web sites that race results are downloaded from.
+"""
+import collections
+import http.server
+import threading
+import unittest
+import urllib.parse
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """
+    Answer each request from the server's routes.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=None):
+        """
+        Send a complete response.
+
+        Parameters
+        ----------
+        body : bytes or str
+            Response body.  Text is encoded as UTF-8.
+        status : int
+            HTTP status code.
+        headers : dict
+            Any headers besides Content-Length.
+        """
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """
+        The body of a POST request.
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def query(self):
+        """
+        The query string, parsed.
+        """
+        return urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+    def dispatch(self):
+        path = urllib.parse.urlsplit(self.path).path
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            self.server.hits[path] += 1
+        route = self.server.route(path)
+        if route is None:
+            self.send_body(b'nope', status=404)
+        elif callable(route):
+            route(self)
+        else:
+            self.send_body(route)
+
+    do_GET = dispatch
+    do_POST = dispatch
+
+
+class WebServer(http.server.ThreadingHTTPServer):
+    """
+    Threaded web server on a free local port.
+
+    Attributes
+    ----------
+    routes : dict
+        Maps a path to what is served there, either the body itself or a
+        function taking the request handler that sends the response.  A
+        request goes to the longest path that its own path starts with, so
+        "/" catches everything.  Routes may be changed while serving.
+    requests : list
+        Path and query string of every request, in order.
+    hits : collections.Counter
+        Number of requests for each path, without the query string.
+    base_url : str
+        Such as "http://127.0.0.1:8080".
+    lock : threading.Lock
+        Held while the request counts are updated.  Routes may use it for
+        their own counts.
+    """
+    def __init__(self, routes=None):
+        """
+        Parameters
+        ----------
+        routes : dict
+            Initial routes.
+        """
+        http.server.ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0),
+                                                 Handler)
+        self.routes = dict(routes or {})
+        self.requests = []
+        self.hits = collections.Counter()
+        self.lock = threading.Lock()
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server_port)
+        self.thread = threading.Thread(target=self.serve_forever)
+
+    def route(self, path):
+        matches = [prefix for prefix in self.routes if path.startswith(prefix)]
+        if len(matches) == 0:
+            return None
+        return self.routes[max(matches, key=len)]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving.  Harmless if already stopped.
+        """
+        if self.thread.is_alive():
+            self.shutdown()
+            self.thread.join()
+        self.server_close()
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Serve the test case's routes for the length of each test.
+
+    Attributes
+    ----------
+    server : WebServer
+        The running server.
+    base_url : str
+        Where it is.
+    """
+    def routes(self):
+        """
+        What the server starts out serving.  Override in each test case.
+        """
+        return {}
+
+    def setUp(self):
+        self.server = WebServer(self.routes()).start()
+        self.base_url = self.server.base_url
+
+    def tearDown(self):
+        self.server.stop()
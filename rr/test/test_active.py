@@ -5,8 +5,15 @@ import tempfile
 import time
 import unittest
 
+from lxml import etree
+
+from rr.active import ActiveRR
+from rr.fetch import Fetcher
+from rr.test.server import ServerTestCase
 #from rr import Active
 
+PAGES = 5
+
 
 @unittest.skip("active not supported at the moment")
 class TestActive(unittest.TestCase):
@@ -72,5 +79,110 @@ class TestActive(unittest.TestCase):
             self.assertTrue("PAUL HIMBERGER" in html)
 
 
+def results_page(page, window=None):
+    """
+    Minimal Active.com results page, with ten finishers per page.  If a
+    window is given, the pagination only lists that many pages past this
+    one.
+    """
+    rows = ''.join('<tr><td>{0}</td><td>{1}</td><td>{2}</td></tr>'.format(
+                   place, place, 'JOHN SMITH' if place == 42
+                   else 'RUNNER {0}'.format(place))
+                   for place in range(10 * page - 9, 10 * page + 1))
+    links = ''.join('<a href="/events/1/results?page={0}">{0}</a>'.format(n)
+                    for n in range(1, PAGES + 1) if n != page
+                    and (window is None or n <= page + window))
+    if page < PAGES:
+        links += ('<a rel="next" href="/events/1/results?page={0}">'
+                  'Next</a>').format(page + 1)
+    return ('<html><head><title>Turkey Trot</title></head><body>'
+            '<div class="page-heading"><div class="headers">'
+            '<h1>Turkey Trot</h1><h3><time>11/27/2014</time></h3>'
+            '</div></div><table class="participant-list">'
+            '<tr><th>Place</th><th>Bib</th><th>Name</th></tr>{0}</table>'
+            '<div class="pagination">{1}</div></body></html>'
+            ).format(rows, links).encode()
+
+
+class TestActivePagination(ServerTestCase):
+    """
+    Test fetching the pages of a race's results.
+    """
+    def routes(self):
+        # Stand-in for the Active.com results site.
+        return {'/events/1/results': lambda handler: handler.send_body(
+            results_page(int(handler.query()['page'][0]),
+                         window=handler.server.window))}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.window = None
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_pages(self):
+        """
+        Verify that every page is fetched once and matched.
+        """
+        o = self.check_pages()
+        self.assertEqual(o.stage_stats['fetch page'].items, PAGES - 1)
+
+    def test_truncated(self):
+        """
+        Verify that pages past those listed on the lead-in page are still
+        fetched, whether or not later pages list them.
+        """
+        for window in [2, 0]:
+            self.server.window = window
+            self.server.requests.clear()
+            self.check_pages()
+
+    def check_pages(self):
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\n')
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        o = ActiveRR(date_range=(None, None), verbose='critical',
+                     membership_list=membership, output_file=output_file,
+                     base_url=self.base_url, fetcher=Fetcher())
+        o.initialize_output_file()
+        o.process_results_page(self.base_url + '/events/1/results?page=1')
+        o.finalize_output_file()
+        o.fetcher.close()
+
+        self.assertEqual(len(self.server.requests), PAGES)
+        self.assertEqual(len(set(self.server.requests)), PAGES)
+        doc = etree.parse(output_file, etree.HTMLParser())
+        rows = doc.findall('.//div[@class="race"]/table/tr')
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1].findtext('td'), '42')
+        return o
+
+    def test_page_urls(self):
+        """
+        Verify that the page count is read off a page's pagination links.
+        """
+        o = ActiveRR(date_range=(None, None), verbose='critical',
+                     base_url=self.base_url)
+        doc = etree.fromstring(results_page(1), etree.HTMLParser())
+        urls = o.page_urls(doc)
+        self.assertEqual(urls, ['{0}/events/1/results?page={1}'.format(
+                                self.base_url, page)
+                                for page in range(2, PAGES + 1)])
+        doc = etree.fromstring(results_page(PAGES), etree.HTMLParser())
+        self.assertEqual(o.page_urls(doc), [])
+
+        # Only the pages after those already fetched are wanted.
+        doc = etree.fromstring(results_page(3, window=2), etree.HTMLParser())
+        self.assertEqual(o.page_urls(doc, after=3),
+                         ['{0}/events/1/results?page={1}'.format(
+                          self.base_url, page) for page in [4, 5]])
+        doc = etree.fromstring(results_page(1, window=0), etree.HTMLParser())
+        self.assertIsNone(o.page_urls(doc))
+
+
 if __name__ == "__main__":
     unittest.main()
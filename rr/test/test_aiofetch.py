@@ -0,0 +1,218 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from rr.aiofetch import AsyncFetcher
+from rr.common import RaceResults
+from rr.fetch import FetchError
+from rr.scheduler import FetchScheduler
+
+
+class StandIn:
+    """
+    Local asyncio web server standing in for a race results web site.
+    """
+    def __init__(self):
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.handle, '127.0.0.1', 0),
+            self.loop).result()
+        port = self.server.sockets[0].getsockname()[1]
+        self.base_url = 'http://127.0.0.1:{0}'.format(port)
+
+    def close(self):
+        async def stop():
+            self.server.close()
+            tasks = [task for task in asyncio.all_tasks()
+                     if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split()
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, value = line.split(':', 1)
+                    headers[key.lower()] = value.strip()
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(
+                        int(headers['content-length']))
+                await self.respond(writer, method, path, headers, body)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, path, headers, body):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        extra = ''
+        status = '200 OK'
+        if path == '/slow':
+            await asyncio.sleep(5)
+        elif path.startswith('/race'):
+            await asyncio.sleep(0.05)
+        self.in_flight -= 1
+
+        if path == '/chunked':
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Transfer-Encoding: chunked\r\n\r\n'
+                         b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+            return
+        if path == '/redirect':
+            status = '302 Found'
+            extra = 'Location: /race1\r\n'
+            payload = b''
+        elif path == '/login':
+            extra = 'Set-Cookie: session=abc123; Path=/\r\n'
+            payload = b'logged in'
+        elif path == '/whoami':
+            payload = headers.get('cookie', '').encode()
+        elif path == '/missing':
+            status = '404 Not Found'
+            payload = b'nope'
+        elif method == 'POST':
+            payload = body
+        else:
+            payload = path.encode()
+        head = 'HTTP/1.1 {0}\r\nContent-Length: {1}\r\n{2}\r\n'
+        writer.write(head.format(status, len(payload), extra).encode())
+        writer.write(payload)
+        await writer.drain()
+
+
+class TestAsyncFetcher(unittest.TestCase):
+    """
+    Test the asyncio backend against a local asyncio web server.
+    """
+    def setUp(self):
+        self.standin = StandIn()
+        self.base_url = self.standin.base_url
+
+    def tearDown(self):
+        self.standin.close()
+
+    def test_fetch(self):
+        """
+        Verify plain, chunked, redirected and POSTed requests over a single
+        kept-alive connection.
+        """
+        fetcher = AsyncFetcher()
+        self.assertEqual(fetcher.fetch(self.base_url + '/race1').text,
+                         '/race1')
+        self.assertEqual(fetcher.fetch(self.base_url + '/chunked').text,
+                         'hello world')
+        response = fetcher.fetch(self.base_url + '/redirect')
+        self.assertEqual(response.url, self.base_url + '/race1')
+        response = fetcher.fetch(self.base_url + '/search',
+                                 data={'team_code': 'RARI'})
+        self.assertEqual(response.text, 'team_code=RARI')
+        fetcher.close()
+        self.assertEqual(self.standin.connections, 1)
+
+    def test_cookies_and_errors(self):
+        """
+        Verify that cookies are shared and HTTP errors raise FetchError.
+        """
+        fetcher = AsyncFetcher()
+        fetcher.fetch(self.base_url + '/login')
+        self.assertEqual(fetcher.fetch(self.base_url + '/whoami').text,
+                         'session=abc123')
+        with self.assertRaises(FetchError) as context:
+            fetcher.fetch(self.base_url + '/missing')
+        self.assertEqual(context.exception.status, 404)
+        fetcher.close()
+
+    def test_many_in_flight(self):
+        """
+        Verify that the scheduler hands a batch to the event loop and that
+        the per-host limit holds.
+        """
+        fetcher = AsyncFetcher(max_connections=50)
+        urls = [self.base_url + '/race{0}'.format(j) for j in range(200)]
+        scheduler = FetchScheduler(fetcher, jobs=200, per_host=50)
+        results = list(scheduler.fetch_all(urls))
+        fetcher.close()
+
+        self.assertEqual(sorted(url for url, _, _ in results), sorted(urls))
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(self.standin.max_in_flight, 50)
+
+    def test_lazy(self):
+        """
+        Verify that a batch is taken from a generator only as fast as the
+        results are taken.
+        """
+        fetcher = AsyncFetcher()
+        taken = []
+
+        def requests():
+            for j in range(20):
+                taken.append(j)
+                yield self.base_url + '/race{0}'.format(j)
+
+        results = fetcher.fetch_all(requests(), jobs=3)
+        next(results)
+        time.sleep(0.2)
+        self.assertLessEqual(len(taken), 5)
+        self.assertEqual(len(list(results)), 19)
+        fetcher.close()
+
+    def test_race_results(self):
+        """
+        Verify that race downloads are multiplexed on the event loop rather
+        than run on a thread each.
+        """
+        rr = RaceResults(verbose='critical')
+        rr.fetcher.close()
+        rr.fetcher = AsyncFetcher(max_connections=8)
+        rr.jobs = 4
+        urls = [self.base_url + '/race{0}'.format(j) for j in range(12)]
+        self.assertEqual(sorted(url for url, _ in rr.fetch_all(urls)),
+                         sorted(urls))
+        rr.fetcher.close()
+        self.assertEqual(rr.stage_stats['fetch'].workers, 1)
+        self.assertEqual(self.standin.max_in_flight, 4)
+
+    def test_deadline(self):
+        """
+        Verify that outstanding requests are cancelled at the deadline.
+        """
+        fetcher = AsyncFetcher(deadline=0.5)
+        urls = [self.base_url + '/slow', self.base_url + '/race1']
+        t0 = time.monotonic()
+        results = dict((url, error) for url, _, error
+                       in fetcher.fetch_all(urls, jobs=2))
+        self.assertLess(time.monotonic() - t0, 2)
+        self.assertTrue('deadline' in str(results[self.base_url + '/slow']))
+        self.assertIsNone(results[self.base_url + '/race1'])
+
+        with self.assertRaises(FetchError):
+            fetcher.fetch(self.base_url + '/race2')
+        fetcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
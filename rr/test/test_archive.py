@@ -0,0 +1,83 @@
+import os
+import tempfile
+import time
+import unittest
+
+from rr.archive import RecordingFetcher, ReplayFetcher
+from rr.fetch import Fetcher, FetchError
+from rr.test.server import ServerTestCase
+
+
+def slow(handler):
+    time.sleep(0.2)
+    handler.send_body(b'slow')
+
+
+def results(handler):
+    cookie = handler.headers.get('Cookie', '').encode()
+    handler.send_body(cookie + b' ' + handler.read_body())
+
+
+class TestArchive(ServerTestCase):
+    """
+    Test recording traffic from a local web server and replaying it offline.
+    The server stands in for a web site that needs a session cookie, like
+    NYRR.
+    """
+    def routes(self):
+        return {
+            '/search': lambda handler: handler.send_body(
+                b'form', headers={'Set-Cookie': 'id=42; Path=/'}),
+            '/slow': slow,
+            '/results': results,
+        }
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_record_replay(self):
+        """
+        Verify that a session with cookies and POSTs is replayed offline.
+        """
+        for archive in ['run.jsonl', 'run.jsonl.gz']:
+            path = os.path.join(self.tempdir.name, archive)
+            fetcher = RecordingFetcher(Fetcher(), path)
+            fetcher.fetch(self.base_url + '/search')
+            recorded = fetcher.fetch(self.base_url + '/results',
+                                     data={'team_code': 'RARI'})
+            with self.assertRaises(FetchError):
+                fetcher.fetch(self.base_url + '/missing')
+            fetcher.fetch(self.base_url + '/slow')
+            fetcher.close()
+            self.assertEqual(recorded.text, 'id=42 team_code=RARI')
+        self.server.stop()
+
+        fetcher = ReplayFetcher(path)
+        response = fetcher.fetch(self.base_url + '/results',
+                                 data={'team_code': 'RARI'})
+        self.assertEqual(response.text, 'id=42 team_code=RARI')
+        self.assertEqual(fetcher.fetch(self.base_url + '/search').text,
+                         'form')
+        with self.assertRaises(FetchError):
+            fetcher.fetch(self.base_url + '/missing')
+        with self.assertRaises(FetchError):
+            fetcher.fetch(self.base_url + '/results',
+                          data={'team_code': 'NYRR'})
+
+        t0 = time.monotonic()
+        fetcher.fetch(self.base_url + '/slow')
+        self.assertLess(time.monotonic() - t0, 0.1)
+
+        fetcher = ReplayFetcher(path, latency=True)
+        t0 = time.monotonic()
+        fetcher.fetch(self.base_url + '/slow')
+        self.assertGreaterEqual(time.monotonic() - t0, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+from rr.blobstore import BlobStore
+
+
+class TestBlobStore(unittest.TestCase):
+    """
+    Test the content-addressed store of downloaded pages.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_round_trip(self):
+        """
+        Verify that identical pages are stored once and read back by URL.
+        """
+        for codec in ['zlib', 'lzma']:
+            directory = os.path.join(self.tempdir.name, codec)
+            store = BlobStore(directory, codec=codec)
+            content = b'<pre>1  MICHAEL CARR  22:18</pre>' * 100
+            digest = store.put('http://a/ma.shtml', content, season=2013)
+            self.assertEqual(store.put('http://b/ma.shtml', content), digest)
+            self.assertEqual(store.get('http://b/ma.shtml'), content)
+            self.assertIsNone(store.get('http://c/ma.shtml'))
+            self.assertLess(store.loose_size(), len(content))
+            store.close()
+
+    def test_eviction(self):
+        """
+        Verify that the least recently used pages are evicted first.
+        """
+        store = BlobStore(self.tempdir.name, max_bytes=100)
+        pages = {url: os.urandom(60) for url in ['a', 'b', 'c']}
+        store.put('a', pages['a'])
+        store.put('b', pages['b'])
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(store.get('b'), pages['b'])
+        store.put('c', pages['c'])
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('c'), pages['c'])
+        self.assertLessEqual(store.loose_size(), 100)
+        store.close()
+
+    def test_pack(self):
+        """
+        Verify that a season is compacted into one pack file.
+        """
+        store = BlobStore(self.tempdir.name)
+        pages = {'race{0}'.format(j): os.urandom(50) for j in range(5)}
+        for url, content in pages.items():
+            store.put(url, content, season=2012)
+        store.put('current', b'this season', season=2013)
+
+        self.assertEqual(store.pack(2012), 5)
+        self.assertEqual(store.pack(2012), 0)
+        packs = os.listdir(os.path.join(self.tempdir.name, 'packs'))
+        self.assertEqual(packs, ['2012.pack'])
+        # Only this season's page is still loose.
+        self.assertLess(store.loose_size(), 50)
+        store.close()
+
+        store = BlobStore(self.tempdir.name)
+        for url, content in pages.items():
+            self.assertEqual(store.get(url), content)
+        self.assertEqual(store.get('current'), b'this season')
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import datetime
+import tempfile
+import unittest
+
+from rr.aiofetch import AsyncFetcher
+from rr.cache import HttpCache
+from rr.fetch import Fetcher
+from rr.test.server import ServerTestCase
+
+
+def race(handler):
+    """
+    Stand-in for a web site that supports conditional GETs.
+    """
+    etag = '"v{0}"'.format(handler.server.version)
+    if handler.headers.get('If-None-Match') == etag:
+        handler.send_response(304)
+        handler.send_header('ETag', etag)
+        handler.end_headers()
+        return
+    body = 'version {0}'.format(handler.server.version)
+    handler.send_body(body, headers={
+        'ETag': etag, 'Last-Modified': 'Sat, 01 Jun 2013 12:00:00 GMT'})
+
+
+class TestHttpCache(ServerTestCase):
+    """
+    Test the on-disk HTTP cache against a local web server.
+    """
+    def routes(self):
+        return {'/race.htm': race}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.version = 1
+        self.url = self.base_url + '/race.htm'
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_not_modified(self):
+        """
+        Verify that a 304 is answered from the cache.
+        """
+        fetcher = Fetcher(cache=HttpCache(self.tempdir.name))
+        first = fetcher.fetch(self.url)
+        second = fetcher.fetch(self.url)
+        fetcher.close()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(first.text, 'version 1')
+        self.assertEqual(second.text, 'version 1')
+        self.assertEqual(second.status, 200)
+
+    def test_modified(self):
+        """
+        Verify that a changed document replaces the cached one.
+        """
+        fetcher = Fetcher(cache=HttpCache(self.tempdir.name))
+        fetcher.fetch(self.url)
+        self.server.version = 2
+        response = fetcher.fetch(self.url)
+        fetcher.close()
+        self.assertEqual(response.text, 'version 2')
+
+        fetcher = Fetcher(cache=HttpCache(self.tempdir.name))
+        response = fetcher.fetch(self.url)
+        fetcher.close()
+        self.assertEqual(response.text, 'version 2')
+
+    def test_immutable(self):
+        """
+        Verify that old race pages are served without any request.
+        """
+        cache = HttpCache(self.tempdir.name,
+                          immutable_after=datetime.timedelta(days=30))
+        fetcher = Fetcher(cache=cache)
+        fetcher.fetch(self.url, immutable=True)
+        response = fetcher.fetch(self.url, immutable=True)
+        self.assertEqual(response.text, 'version 1')
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Master pages are always revalidated.
+        fetcher.fetch(self.url)
+        fetcher.close()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_asyncio(self):
+        """
+        Verify that the asyncio backend revalidates too.
+        """
+        fetcher = AsyncFetcher(cache=HttpCache(self.tempdir.name))
+        fetcher.fetch(self.url)
+        response = fetcher.fetch(self.url)
+        fetcher.close()
+        self.assertEqual(response.text, 'version 1')
+        self.assertEqual(len(self.server.requests), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,15 @@ import tempfile
 import unittest
 from xml.etree import cElementTree as ET
 
+from lxml import etree
+
 import rr
+from rr.aiofetch import AsyncFetcher
+from rr.crrr import CoolRunning
+from rr.fetch import Fetcher
+from rr.ledger import Ledger
+from rr.store import ResultsStore
+from rr.test.server import ServerTestCase
 
 
 class TestCoolRunning(unittest.TestCase):
@@ -406,5 +414,142 @@ class TestRacingCompanies(unittest.TestCase):
         self.run_test(racefile, "ZACH DAY")
 
 
+def crrr_page(title, lines, links=()):
+    """
+    Minimal vanilla CoolRunning result file.
+    """
+    anchors = ''.join('<a href="./{0}">{0}</a>\n'.format(link)
+                      for link in links)
+    return ('<html><head>\n<meta name="Author" content="ACCU" />\n'
+            '</head><body>\n<h1>{0}</h1>\n<h2>Somewhere, MA</h2>\n{1}'
+            '<pre>\nPlace  Name  Time\n{2}\n</pre>\n</body></html>'
+            ).format(title, anchors, '\n'.join(lines)).encode()
+
+
+class TestCoolRunningCrawl(ServerTestCase):
+    """
+    Test downloading races along with their secondary result files.
+    """
+    def routes(self):
+        links = ['Dec9_Jingle_set1.shtml', 'Dec9_Jingle_set2.shtml',
+                 'Dec9_Jingle_set3.shtml', 'Dec9_Jingle_set3.shtml',
+                 'Dec9_Other_set2.shtml']
+        return {
+            '/results/12/ma/Dec9_Jingle_set1.shtml':
+                crrr_page('Jingle 5K', ['1  JOHN SMITH  18:01'], links),
+            '/results/12/ma/Dec9_Jingle_set2.shtml':
+                crrr_page('Jingle 5K', ['1  JANE DOE  28:45'], links),
+            '/results/12/ma/Dec9_Jingle_set3.shtml':
+                crrr_page('Jingle 5K', ['1  NOBODY ELSE  35:00'], links),
+        }
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_race_sets(self):
+        """
+        Verify that every result file of a race is fetched once and that
+        the race ends up in a single section.
+        """
+        self.check_race_sets(Fetcher())
+
+    def test_race_sets_asyncio(self):
+        """
+        Verify the same with the first result files multiplexed on an event
+        loop.
+        """
+        self.check_race_sets(AsyncFetcher())
+
+    def check_race_sets(self, fetcher):
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\nDOE,JANE\n')
+        crrr = CoolRunning(verbose='critical', membership_list=membership,
+                           output_file=output_file)
+        crrr.fetcher = fetcher
+        crrr.jobs = 2
+        crrr.initialize_output_file()
+        url = self.base_url + '/results/12/ma/Dec9_Jingle_set1.shtml'
+        for race in crrr.fetch_races([url]):
+            self.assertEqual(len(race), 3)
+            crrr.process_race_sets(race)
+        crrr.finalize_output_file()
+        crrr.fetcher.close()
+
+        self.assertEqual(set(self.server.hits.values()), {1})
+        doc = etree.parse(output_file, etree.HTMLParser())
+        divs = doc.findall('.//div[@class="race"]')
+        self.assertEqual(len(divs), 1)
+        self.assertEqual(len(divs[0].findall('h1')), 1)
+        text = ''.join(divs[0].itertext())
+        self.assertIn('JOHN SMITH', text)
+        self.assertIn('JANE DOE', text)
+        self.assertNotIn('NOBODY ELSE', text)
+
+    def test_correction(self):
+        """
+        Verify that corrected results replace the stored results and the
+        rendered race, and that a race nobody is left in is dropped.
+        """
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\nDOE,JANE\n')
+        db = os.path.join(self.tempdir.name, 'results.sqlite')
+        links = ['Dec9_Jingle_set1.shtml', 'Dec9_Jingle_set2.shtml']
+        path = '/results/12/ma/Dec9_Jingle_set{0}.shtml'
+        self.server.routes.pop(path.format(3))
+
+        def run_once(set1, set2):
+            self.server.routes[path.format(1)] = crrr_page('Jingle 5K', set1,
+                                                          links)
+            self.server.routes[path.format(2)] = crrr_page('Jingle 5K', set2,
+                                                          links)
+            crrr = CoolRunning(verbose='critical', membership_list=membership,
+                               output_file=output_file)
+            crrr.fetcher = Fetcher()
+            crrr.ledger = Ledger(os.path.join(self.tempdir.name,
+                                              'ledger.sqlite'))
+            crrr.fragment_dir = os.path.join(self.tempdir.name, 'fragments')
+            crrr.sinks = [ResultsStore(db)]
+            crrr.initialize_output_file()
+            for race in crrr.fetch_races([self.base_url + path.format(1)]):
+                crrr.process_race_sets(race)
+            crrr.finalize_output_file()
+            crrr.fetcher.close()
+
+            store = ResultsStore(db)
+            lines = [row[0] for row in store.conn.execute(
+                'SELECT line FROM results ORDER BY line')]
+            store.close()
+            doc = etree.parse(output_file, etree.HTMLParser())
+            text = ''.join(''.join(div.itertext()) for div in
+                           doc.findall('.//div[@class="race"]'))
+            return lines, text
+
+        lines, text = run_once(['1  JOHN SMITH  18:01'],
+                               ['1  JANE DOE  28:45'])
+        self.assertEqual(lines, ['1  JANE DOE  28:45', '1  JOHN SMITH  18:01'])
+
+        # Jane Doe's time is corrected.
+        lines, text = run_once(['1  JOHN SMITH  18:01'],
+                               ['1  JANE DOE  28:40'])
+        self.assertEqual(lines, ['1  JANE DOE  28:40', '1  JOHN SMITH  18:01'])
+        self.assertIn('28:40', text)
+        self.assertNotIn('28:45', text)
+
+        # Both were listed by mistake.
+        lines, text = run_once(['1  NOBODY ELSE  35:00'],
+                               ['1  SOMEONE ELSE  36:00'])
+        self.assertEqual(lines, [])
+        self.assertEqual(text, '')
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,5 @@
 import datetime
+import json
 import os
 import pkg_resources
 import re
@@ -9,6 +10,12 @@ import unittest
 import warnings
 
 import rr
+from rr.cache import HttpCache
+from rr.csrr import CompuScore
+from rr.fetch import Fetcher
+from rr.test.server import ServerTestCase
+
+EVENTS = 60
 
 
 class TestCompuscore(unittest.TestCase):
@@ -185,3 +192,134 @@ class TestCompuscore(unittest.TestCase):
             html = f.read()
             regex = re.compile(r"""(<body>\s*</body> | <body/>)""", re.VERBOSE)
             self.assertRegex(html, regex)
+
+
+def result_files(host, event_id):
+    """
+    Every other event also has its results published as plain text.
+    """
+    webfile = {'domain': host, 'resource': '/r{0}.htm'.format(event_id),
+               'size': 5000}
+    entry = {'webfile': webfile}
+    if int(event_id) % 2 == 0:
+        entry['textfile'] = {'domain': host,
+                             'resource': '/r{0}.txt'.format(event_id),
+                             'size': 1000}
+    return [entry]
+
+
+def events(handler):
+    handler.send_body(json.dumps(
+        {'events': [{'id': j} for j in range(EVENTS)]}))
+
+
+def event_detail(handler):
+    host = handler.headers['Host']
+    ids = handler.query()['ids'][0].split(',')
+    handler.send_body(json.dumps({'events': [
+        {'id': int(event_id),
+         'name': 'Race {0}'.format(event_id),
+         'date': '2014-06-01T00:00:00',
+         'races': [{'name': '5K',
+                    'result_files': result_files(host, event_id)}]}
+        for event_id in ids]}))
+
+
+def result_file(handler):
+    if handler.path.endswith('.txt'):
+        handler.send_body('1  JOANNA STEVENS  22:18\n')
+    else:
+        handler.send_body('<h2>Race</h2>\n1  JOANNA STEVENS  22:18\n')
+
+
+class ListSink:
+    """
+    Keeps the matched results.
+    """
+    def __init__(self, records):
+        self.records = records
+
+    def write(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class TestCompuscoreApi(ServerTestCase):
+    """
+    Test looking up races with the Compuscore API.
+    """
+    def routes(self):
+        # The API and the result files it lists.
+        return {'/': result_file,
+                '/api/races/events': events,
+                '/api/races/event-detail': event_detail}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def run_once(self):
+        """
+        Returns the output file's contents.
+        """
+        cache = HttpCache(os.path.join(self.tempdir.name, 'cache'),
+                          immutable_after=datetime.timedelta(0))
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('STEVENS,JOANNA\n')
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        o = CompuScore(verbose='critical', membership_list=membership,
+                       output_file=output_file,
+                       start_date=datetime.date(2014, 6, 1),
+                       stop_date=datetime.date(2014, 6, 2),
+                       api_url=self.base_url + '/api/races',
+                       fetcher=Fetcher(cache=cache), jobs=4)
+        self.records = []
+        o.sinks = [ListSink(self.records)]
+        o.initialize_output_file()
+        o.compile_web_results()
+        o.finalize_output_file()
+        o.fetcher.close()
+        self.variant_stats = o.variant_stats
+        with open(output_file) as fptr:
+            return fptr.read()
+
+    def test_batches(self):
+        """
+        Verify that event details are asked for in batches and then cached
+        per event, and that the lightest result file is downloaded.
+        """
+        html = self.run_once()
+        self.assertEqual(html.count('JOANNA STEVENS'), EVENTS)
+        self.assertEqual(self.server.hits['/api/races/event-detail'], 3)
+        self.assertEqual(self.server.hits['/r7.htm'], 1)
+
+        # The plain text variant is preferred.
+        self.assertEqual(self.server.hits['/r6.txt'], 1)
+        self.assertEqual(self.server.hits['/r6.htm'], 0)
+        self.assertEqual(self.variant_stats.providers(),
+                         {'compuscore': (EVENTS, EVENTS // 2,
+                                         EVENTS // 2 * 4000)})
+
+        self.server.hits.clear()
+        self.run_once()
+        self.assertEqual(self.server.hits['/api/races/event-detail'], 0)
+
+    def test_text_variant(self):
+        """
+        Verify that races downloaded as plain text are named and dated from
+        the API.
+        """
+        html = self.run_once()
+        self.assertIn('<h2>Race 6 - 5K</h2>', html)
+        self.assertEqual(html.count('Race Date:  Jun 01, 2014'), EVENTS)
+        record = [record for record in self.records
+                  if record['url'].endswith('/r6.txt')][0]
+        self.assertEqual(record['race'], 'Race 6 - 5K')
+        self.assertEqual(record['date'], '2014-06-01')
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+import zlib
+
+from rr.aiofetch import AsyncFetcher
+from rr.fetch import Fetcher, FetchError
+from rr.test.server import ServerTestCase
+
+RESULTS = b'<pre>    1  MICHAEL CARR       35 M  22:18.9</pre>\n' * 200
+
+
+def deflated(handler):
+    """
+    Send the results compressed the way the path names.
+    """
+    encoding = handler.path[1:]
+    if encoding not in handler.headers.get('Accept-Encoding', ''):
+        handler.send_body(RESULTS)
+        return
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else -15
+    obj = zlib.compressobj(wbits=wbits)
+    body = obj.compress(RESULTS) + obj.flush()
+    handler.send_body(body, headers={'Content-Encoding': encoding})
+
+
+def race(handler):
+    handler.server.connections.add(handler.client_address)
+    handler.send_body('café'.encode('latin1'))
+
+
+class TestFetcher(ServerTestCase):
+    """
+    Test the shared HTTP layer against a local web server.
+    """
+    def routes(self):
+        login = {'Set-Cookie': 'session=abc123; Path=/; '
+                               'Expires=Wed, 01 Jan 2048 00:00:00 GMT'}
+        return {
+            '/': race,
+            '/login': lambda handler: handler.send_body(b'logged in',
+                                                        headers=login),
+            '/whoami': lambda handler: handler.send_body(
+                handler.headers.get('Cookie', '')),
+            '/missing': lambda handler: handler.send_body(b'nope',
+                                                          status=404),
+            '/gzip': deflated,
+            '/deflate': deflated,
+            '/search': lambda handler: handler.send_body(
+                handler.read_body()),
+        }
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.connections = set()
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_keep_alive(self):
+        """
+        Verify that consecutive requests reuse one connection.
+        """
+        fetcher = Fetcher()
+        for _ in range(3):
+            response = fetcher.fetch(self.base_url + '/race')
+        fetcher.close()
+        self.assertEqual(response.text, 'café')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_post(self):
+        """
+        Verify that form parameters are POSTed.
+        """
+        fetcher = Fetcher()
+        response = fetcher.fetch(self.base_url + '/search',
+                                 data={'team_code': 'RARI'})
+        fetcher.close()
+        self.assertEqual(response.text, 'team_code=RARI')
+
+    def test_compression(self):
+        """
+        Verify that compressed bodies are decoded and accounted for.
+        """
+        for fetcher in [Fetcher(), AsyncFetcher()]:
+            for encoding in ['gzip', 'deflate']:
+                response = fetcher.fetch(self.base_url + '/' + encoding)
+                self.assertEqual(response.content, RESULTS)
+            fetcher.close()
+
+            host = '127.0.0.1:{0}'.format(self.server.server_port)
+            count, wire, decoded = fetcher.stats.hosts()[host]
+            self.assertEqual(count, 2)
+            self.assertEqual(decoded, 2 * len(RESULTS))
+            self.assertLess(wire * 8, decoded)
+            self.assertIn(host, fetcher.stats.report()[0])
+
+    def test_error(self):
+        """
+        Verify that an HTTP error raises FetchError.
+        """
+        fetcher = Fetcher()
+        with self.assertRaises(FetchError) as context:
+            fetcher.fetch(self.base_url + '/missing')
+        fetcher.close()
+        self.assertEqual(context.exception.status, 404)
+
+    def test_cookie_file(self):
+        """
+        Verify that cookies persist from one run to the next.
+        """
+        cookie_file = os.path.join(self.tempdir.name, 'cookies.txt')
+        fetcher = Fetcher(cookie_file=cookie_file)
+        fetcher.fetch(self.base_url + '/login')
+        fetcher.close()
+
+        fetcher = Fetcher(cookie_file=cookie_file)
+        response = fetcher.fetch(self.base_url + '/whoami')
+        fetcher.close()
+        self.assertEqual(response.text, 'session=abc123')
+
+    def test_isolated(self):
+        """
+        Verify that an isolated fetcher keeps its cookies to itself but
+        shares the connections.
+        """
+        for cls in [Fetcher, AsyncFetcher]:
+            fetcher = cls()
+            other = fetcher.isolated()
+            other.fetch(self.base_url + '/login')
+            response = fetcher.fetch(self.base_url + '/whoami')
+            self.assertEqual(response.text, '')
+            response = other.fetch(self.base_url + '/whoami')
+            self.assertEqual(response.text, 'session=abc123')
+            other.close()
+            fetcher.fetch(self.base_url + '/whoami')
+            fetcher.close()
+            self.assertIs(other.stats, fetcher.stats)
+
+
+if __name__ == "__main__":
+    unittest.main()
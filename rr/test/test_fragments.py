@@ -0,0 +1,112 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+import pkg_resources
+from lxml import etree
+
+import rr
+from rr.fragments import FragmentStore
+
+
+class TestFragmentStore(unittest.TestCase):
+    """
+    Test rendering races into a fragment directory.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.fragment_dir = os.path.join(self.tempdir.name, 'fragments')
+        self.output_file = os.path.join(self.tempdir.name, 'results.html')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def race_div(self, title):
+        div = etree.Element('div')
+        div.set('class', 'race')
+        h1 = etree.SubElement(div, 'h1')
+        h1.text = title
+        return div
+
+    def assembled_titles(self):
+        tree = etree.parse(self.output_file, etree.HTMLParser())
+        return [h1.text for h1 in tree.getroot().findall('.//body/div/h1')]
+
+    def test_assembly_order(self):
+        """
+        Verify that fragments are assembled by date, then by provider,
+        regardless of the order in which they were rendered.
+        """
+        store = FragmentStore(self.fragment_dir)
+        store.put('coolrunning', datetime.date(2014, 3, 2),
+                  'http://a/2', self.race_div('CR March 2'))
+        store.put('bestrace', datetime.date(2014, 3, 2),
+                  'http://b/2', self.race_div('BR March 2'))
+        store.put('coolrunning', datetime.date(2014, 3, 1),
+                  'http://a/1', self.race_div('CR March 1'))
+        store.assemble(self.output_file)
+
+        self.assertEqual(self.assembled_titles(),
+                         ['CR March 1', 'BR March 2', 'CR March 2'])
+
+    def test_rerender_replaces(self):
+        """
+        Verify that re-rendering a race replaces its fragment.
+        """
+        store = FragmentStore(self.fragment_dir)
+        date = datetime.date(2014, 3, 1)
+        store.put('bestrace', date, 'http://b/1', self.race_div('Draft'))
+        store.put('bestrace', date, 'http://b/1', self.race_div('Corrected'))
+        store.assemble(self.output_file)
+
+        self.assertEqual(len(store.fragments()), 1)
+        self.assertEqual(self.assembled_titles(), ['Corrected'])
+
+    def test_discard(self):
+        """
+        Verify that a race's fragment is discarded whatever date it was
+        filed under, and that other races are left alone.
+        """
+        store = FragmentStore(self.fragment_dir)
+        store.put('bestrace', datetime.date(2014, 3, 1), 'http://b/1',
+                  self.race_div('Gone'))
+        store.put('bestrace', datetime.date(2014, 3, 1), 'http://b/2',
+                  self.race_div('Kept'))
+        store.put('coolrunning', datetime.date(2014, 3, 1), 'http://b/1',
+                  self.race_div('Other provider'))
+        store.discard('bestrace', 'http://b/1')
+        store.assemble(self.output_file)
+
+        self.assertEqual(self.assembled_titles(), ['Kept', 'Other provider'])
+
+    def test_racelist(self):
+        """
+        Verify that a run with a fragment directory produces the same races
+        in the output file.
+        """
+        race_file = pkg_resources.resource_filename(
+            rr.__name__, 'test/testdata/121202SB5.HTM')
+        racelist_file = os.path.join(self.tempdir.name, 'racelist.txt')
+        with open(racelist_file, 'w') as fptr:
+            fptr.write(race_file + '\n')
+        membership_file = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership_file, 'w') as fptr:
+            fptr.write('STRAWN,MARK\n')
+
+        sys.argv = ['',
+                    '--verbose', 'critical',
+                    '--ml', membership_file,
+                    '--rl', racelist_file,
+                    '--fragments', self.fragment_dir,
+                    '-o', self.output_file]
+        rr.command_line.run_bestrace()
+
+        self.assertEqual(len(os.listdir(self.fragment_dir)), 1)
+        with open(self.output_file) as fptr:
+            self.assertTrue('MARK STRAWN' in fptr.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
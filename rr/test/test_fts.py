@@ -0,0 +1,69 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import pkg_resources
+
+import rr
+from rr.fts import DocumentIndex, result_lines
+
+
+class TestDocumentIndex(unittest.TestCase):
+    """
+    Test the full-text index of race documents.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'index.db')
+
+        relfile = 'test/testdata/121202SB5.HTM'
+        filename = pkg_resources.resource_filename(rr.__name__, relfile)
+        with open(filename, 'rt') as fptr:
+            self.html = fptr.read()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_search(self):
+        """
+        Verify that anyone in an indexed race can be found, with a link back
+        to the race.
+        """
+        url = 'http://www.bestrace.com/results/12/121202SB5.HTM'
+        index = DocumentIndex(self.path)
+        self.assertTrue(index.add(url, result_lines(self.html),
+                                  provider='bestrace', title='Vikings 5K',
+                                  date=datetime.date(2012, 12, 2)))
+
+        hits = index.search('strawn mark')
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(hits[0][0], url)
+        self.assertEqual(hits[0][2], '2012-12-02')
+        self.assertTrue('MARK STRAWN' in hits[0][3])
+
+        self.assertEqual(index.search('strawn mark', phrase=True), [])
+        self.assertEqual(len(index.search('mark strawn', phrase=True)), 1)
+
+        for text in ['', ' \t']:
+            with self.assertRaises(ValueError):
+                index.search(text)
+        index.close()
+
+    def test_incremental(self):
+        """
+        Verify that a document is only re-indexed when it changes.
+        """
+        url = 'http://www.coolrunning.com/results/14/ma/Jun14_Flag_set1.shtml'
+        index = DocumentIndex(self.path)
+        self.assertTrue(index.add(url, ['1 JOHN BANNER 16:40']))
+        self.assertFalse(index.add(url, ['1 JOHN BANNER 16:40']))
+        self.assertTrue(index.add(url, ['1 JOHN BANNER 16:41']))
+
+        hits = index.search('banner')
+        self.assertEqual([hit[3] for hit in hits], ['1 JOHN BANNER 16:41'])
+        index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
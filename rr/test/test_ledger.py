@@ -0,0 +1,159 @@
+import os
+import tempfile
+import unittest
+
+from rr.common import RaceResults
+from rr.fetch import Fetcher
+from rr.ledger import Ledger
+from rr.store import ResultsStore
+from rr.test.server import ServerTestCase
+
+
+class CountingResults(RaceResults):
+    """
+    Counts the lines matched against the membership list.
+    """
+    provider = 'example'
+
+    def __init__(self, *args, **kwargs):
+        RaceResults.__init__(self, *args, **kwargs)
+        self.compared = []
+
+    def match_against_membership(self, line):
+        self.compared.append(line)
+        return RaceResults.match_against_membership(self, line)
+
+
+class TestLedger(ServerTestCase):
+    """
+    Test skipping races that were already processed.
+    """
+    def routes(self):
+        return {'/a.htm': b'1  JOHN SMITH  22:18',
+                '/b.htm': b'1  JANE DOE  23:45'}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'ledger.sqlite')
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_ledger(self):
+        """
+        Verify that only unchanged documents and matchers are skipped.
+        """
+        ledger = Ledger(self.path)
+        self.assertFalse(ledger.unchanged('a', 'digest', 'matcher'))
+        ledger.record('a', 'digest', 'matcher', True)
+        self.assertTrue(ledger.unchanged('a', 'digest', 'matcher'))
+        self.assertFalse(ledger.unchanged('a', 'digest2', 'matcher'))
+        self.assertFalse(ledger.unchanged('a', 'digest', 'matcher2'))
+        self.assertEqual(ledger.get('a'), ('digest', 'matcher', True))
+        ledger.close()
+
+    def run_once(self, force=False, members=(('SMITH', 'JOHN'),),
+                 output_file=None):
+        """
+        Returns the URLs that were processed.
+        """
+        rr = RaceResults(verbose='critical', output_file=output_file)
+        rr.members = list(members)
+        rr.fetcher = Fetcher()
+        rr.ledger = Ledger(self.path)
+        rr.force = force
+        if output_file is not None:
+            rr.initialize_output_file()
+        urls = [self.base_url + '/a.htm', self.base_url + '/b.htm']
+        processed = [url for url, _ in rr.fetch_all(urls)]
+        if output_file is not None:
+            rr.finalize_output_file()
+        else:
+            rr.ledger.close()
+        rr.fetcher.close()
+        return processed
+
+    def test_skip(self):
+        """
+        Verify that a re-run only processes new or changed races.
+        """
+        self.assertEqual(len(self.run_once()), 2)
+        self.assertEqual(self.run_once(), [])
+        self.assertEqual(len(self.run_once(force=True)), 2)
+
+        self.server.routes['/b.htm'] = b'1  JANE DOE  23:44'
+        self.assertEqual(self.run_once(), [self.base_url + '/b.htm'])
+
+        members = [('SMITH', 'JOHN'), ('DOE', 'JANE')]
+        self.assertEqual(len(self.run_once(members=members)), 2)
+
+    def test_output_file(self):
+        """
+        Verify that races are not skipped when written straight to an
+        output file, which would then be missing them.
+        """
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        self.assertEqual(len(self.run_once(output_file=output_file)), 2)
+        self.assertEqual(len(self.run_once(output_file=output_file)), 2)
+        self.assertEqual(self.run_once(), [])
+
+    def test_correction(self):
+        """
+        Verify that only the changed lines of re-posted results are matched
+        again, that the correction is reported, and that the results store
+        keeps only the corrected results.
+        """
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\nDOE,JANE\n')
+        lines = ['{0}  RUNNER NUMBER{0}  22:{0:02d}'.format(j)
+                 for j in range(20)]
+        lines[5] = '5  JOHN SMITH  22:05'
+        lines[9] = '9  JANE DOE  22:09'
+        self.server.routes['/a.htm'] = '\n'.join(lines).encode()
+
+        def run_once():
+            rr = CountingResults(verbose='critical',
+                                 membership_list=membership)
+            rr.fetcher = Fetcher()
+            rr.ledger = Ledger(self.path)
+            rr.sinks = [ResultsStore(store_path)]
+            for url, response in rr.fetch_all([self.base_url + '/a.htm']):
+                rr.downloaded_url = url
+                for line in response.text.split('\n'):
+                    if rr.line_matches(line):
+                        rr.add_match(line)
+                        rr.matched_urls.add(url)
+                rr.write_records('Race')
+            rr.ledger.close()
+            rr.sinks[0].close()
+            rr.fetcher.close()
+            return rr
+
+        def stored_lines():
+            store = ResultsStore(store_path)
+            rows = store.conn.execute('SELECT line FROM results '
+                                      'ORDER BY line').fetchall()
+            store.close()
+            return [row[0] for row in rows]
+
+        store_path = os.path.join(self.tempdir.name, 'results.sqlite')
+
+        rr = run_once()
+        self.assertEqual(len(rr.compared), 20)
+
+        # Jane Doe's time is corrected.
+        lines[9] = '9  JANE DOE  22:10'
+        self.server.routes['/a.htm'] = '\n'.join(lines).encode()
+        rr = run_once()
+        self.assertEqual(rr.compared, ['9  JANE DOE  22:10'])
+        self.assertEqual(stored_lines(),
+                         ['5  JOHN SMITH  22:05', '9  JANE DOE  22:10'])
+        self.assertEqual(rr.corrections,
+                         [(self.base_url + '/a.htm', 1, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
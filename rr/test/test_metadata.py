@@ -0,0 +1,129 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from rr.crrr import CoolRunning
+from rr.csrr import CompuScore
+from rr.metadata import MetadataCache, RaceMetadata
+from rr.test.server import WebServer
+
+
+RACE = """<html><head><title>{0}</title></head><body>
+<h2>{0}</h2>
+<h3>Race Date:{1}</h3>
+<pre>
+1  JOHN SMITH  22:18
+</pre>
+</body></html>"""
+
+
+def event_detail(handler):
+    host = handler.headers['Host']
+    handler.send_body(json.dumps({'events': [
+        {'id': event_id, 'name': name, 'date': '2012-11-03',
+         'races': [{'name': '5K', 'result_files': [
+             {'webfile': {'domain': host,
+                          'resource': '/{0}.htm'.format(name)}}]}]}
+        for event_id, name in [(1, 'inside'), (2, 'outside')]]}))
+
+
+class TestMetadata(unittest.TestCase):
+    """
+    Test deciding whether to download a race from what is already known.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'metadata.sqlite')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_cache(self):
+        """
+        Verify that what is learned about a race later fills in what was
+        learned earlier.
+        """
+        cache = MetadataCache(self.path)
+        url = 'http://example.com/race.txt'
+        self.assertIsNone(cache.get(url))
+        cache.put(url, RaceMetadata(datetime.datetime(2013, 1, 5), None,
+                                    None, 'txt'))
+        cache.put(url, RaceMetadata(None, 'Race', 'sri', None))
+        cache.close()
+
+        cache = MetadataCache(self.path)
+        self.assertEqual(cache.get(url),
+                         RaceMetadata(datetime.date(2013, 1, 5), 'Race',
+                                      'sri', 'txt'))
+        cache.close()
+
+    def test_author(self):
+        """
+        Verify that a race posted by someone whose results are not parsed
+        is skipped once its author is known.
+        """
+        crrr = CoolRunning(verbose='critical')
+        url = 'http://www.coolrunning.com/results/13/ma/Jan5_Series_set1.shtml'
+        self.assertFalse(crrr.author_skipped(url))
+        crrr.metadata_cache = MetadataCache(self.path)
+        self.assertFalse(crrr.author_skipped(url))
+        crrr.remember_metadata(url, author='ACCU')
+        self.assertFalse(crrr.author_skipped(url))
+        crrr.remember_metadata(url, author='colonial')
+        self.assertTrue(crrr.author_skipped(url))
+        self.assertEqual(crrr.race_metadata(url).format, 'html')
+        crrr.metadata_cache.close()
+
+    def test_compuscore(self):
+        """
+        Verify that a race found to be outside the date range is only
+        downloaded once.
+        """
+        # Stand-in for the CompuScore API and result files.
+        server = WebServer({
+            '/api/races/events': json.dumps({'events': [{'id': 1},
+                                                        {'id': 2}]}),
+            '/api/races/event-detail': event_detail,
+            '/inside.htm': RACE.format('Inside', '11-03-12'),
+            '/outside.htm': RACE.format('Outside', '12-15-12'),
+        }).start()
+        base_url = server.base_url
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\n')
+        try:
+            def run_once():
+                csrr = CompuScore(verbose='critical',
+                                  membership_list=membership,
+                                  output_file=os.path.join(self.tempdir.name,
+                                                           'results.html'),
+                                  start_date=datetime.date(2012, 11, 1),
+                                  stop_date=datetime.date(2012, 11, 30),
+                                  api_url=base_url + '/api/races')
+                csrr.metadata_cache = MetadataCache(self.path)
+                server.requests.clear()
+                csrr.run()
+                return server.requests
+
+            requests = run_once()
+            self.assertIn('/inside.htm', requests)
+            self.assertIn('/outside.htm', requests)
+
+            cache = MetadataCache(self.path)
+            metadata = cache.get(base_url + '/outside.htm')
+            self.assertEqual(metadata.date, datetime.date(2012, 12, 15))
+            self.assertEqual(metadata.title, 'outside - 5K')
+            self.assertEqual(metadata.format, 'html')
+            cache.close()
+
+            requests = run_once()
+            self.assertIn('/inside.htm', requests)
+            self.assertNotIn('/outside.htm', requests)
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,62 @@
+import concurrent.futures
 import datetime
+import http.cookies
 import os
 import sys
 import tempfile
+import time
 import unittest
+import urllib.parse
+
+from lxml import etree
 
 import rr
+from rr.fetch import Fetcher
+from rr.nyrr import ARCHIVE_URL, NewYorkRR
+from rr.schedule import ScheduleEntry, ScheduleIndex, schedule_key
+from rr.test.server import ServerTestCase
+
+TEAMS = {'RARI': 'JOHN SMITH', 'GSRT': 'JANE DOE'}
+
+
+def team_results(event, team):
+    """
+    Minimal NYRR team search results page.
+    """
+    return ('<html><head><title>Event {0}</title></head><body>'
+            '<table><tr><td>nav</td></tr></table>'
+            '<table><tr><td></td><td></td><td><span>Event {0}</span>'
+            '<span>Team {1}</span><span>5K, Central Park</span></td></tr>'
+            '</table><table><tr><td></td></tr></table>'
+            '<table><tr><td>Place</td><td><a>Last</a></td><td><a>First</a>'
+            '</td><td>Time</td></tr><tr><td>1</td><td>{2}</td><td>{3}</td>'
+            '<td>22:18</td></tr></table></body></html>'
+            ).format(event, team, *TEAMS[team].split()[::-1]).encode()
+
+
+def event_form(handler):
+    """
+    The search form of an event, which keeps the event being searched in a
+    cookie.
+    """
+    event = handler.path.split('/')[-1]
+    action = 'http://{0}/search/{1}'.format(handler.headers['Host'], event)
+    body = '<html><form method=post action={0}></form></html>'
+    handler.send_body(body.format(action),
+                      headers={'Set-Cookie': 'event={0}; Path=/'.format(
+                               event)})
+
+
+def team_search(handler):
+    form = urllib.parse.parse_qs(handler.read_body().decode())
+    # Give other searches a chance to get in between.
+    time.sleep(0.05)
+    event = handler.path.split('/')[-1]
+    cookies = http.cookies.SimpleCookie(handler.headers.get('Cookie', ''))
+    if 'event' not in cookies or cookies['event'].value != event:
+        handler.send_body(b'Your search returns no match.')
+        return
+    handler.send_body(team_results(event, form['team_code'][0]))
 
 
 class TestNYRR(unittest.TestCase):
@@ -36,5 +88,106 @@ class TestNYRR(unittest.TestCase):
             self.assertTrue("Ron" in html)
 
 
+    def test_race_links(self):
+        """
+        Verify that the races are picked out of the race list page.
+        """
+        o = NewYorkRR(verbose='critical')
+        url = o.result_url_base + '?result.id={0}&result.year=2012'
+        html = ('<html><body><form name="x" method=post action=y>'
+                '<table><tr><td><a href="{0}">\n  Jingle Bell Jog\n</a>'
+                ' 12/09/12</td></tr><tr><td><a href="{1}">Ted Corbitt 15K'
+                '</a> 12/15/12</td></tr><tr><td><a href="/elsewhere">'
+                'Elsewhere</a> 12/16/12</td></tr></table></form>'
+                '</body></html>').format(url.format('b21209'),
+                                         url.format('b21215'))
+        self.assertEqual(o.race_links(html),
+                         [(url.format('b21209'), 'Jingle Bell Jog',
+                           datetime.date(2012, 12, 9)),
+                          (url.format('b21215'), 'Ted Corbitt 15K',
+                           datetime.date(2012, 12, 15))])
+
+
+class TestNYRRSearch(ServerTestCase):
+    """
+    Test searching NYRR events for several teams at once.
+    """
+    def routes(self):
+        return {'/event/': event_form, '/search/': team_search}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        self.tempdir.cleanup()
+
+    def test_teams(self):
+        """
+        Verify that concurrent searches keep their cookies apart and that
+        the teams at an event share a section.
+        """
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\nDOE,JANE\n')
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        o = NewYorkRR(verbose='critical', membership_list=membership,
+                      output_file=output_file, team=['RARI', 'GSRT'],
+                      fetcher=Fetcher())
+        o.initialize_output_file()
+        urls = ['{0}/event/{1}'.format(self.base_url, j) for j in range(4)]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            searches = list(executor.map(o.search_event, urls))
+        for url, event_searches in zip(urls, searches):
+            o.process_event(url, event_searches)
+        o.finalize_output_file()
+        o.fetcher.close()
+
+        doc = etree.parse(output_file, etree.HTMLParser())
+        divs = doc.findall('.//div[@class="race"]')
+        self.assertEqual(len(divs), 4)
+        for div in divs:
+            self.assertEqual([h2.text for h2 in div.findall('h2')],
+                             ['Team RARI', 'Team GSRT'])
+            text = ''.join(div.itertext())
+            self.assertIn('SMITH', text)
+            self.assertIn('DOE', text)
+
+    def test_new_only(self):
+        """
+        Verify that a run only searches the events posted since the last
+        one.
+        """
+        membership = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership, 'w') as fptr:
+            fptr.write('SMITH,JOHN\n')
+        output_file = os.path.join(self.tempdir.name, 'results.html')
+        path = os.path.join(self.tempdir.name, 'schedule.sqlite')
+        key = schedule_key(ARCHIVE_URL, {'NYRRYEAR': '2012'})
+        entries = [ScheduleEntry(datetime.date(2012, 12, 9), 'Event 0',
+                                 '{0}/event/0'.format(self.base_url), None)]
+
+        def run_once():
+            index = ScheduleIndex(path)
+            index.put('nyrr', key, entries)
+            o = NewYorkRR(verbose='critical', membership_list=membership,
+                          output_file=output_file, fetcher=Fetcher(),
+                          start_date=datetime.date(2012, 12, 1),
+                          stop_date=datetime.date(2012, 12, 31),
+                          schedule_index=index, new_only=True)
+            o.run()
+            doc = etree.parse(output_file, etree.HTMLParser())
+            return len(doc.findall('.//div[@class="race"]'))
+
+        self.assertEqual(run_once(), 1)
+        self.assertEqual(run_once(), 0)
+        time.sleep(0.01)
+        entries.append(ScheduleEntry(datetime.date(2012, 12, 15), 'Event 1',
+                                     '{0}/event/1'.format(self.base_url),
+                                     None))
+        self.assertEqual(run_once(), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
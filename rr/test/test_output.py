@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+from lxml import etree
+
+from rr.common import RaceResults
+from rr.output import HtmlWriter, _UMASK
+
+
+class TestHtmlWriter(unittest.TestCase):
+    """
+    Test streaming race results into the output file.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.tempdir.name, 'results.html')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def race_div(self, title):
+        div = etree.Element('div')
+        div.set('class', 'race')
+        h1 = etree.SubElement(div, 'h1')
+        h1.text = title
+        return div
+
+    def test_output_only_appears_when_closed(self):
+        """
+        Verify that the output file is moved into place by close.
+        """
+        writer = HtmlWriter(self.output_file)
+        writer.write(self.race_div('Race 1'))
+        self.assertFalse(os.path.exists(self.output_file))
+        writer.close()
+        self.assertTrue(os.path.exists(self.output_file))
+        self.assertEqual(os.listdir(self.tempdir.name), ['results.html'])
+
+    def test_mode(self):
+        """
+        Verify that the output file is not left private to the owner.
+        """
+        HtmlWriter(self.output_file).close()
+        mode = os.stat(self.output_file).st_mode & 0o777
+        self.assertEqual(mode, 0o666 & ~_UMASK)
+
+    def test_races_in_order(self):
+        """
+        Verify that races are appended inside the body in order.
+        """
+        with HtmlWriter(self.output_file) as writer:
+            writer.write(self.race_div('Race 1'))
+            writer.write(self.race_div('Race 2'))
+
+        tree = etree.parse(self.output_file, etree.HTMLParser())
+        h1s = tree.getroot().findall('.//body/div/h1')
+        self.assertEqual([h1.text for h1 in h1s], ['Race 1', 'Race 2'])
+
+        with open(self.output_file) as fptr:
+            html = fptr.read()
+        self.assertEqual(html.find('\n\n'), -1)
+
+    def test_empty_body(self):
+        """
+        Verify that no races yields an empty body.
+        """
+        HtmlWriter(self.output_file).close()
+        with open(self.output_file) as fptr:
+            html = fptr.read()
+        self.assertRegex(html, r'<body>\s*</body>')
+
+    def test_abort(self):
+        """
+        Verify that aborting leaves an existing output file alone.
+        """
+        with open(self.output_file, 'w') as fptr:
+            fptr.write('previous run')
+        writer = HtmlWriter(self.output_file)
+        writer.write(self.race_div('Race 1'))
+        writer.abort()
+        with open(self.output_file) as fptr:
+            self.assertEqual(fptr.read(), 'previous run')
+        self.assertEqual(os.listdir(self.tempdir.name), ['results.html'])
+
+    def test_exception(self):
+        """
+        Verify that a run failing part way leaves the previous output file
+        alone.
+        """
+        with open(self.output_file, 'w') as fptr:
+            fptr.write('previous run')
+        with self.assertRaises(RuntimeError):
+            with HtmlWriter(self.output_file) as writer:
+                writer.write(self.race_div('Race 1'))
+                raise RuntimeError('Could not parse the race')
+        with open(self.output_file) as fptr:
+            self.assertEqual(fptr.read(), 'previous run')
+
+        def crash():
+            rr.insert_race_results(self.race_div('Race 1'))
+            raise RuntimeError('Could not parse the race')
+
+        rr = RaceResults(verbose='critical', output_file=self.output_file)
+        rr.compile_web_results = crash
+        with self.assertRaises(RuntimeError):
+            rr.run()
+        with open(self.output_file) as fptr:
+            self.assertEqual(fptr.read(), 'previous run')
+        self.assertEqual(os.listdir(self.tempdir.name), ['results.html'])
+
+
+if __name__ == "__main__":
+    unittest.main()
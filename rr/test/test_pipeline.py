@@ -0,0 +1,89 @@
+import threading
+import time
+import unittest
+
+from rr.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Test stages connected by bounded queues.
+    """
+    def test_order(self):
+        """
+        Verify that one worker per stage keeps items in order.
+        """
+        pipeline = Pipeline(range(50), queue_size=2)
+        pipeline.add_stage('double', lambda x: 2 * x)
+        pipeline.add_stage('odd', lambda x: None if x % 4 == 0 else x)
+        self.assertEqual(list(pipeline), [x for x in range(2, 100, 4)])
+        self.assertEqual(pipeline.stats['double'].items, 50)
+        self.assertEqual(pipeline.stats['odd'].items, 50)
+        self.assertEqual(pipeline.stats['process'].items, 25)
+
+    def test_workers(self):
+        """
+        Verify that a stage with several workers overlaps its items.
+        """
+        def slow(x):
+            time.sleep(0.1)
+            return x
+
+        pipeline = Pipeline(range(8))
+        pipeline.add_stage('fetch', slow, workers=8)
+        t0 = time.monotonic()
+        self.assertEqual(sorted(pipeline), list(range(8)))
+        self.assertLess(time.monotonic() - t0, 0.5)
+
+    def test_backpressure(self):
+        """
+        Verify that a slow consumer holds back the earlier stages.
+        """
+        started = []
+        lock = threading.Lock()
+
+        def fetch(x):
+            with lock:
+                started.append(x)
+            return x
+
+        pipeline = Pipeline(range(100), queue_size=2)
+        pipeline.add_stage('fetch', fetch)
+        for x in pipeline:
+            if x == 0:
+                time.sleep(0.3)
+                # Only a couple of queues' worth have gone ahead.
+                self.assertLessEqual(len(started), 6)
+        self.assertEqual(len(started), 100)
+        self.assertGreater(pipeline.stats['fetch'].blocked, 0.1)
+        self.assertLessEqual(pipeline.stats['process'].max_depth, 2)
+        self.assertIn('fetch: 100 items', pipeline.stats['fetch'].report())
+
+    def test_error(self):
+        """
+        Verify that an error in a stage reaches the caller.
+        """
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        pipeline = Pipeline(range(10))
+        pipeline.add_stage('parse', fail, workers=2)
+        with self.assertRaises(ValueError):
+            list(pipeline)
+
+    def test_early_exit(self):
+        """
+        Verify that the caller may stop early.
+        """
+        before = threading.active_count()
+        pipeline = Pipeline(iter(range(1000)), queue_size=2)
+        pipeline.add_stage('fetch', lambda x: x, workers=3)
+        for x in pipeline:
+            break
+        self.assertEqual(threading.active_count(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
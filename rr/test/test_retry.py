@@ -0,0 +1,106 @@
+import unittest
+
+from rr.aiofetch import AsyncFetcher
+from rr.fetch import Fetcher, FetchError
+from rr.retry import RetryPolicy
+from rr.test.server import ServerTestCase
+
+RESULTS = b''.join(b'%5d  RUNNER %05d  22:18\n' % (j, j) for j in range(2000))
+
+
+def flaky(handler):
+    if handler.server.hits[handler.path] < 3:
+        handler.send_error(503)
+    else:
+        handler.send_body(b'ok')
+
+
+def dropped(handler):
+    """
+    Send half the body the first time, then honor Range requests.
+    """
+    handler.server.ranges.append(handler.headers.get('Range'))
+    start = 0
+    if handler.headers.get('Range') is not None:
+        start = int(handler.headers['Range'][6:-1])
+        handler.send_response(206)
+        handler.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+            start, len(RESULTS) - 1, len(RESULTS)))
+    else:
+        handler.send_response(200)
+    handler.send_header('Accept-Ranges', 'bytes')
+    handler.send_header('ETag', '"results-v1"')
+    handler.send_header('Content-Length', str(len(RESULTS) - start))
+    handler.end_headers()
+    if start == 0:
+        handler.wfile.write(RESULTS[:len(RESULTS) // 2])
+        handler.close_connection = True
+    else:
+        handler.wfile.write(RESULTS[start:])
+
+
+class TestRetry(ServerTestCase):
+    """
+    Test retries and resumed downloads against a local web server that
+    stands in for an unreliable web site.
+    """
+    def routes(self):
+        return {
+            '/': b'ok',
+            '/flaky': flaky,
+            '/down': lambda handler: handler.send_error(503),
+            '/missing': lambda handler: handler.send_error(404),
+            '/dropped': dropped,
+        }
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.ranges = []
+
+    def test_transient(self):
+        """
+        Verify that transient errors are retried and others are not.
+        """
+        for cls in [Fetcher, AsyncFetcher]:
+            self.server.hits.clear()
+            fetcher = cls(retry=RetryPolicy(base_delay=0.01))
+            response = fetcher.fetch(self.base_url + '/flaky')
+            self.assertEqual(response.text, 'ok')
+            self.assertEqual(self.server.hits['/flaky'], 3)
+
+            with self.assertRaises(FetchError):
+                fetcher.fetch(self.base_url + '/missing')
+            self.assertEqual(self.server.hits['/missing'], 1)
+            fetcher.close()
+
+    def test_budget(self):
+        """
+        Verify that retries stop once the run's budget is spent.
+        """
+        fetcher = Fetcher(retry=RetryPolicy(attempts=5, base_delay=0.01,
+                                            budget=3))
+        for _ in range(2):
+            with self.assertRaises(FetchError):
+                fetcher.fetch(self.base_url + '/down')
+        fetcher.close()
+        self.assertEqual(self.server.hits['/down'], 5)
+        self.assertEqual(fetcher.retry.retries, 3)
+
+    def test_resume(self):
+        """
+        Verify that a dropped transfer is resumed where it stopped.
+        """
+        for cls in [Fetcher, AsyncFetcher]:
+            self.server.ranges = []
+            fetcher = cls(retry=RetryPolicy(base_delay=0.01))
+            url = '{0}/dropped-{1}'.format(self.base_url, cls.__name__)
+            response = fetcher.fetch(url)
+            fetcher.close()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.content, RESULTS)
+            expected = [None, 'bytes={0}-'.format(len(RESULTS) // 2)]
+            self.assertEqual(self.server.ranges, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
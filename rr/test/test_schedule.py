@@ -0,0 +1,202 @@
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from rr.brrr import BestRace
+from rr.crrr import CoolRunning
+from rr.fetch import Fetcher, FetchError
+from rr.schedule import Schedule, ScheduleEntry, ScheduleIndex, schedule_key
+from rr.test.server import WebServer
+
+
+def entry(year, month, day, name):
+    return ScheduleEntry(datetime.date(year, month, day), name,
+                         'http://example.com/{0}.htm'.format(name), None)
+
+
+class TestSchedule(unittest.TestCase):
+    """
+    Test the index of the races listed on master pages.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, 'schedule.sqlite')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_between(self):
+        """
+        Verify that a date range spanning months takes the races on both of
+        its end dates.
+        """
+        schedule = Schedule([entry(2013, 2, 2, 'c'), entry(2013, 1, 31, 'b'),
+                             entry(2013, 1, 5, 'a'), entry(2013, 2, 3, 'd')])
+        races = schedule.between(datetime.datetime(2013, 1, 31),
+                                 datetime.datetime(2013, 2, 2))
+        self.assertEqual([race.name for race in races], ['b', 'c'])
+        self.assertEqual(schedule.between(datetime.date(2013, 3, 1),
+                                          datetime.date(2013, 3, 31)), [])
+
+    def test_index(self):
+        """
+        Verify that a parsed master page is kept until it is stale.
+        """
+        key = schedule_key('http://example.com/archive',
+                           {'YEAR': '2013', 'LIST': 'YEAR'})
+        self.assertEqual(key, 'http://example.com/archive#LIST=YEAR&YEAR=2013')
+
+        index = ScheduleIndex(self.path)
+        self.assertIsNone(index.get('example', key))
+        entries = [entry(2013, 1, 5, 'a'),
+                   ScheduleEntry(datetime.date(2013, 1, 6), None,
+                                 'http://example.com/b.htm', 'ma')]
+        index.put('example', key, entries)
+        self.assertEqual(index.get('example', key).entries, entries)
+        self.assertIsNone(index.get('other', key))
+        index.put('example', key, entries[:1])
+        self.assertEqual(index.get('example', key).entries, entries[:1])
+        index.close()
+
+        index = ScheduleIndex(self.path, ttl=datetime.timedelta(seconds=0.1))
+        time.sleep(0.2)
+        self.assertIsNone(index.get('example', key))
+        self.assertEqual(len(index.get('example', key, stale=True)), 1)
+        index.close()
+
+    def test_diff(self):
+        """
+        Verify that a new version of a master page tells when each race was
+        first listed, and that races handed on are remembered.
+        """
+        index = ScheduleIndex(self.path)
+        key = 'http://example.com/2013schedule.html'
+        old = [entry(2013, 1, 5, 'a'), entry(2013, 1, 12, 'b')]
+        index.put('example', key, old)
+        time.sleep(0.01)
+        new = entry(2013, 1, 6, 'c')
+        index.put('example', key, old + [new])
+        schedule = index.get('example', key)
+        self.assertEqual(schedule.first_seen[old[0].url],
+                         schedule.first_seen[old[1].url])
+        self.assertGreater(schedule.first_seen[new.url],
+                           schedule.first_seen[old[0].url])
+
+        self.assertEqual(index.handed_on('example'), {})
+        index.hand_on('example', [old[0].url], when=1)
+        index.hand_on('example', [old[0].url, new.url], when=2)
+        self.assertEqual(index.handed_on('example'),
+                         {old[0].url: 1, new.url: 2})
+        self.assertEqual(index.handed_on('other'), {})
+        index.close()
+
+    def test_handed_on_held(self):
+        """
+        Verify that races are not recorded as handed on if any race could
+        not be downloaded, so that they are tried again.
+        """
+        brrr = BestRace(verbose='critical',
+                        start_date=datetime.date(2013, 1, 1),
+                        stop_date=datetime.date(2013, 1, 31))
+        brrr.schedule_index = ScheduleIndex(self.path)
+        brrr.races_between(Schedule([entry(2013, 1, 5, 'a')]))
+        brrr.fetch_failed(FetchError('http://example.com/a.htm',
+                                     reason='timed out'))
+        brrr.record_handed_on()
+        self.assertEqual(brrr.schedule_index.handed_on('bestrace'), {})
+
+        brrr.fetch_failures = 0
+        brrr.record_handed_on()
+        self.assertEqual(list(brrr.schedule_index.handed_on('bestrace')),
+                         ['http://example.com/a.htm'])
+        brrr.schedule_index.close()
+
+    def test_coolrunning(self):
+        """
+        Verify that a state's master file lists the first set of each race.
+        """
+        html = ('<a href="/results/13/ma/Jan31_Colder_set1.shtml">Colder</a>'
+                '<a href="/results/13/ma/Feb2_Groundh_set1.shtml">Ground</a>'
+                '<a href="/results/13/ma/Feb2_Groundh_set1.shtml">Again</a>'
+                '<a href="/results/13/ma.shtml">Massachusetts</a>')
+        crrr = CoolRunning(verbose='critical')
+        entries = crrr.parse_state_master_file(
+            'http://www.coolrunning.com/results/13/ma.shtml', html)
+        self.assertEqual(
+            entries,
+            [ScheduleEntry(datetime.date(2013, 1, 31), None,
+                           'http://www.coolrunning.com'
+                           '/results/13/ma/Jan31_Colder_set1.shtml', 'ma'),
+             ScheduleEntry(datetime.date(2013, 2, 2), None,
+                           'http://www.coolrunning.com'
+                           '/results/13/ma/Feb2_Groundh_set1.shtml', 'ma')])
+        self.assertEqual(crrr.state_master_url('ma', 2009),
+                         'http://www.coolrunning.com/results/09/ma.shtml')
+
+    def test_master_schedules(self):
+        """
+        Verify that a master page is downloaded once until it is stale, that
+        a date range spanning years uses the master page of each year, and
+        that only the races no earlier run fetched can be asked for, even if
+        an earlier run covered other dates.
+        """
+        # Stand-in for the master pages.
+        server = WebServer({
+            '/2012schedule.html':
+                b'<a href="results/12/121230RUN.HTM">Last Run</a>'
+                b'<a href="results/12/121202SB5.HTM">Too Early</a>',
+            '/2013schedule.html':
+                b'<a href="results/13/130101FIRST.HTM"> First\n Run </a>',
+        }).start()
+        base_url = server.base_url
+        try:
+            def run_once(new_only=False,
+                         start_date=datetime.datetime(2012, 12, 29)):
+                brrr = BestRace(verbose='critical', start_date=start_date,
+                                stop_date=datetime.datetime(2013, 1, 2),
+                                new_only=new_only)
+                brrr.fetcher = Fetcher()
+                ttl = datetime.timedelta(0 if new_only else 1)
+                brrr.schedule_index = ScheduleIndex(self.path, ttl=ttl)
+                urls = ['{0}/{1}schedule.html'.format(base_url, year)
+                        for year in brrr.search_years()]
+                schedules = brrr.master_schedules(urls,
+                                                  brrr.parse_master_file)
+                races = [race for url in urls
+                         for race in brrr.races_between(schedules[url])]
+                brrr.record_handed_on()
+                brrr.schedule_index.close()
+                brrr.fetcher.close()
+                return races
+
+            races = run_once()
+            self.assertEqual([race.name for race in races],
+                             ['Last Run', 'First Run'])
+            self.assertEqual(races[1].url,
+                             base_url + '/results/13/130101FIRST.HTM')
+            self.assertEqual(races[1].date, datetime.date(2013, 1, 1))
+            self.assertEqual(len(server.requests), 2)
+
+            self.assertEqual(run_once(), races)
+            self.assertEqual(len(server.requests), 2)
+
+            # A race is posted after a run that only wants new races.
+            server.routes['/2013schedule.html'] += (
+                b'<a href="results/13/130102SECOND.HTM">Second Run</a>')
+            races = run_once(new_only=True)
+            self.assertEqual([race.name for race in races], ['Second Run'])
+            self.assertEqual(len(server.requests), 4)
+
+            # A race listed before the last run but outside its dates.
+            races = run_once(new_only=True,
+                             start_date=datetime.datetime(2012, 12, 1))
+            self.assertEqual([race.name for race in races], ['Too Early'])
+            self.assertEqual(run_once(new_only=True), [])
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
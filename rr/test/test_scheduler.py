@@ -0,0 +1,84 @@
+import time
+import unittest
+
+from rr.fetch import Fetcher
+from rr.scheduler import FetchScheduler
+from rr.test.server import ServerTestCase
+
+
+def slow(handler):
+    """
+    Slow stand-in for a race results web site that keeps track of how many
+    requests it is serving at once.
+    """
+    server = handler.server
+    with server.lock:
+        server.in_flight += 1
+        server.max_in_flight = max(server.max_in_flight, server.in_flight)
+    time.sleep(0.05)
+    with server.lock:
+        server.in_flight -= 1
+
+    if handler.path == '/missing':
+        handler.send_body(b'nope', status=404)
+    else:
+        handler.send_body(handler.path)
+
+
+class TestFetchScheduler(ServerTestCase):
+    """
+    Test fetching a batch of URLs concurrently.
+    """
+    def routes(self):
+        return {'/': slow}
+
+    def setUp(self):
+        ServerTestCase.setUp(self)
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.fetcher = Fetcher(max_connections=8)
+
+    def tearDown(self):
+        self.fetcher.close()
+        ServerTestCase.tearDown(self)
+
+    def urls(self, n):
+        return [self.base_url + '/race{0}'.format(j) for j in range(n)]
+
+    def test_all_fetched(self):
+        """
+        Verify that every URL is fetched once and errors are reported.
+        """
+        urls = self.urls(10) + [self.base_url + '/missing']
+        scheduler = FetchScheduler(self.fetcher, jobs=4)
+        results = list(scheduler.fetch_all(urls))
+
+        self.assertEqual(sorted(url for url, _, _ in results), sorted(urls))
+        for url, response, error in results:
+            if url.endswith('/missing'):
+                self.assertEqual(error.status, 404)
+            else:
+                self.assertTrue(url.endswith(response.text))
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_per_host_limit(self):
+        """
+        Verify that no more than the per-host limit is in flight at once.
+        """
+        scheduler = FetchScheduler(self.fetcher, jobs=8, per_host=2)
+        list(scheduler.fetch_all(self.urls(12)))
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    def test_serial(self):
+        """
+        Verify that a single job fetches in order, one at a time.
+        """
+        urls = self.urls(4)
+        scheduler = FetchScheduler(self.fetcher, jobs=1)
+        results = [url for url, _, _ in scheduler.fetch_all(urls)]
+        self.assertEqual(results, urls)
+        self.assertEqual(self.server.max_in_flight, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
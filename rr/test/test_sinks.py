@@ -0,0 +1,85 @@
+import csv
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import pkg_resources
+
+import rr
+
+
+class TestSinks(unittest.TestCase):
+    """
+    Test the machine-readable outputs.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+        race_file = pkg_resources.resource_filename(
+            rr.__name__, 'test/testdata/121202SB5.HTM')
+        self.racelist_file = self.path('racelist.txt')
+        with open(self.racelist_file, 'w') as fptr:
+            fptr.write(race_file + '\n')
+
+        self.membership_file = self.path('members.csv')
+        with open(self.membership_file, 'w') as fptr:
+            fptr.write('STRAWN,MARK\n')
+            fptr.write('CARR,MICHAEL\n')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tempdir.name, name)
+
+    def run_bestrace(self, *options):
+        sys.argv = ['',
+                    '--verbose', 'critical',
+                    '--ml', self.membership_file,
+                    '--rl', self.racelist_file,
+                    '-o', self.path('results.html')]
+        sys.argv.extend(options)
+        rr.command_line.run_bestrace()
+
+    def test_jsonl(self):
+        """
+        Verify that each match is written as a JSON record.
+        """
+        self.run_bestrace('--jsonl', self.path('results.jsonl'))
+
+        with open(self.path('results.jsonl')) as fptr:
+            records = [json.loads(line) for line in fptr]
+        names = [record['line'] for record in records]
+        self.assertTrue(any('MARK STRAWN' in name for name in names))
+        self.assertEqual(records[0]['provider'], 'bestrace')
+        self.assertEqual(records[0]['race'], 'RUN with the VIKINGS 5K')
+        self.assertEqual(records[0]['columns'][0], '37')
+        self.assertTrue('MICHAEL CARR' in records[0]['columns'][1])
+
+    def test_several_sinks(self):
+        """
+        Verify that one run can feed compressed and uncompressed sinks.
+        """
+        self.run_bestrace('--jsonl', self.path('results.jsonl.gz'),
+                          '--csv', self.path('results.csv'),
+                          '--csv', self.path('results.csv.gz'))
+
+        with gzip.open(self.path('results.jsonl.gz'), 'rt') as fptr:
+            records = [json.loads(line) for line in fptr]
+        with open(self.path('results.csv'), newline='') as fptr:
+            rows = list(csv.reader(fptr))
+        with gzip.open(self.path('results.csv.gz'), 'rt', newline='') as fptr:
+            self.assertEqual(list(csv.reader(fptr)), rows)
+
+        self.assertEqual(rows[0][:5],
+                         ['provider', 'race', 'date', 'url', 'line'])
+        self.assertEqual(len(rows) - 1, len(records))
+        self.assertEqual([row[4] for row in rows[1:]],
+                         [record['line'] for record in records])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+import pkg_resources
+
+import rr
+from rr.store import ResultsStore
+
+
+class TestResultsStore(unittest.TestCase):
+    """
+    Test the SQLite database of race results.
+    """
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tempdir.name, 'results.db')
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def record(self, race, date, member, line):
+        return {'provider': 'coolrunning',
+                'race': race,
+                'date': date,
+                'url': 'http://www.coolrunning.com/' + race,
+                'line': line,
+                'columns': line.split(),
+                'member': member}
+
+    def populate(self):
+        store = ResultsStore(self.db, batch_size=2)
+        store.write(self.record('Flag Day 5K', '2014-06-14',
+                                ('STRAWN', 'MARK'), '10 MARK STRAWN 18:01'))
+        store.write(self.record('Flag Day 5K', '2014-06-14',
+                                ('CARR', 'MICHAEL'), '11 MICHAEL CARR 18:05'))
+        store.write(self.record('Turkey Trot', '2013-11-28',
+                                ('STRAWN', 'MARK'), '3 MARK STRAWN 17:40'))
+        # Seen again on a re-run.
+        store.write(self.record('Turkey Trot', '2013-11-28',
+                                ('STRAWN', 'MARK'), '3 MARK STRAWN 17:40'))
+        store.close()
+
+    def test_member(self):
+        """
+        Verify that all of a member's results are found, and only once.
+        """
+        self.populate()
+        store = ResultsStore(self.db)
+        rows = store.results_for_member('mark strawn')
+        self.assertEqual([row[2] for row in rows],
+                         ['Turkey Trot', 'Flag Day 5K'])
+
+        rows = store.results_for_member('Strawn', year=2014)
+        self.assertEqual([row[2] for row in rows], ['Flag Day 5K'])
+
+        for name in ['', '  ']:
+            with self.assertRaises(ValueError):
+                store.results_for_member(name)
+        store.close()
+
+    def test_date(self):
+        """
+        Verify that results can be found by race date.
+        """
+        self.populate()
+        store = ResultsStore(self.db)
+        rows = store.results_on(datetime.date(2014, 6, 14))
+        self.assertEqual([row[4] for row in rows], ['STRAWN', 'CARR'])
+        store.close()
+
+    def test_racelist(self):
+        """
+        Verify that a run stores its matches.
+        """
+        race_file = pkg_resources.resource_filename(
+            rr.__name__, 'test/testdata/121202SB5.HTM')
+        racelist_file = os.path.join(self.tempdir.name, 'racelist.txt')
+        with open(racelist_file, 'w') as fptr:
+            fptr.write(race_file + '\n')
+        membership_file = os.path.join(self.tempdir.name, 'members.csv')
+        with open(membership_file, 'w') as fptr:
+            fptr.write('STRAWN,MARK\n')
+
+        sys.argv = ['',
+                    '--verbose', 'critical',
+                    '--ml', membership_file,
+                    '--rl', racelist_file,
+                    '--db', self.db,
+                    '-o', os.path.join(self.tempdir.name, 'results.html')]
+        rr.command_line.run_bestrace()
+
+        store = ResultsStore(self.db)
+        rows = store.results_for_member('Mark Strawn')
+        store.close()
+        self.assertEqual(len(rows), 1)
+        self.assertTrue('MARK STRAWN' in rows[0][6])
+
+
+if __name__ == "__main__":
+    unittest.main()
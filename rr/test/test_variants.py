@@ -0,0 +1,92 @@
+import unittest
+
+from rr.variants import (VariantStats, choose_variant, document_lines,
+                         result_format, variant_format)
+
+
+class TestVariants(unittest.TestCase):
+    """
+    Test choosing between the formats of a result file.
+    """
+    def test_format(self):
+        """
+        Verify that the format is taken from the URL's extension.
+        """
+        self.assertEqual(result_format('http://x.com/a/r1.HTM'), 'html')
+        self.assertEqual(result_format('http://x.com/r1.txt?v=2'), 'txt')
+        self.assertIsNone(result_format('http://x.com/results'))
+
+    def test_choose(self):
+        """
+        Verify that text beats CSV beats HTML, and that formats we cannot
+        parse are never chosen.
+        """
+        html = ('http://x.com/r.htm', 5000)
+        text = ('http://x.com/r.txt', 1200)
+        csv = ('http://x.com/r.csv', 900)
+        pdf = ('http://x.com/r.pdf', 100)
+        self.assertEqual(choose_variant([html, csv, text, pdf]), text)
+        self.assertEqual(choose_variant([html, csv]), csv)
+        self.assertEqual(choose_variant([html, pdf]), html)
+        self.assertIsNone(choose_variant([pdf]))
+        self.assertIsNone(choose_variant([]))
+
+    def test_unknown(self):
+        """
+        Verify that variants of unknown size or format are only chosen if
+        there is nothing better.
+        """
+        unsized = ('http://x.com/a.txt', None)
+        sized = ('http://x.com/b.txt', 1200)
+        self.assertEqual(choose_variant([unsized, sized]), sized)
+        self.assertEqual(choose_variant([unsized]), unsized)
+
+        bare = ('http://x.com/results', 100)
+        html = ('http://x.com/r.htm', 5000)
+        self.assertEqual(choose_variant([bare, html]), html)
+        self.assertEqual(choose_variant([bare]), bare)
+
+        text = ('http://x.com/results?id=1', 900, 'txt')
+        self.assertEqual(choose_variant([html, bare, text]), text)
+
+    def test_variant_format(self):
+        """
+        Verify that the content type and listing key beat the URL.
+        """
+        url = 'http://x.com/download?id=1'
+        self.assertEqual(variant_format(url, 'textfile'), 'txt')
+        self.assertEqual(variant_format(url, 'webfile',
+                                        'text/csv; charset=utf-8'), 'csv')
+        self.assertEqual(variant_format('http://x.com/r.pdf', 'other'),
+                         'pdf')
+        self.assertIsNone(variant_format(url))
+        self.assertEqual(document_lines('1,JOHN,SMITH', url, 'csv'),
+                         ['1  JOHN  SMITH'])
+
+    def test_csv_lines(self):
+        """
+        Verify that CSV fields are spaced out like a text result file.
+        """
+        text = '1,"JOANNA",STEVENS,22:18\n2,JOHN,SMITH,22:19\n'
+        lines = document_lines(text, 'http://x.com/r.csv')
+        self.assertEqual(lines, ['1  JOANNA  STEVENS  22:18',
+                                 '2  JOHN  SMITH  22:19'])
+        self.assertEqual(document_lines('a\nb', 'http://x.com/r.txt'),
+                         ['a', 'b'])
+
+    def test_stats(self):
+        """
+        Verify the bytes saved per provider.
+        """
+        stats = VariantStats()
+        stats.add('compuscore', ('r.txt', 1000), ('r.htm', 5000))
+        stats.add('compuscore', ('s.htm', 5000), ('s.htm', 5000))
+        stats.add('compuscore', ('t.txt', None), ('t.htm', 5000))
+        self.assertEqual(stats.providers(), {'compuscore': (3, 2, 4000)})
+        self.assertEqual(stats.report(),
+                         ['compuscore: 3 result files, 2 from lighter '
+                          'variants, 4000 bytes saved'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Choose between the formats a race's results are published in.
+"""
+import collections
+import csv
+import os
+import threading
+import urllib.parse
+
+
+# Lighter formats first.  Plain text and CSV carry the same results as the
+# HTML without the markup around them.
+FORMAT_RANK = {'txt': 0, 'csv': 1, 'htm': 2, 'html': 2, 'shtml': 2}
+
+
+# What the keys of a race's result file listing hold, e.g. CompuScore's
+# "webfile" next to a "textfile".
+KEY_FORMATS = {'webfile': 'html', 'htmlfile': 'html', 'textfile': 'txt',
+               'txtfile': 'txt', 'csvfile': 'csv', 'pdffile': 'pdf'}
+
+CONTENT_TYPES = {'text/html': 'html', 'application/xhtml+xml': 'html',
+                 'text/plain': 'txt', 'text/csv': 'csv',
+                 'application/pdf': 'pdf'}
+
+
+def result_format(url):
+    """
+    Format of a result file going by its URL, e.g. "txt" or "html".  None
+    if the URL has no extension.
+    """
+    if url is None:
+        return None
+    path = urllib.parse.urlsplit(url).path
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if ext in ['htm', 'shtml']:
+        return 'html'
+    return ext or None
+
+
+def variant_format(url, key=None, content_type=None):
+    """
+    Format of a result file going by its Content-Type if known, then by
+    the key it is listed under, then by its URL.  None if none of them
+    tell.
+    """
+    if content_type:
+        mime_type = content_type.split(';')[0].strip().lower()
+        if mime_type in CONTENT_TYPES:
+            return CONTENT_TYPES[mime_type]
+    if key in KEY_FORMATS:
+        return KEY_FORMATS[key]
+    return result_format(url)
+
+
+def choose_variant(variants):
+    """
+    Pick the lightest of the variants of a result file.
+
+    Parameters
+    ----------
+    variants : list
+        (url, size) or (url, size, format) tuples in the order the provider
+        lists them, where the size in bytes is None if not known.  Without
+        a format, it goes by the URL.  Formats that are not understood, such
+        as PDF, are never chosen.
+
+    Returns
+    -------
+    tuple
+        The chosen variant, or None if no variant can be parsed.
+    """
+    candidates = []
+    for j, variant in enumerate(variants):
+        url, size = variant[:2]
+        fmt = variant[2] if len(variant) > 2 else result_format(url)
+        if fmt is not None and fmt not in FORMAT_RANK:
+            continue
+        # A variant of unknown format may be anything, so it is only
+        # chosen if there is nothing else.
+        rank = FORMAT_RANK.get(fmt, max(FORMAT_RANK.values()) + 1)
+        # Within a format, the smallest file whose size is known, then
+        # those of unknown size, each in the provider's own order.
+        candidates.append((rank, size is None, size or 0, j))
+    if len(candidates) == 0:
+        return None
+    return variants[min(candidates)[-1]]
+
+
+def document_lines(text, url=None, fmt=None):
+    """
+    Split a result file into lines that can be matched against the
+    membership list, whatever its format.  The format goes by the URL
+    unless given.
+
+    CSV rows have their fields joined by two spaces, as they would be in a
+    plain text result file, so that a name split over a first and a last
+    name field still matches.
+    """
+    if fmt is None:
+        fmt = result_format(url)
+    if fmt == 'csv':
+        return ['  '.join(field.strip() for field in row)
+                for row in csv.reader(text.splitlines())]
+    return text.split('\n')
+
+
+class VariantStats:
+    """
+    How much was saved by downloading lighter result file variants, per
+    provider.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers = collections.defaultdict(lambda: [0, 0, 0])
+
+    def add(self, provider, chosen, default):
+        """
+        Account for one result file.
+
+        Parameters
+        ----------
+        provider : str
+            Such as "compuscore".
+        chosen : tuple
+            (url, size) of the variant downloaded.
+        default : tuple
+            (url, size) of the variant that would otherwise have been
+            downloaded.
+        """
+        with self._lock:
+            counts = self._providers[provider]
+            counts[0] += 1
+            if chosen[0] != default[0]:
+                counts[1] += 1
+                if chosen[1] is not None and default[1] is not None:
+                    counts[2] += default[1] - chosen[1]
+
+    def providers(self):
+        """
+        Returns
+        -------
+        dict
+            (result files, lighter variants used, bytes saved) keyed by
+            provider.  Only variants with listed sizes count toward the
+            bytes saved.
+        """
+        with self._lock:
+            return {provider: tuple(counts)
+                    for provider, counts in self._providers.items()}
+
+    def report(self):
+        """
+        One line per provider, suitable for logging.
+        """
+        lines = []
+        for provider, (count, lighter, saved) in sorted(
+                self.providers().items()):
+            line = ('{0}: {1} result files, {2} from lighter variants, '
+                    '{3} bytes saved')
+            lines.append(line.format(provider, count, lighter, saved))
+        return lines
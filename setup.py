@@ -17,6 +17,10 @@ setup(
             'crrr = rr.command_line:run_coolrunning',
             'csrr = rr.command_line:run_compuscore',
             'nyrr = rr.command_line:run_nyrr',
+            'rrassemble = rr.command_line:run_assemble',
+            'rrquery = rr.command_line:run_query',
+            'rrsearch = rr.command_line:run_search',
+            'rrpack = rr.command_line:run_pack',
                             ]},
     license='LICENSE.txt',
     description='Race results parsing',